@@ -0,0 +1,59 @@
+"""
+This script checks how closely the quantized inference engines match the full-precision Keras models.
+It classifies the same sample images with Keras and with each engine and reports, per model, the share of images with the
+same top-1 class, the average overlap of the top-5 classes, the largest difference in any class probability, the time per image
+and the model size. Use real photos: synthetic images give meaningless agreement numbers. For example:
+
+    python benchmarks/engine_accuracy.py ../photos --models ResNet50 VGG16 --engines tflite-float16 tflite-int8
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIR)
+
+from engines import ENGINES, compare_with_keras
+from ingest import decode_image
+from model_registry import MODEL_NAMES
+from pipeline import iter_image_files
+from preprocessing import get_target_size, preprocess_batch
+
+def load_batch(paths, model_name):
+    """
+    Decodes and preprocesses the sample images for a model.
+
+    Parameters:
+    - paths (list): The paths of the sample images.
+    - model_name (str): The name of the model.
+
+    Returns:
+    - np.array: The preprocessed batch.
+    """
+    images = [decode_image(path, get_target_size(model_name))[0] for path in paths]
+    return preprocess_batch(images, model_name)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the quantized inference engines with the Keras models.')
+    parser.add_argument('images', help='Directory or glob pattern of sample images.')
+    parser.add_argument('--models', nargs='+', choices=MODEL_NAMES, default=MODEL_NAMES)
+    parser.add_argument('--engines', nargs='+', choices=[engine for engine in ENGINES if engine != 'keras'], default=['tflite-float16', 'tflite-int8'])
+    parser.add_argument('--limit', type=int, default=64, help='Maximum number of sample images.')
+    parser.add_argument('--top', type=int, default=5, help='Number of top predictions to compare.')
+    args = parser.parse_args()
+
+    paths = list(itertools.islice(iter_image_files(args.images), args.limit))
+    if not paths:
+        parser.error(f"No images found in {args.images}")
+    report = []
+    for model_name in args.models:
+        batch = load_batch(paths, model_name)
+        for engine in args.engines:
+            report.append(compare_with_keras(batch, model_name, engine, args.top))
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+This script benchmarks the classification pipeline for ResNet50, VGG16 and InceptionV3, with each selected inference engine.
+It generates synthetic images locally (no network or dataset needed) in several resolutions and formats, and measures
+decode, preprocess, model-load and predict time separately, for each batch size and thread count.
+Each thread count runs in its own process with `INTRA_OP_THREADS` and `INTER_OP_THREADS` set, because TensorFlow's thread pools can
+only be configured before it starts; the TFLite engines read the same setting.
+
+The report is printed (or written with --output) as JSON, with images per second, p50/p95 latency and peak RSS, for example:
+
+    python benchmarks/inference_benchmark.py --models ResNet50 VGG16 --batch-sizes 1 8 32 --threads 1 4 0 --engines keras tflite-int8
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIR)
+
+import numpy as np
+from PIL import Image
+from engines import ENGINES
+from image_processing import cache_model_key
+from ingest import decode_image
+from model_registry import MODEL_NAMES, clear_models, get_engine
+from preprocessing import allocate_batch, get_target_size, preprocess_batch
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of this process.
+
+    Returns:
+    - float: The peak RSS in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def latency_stats(samples, images_per_sample=1):
+    """
+    Summarizes a list of timings.
+
+    Parameters:
+    - samples (list): The timings, in seconds.
+    - images_per_sample (int): The number of images processed in each timing. Default is 1.
+
+    Returns:
+    - dict: The p50 and p95 latency in milliseconds, and the throughput in images per second.
+    """
+    samples = np.asarray(samples)
+    return {
+        'p50_ms': float(np.percentile(samples, 50) * 1000),
+        'p95_ms': float(np.percentile(samples, 95) * 1000),
+        'images_per_second': float(images_per_sample * len(samples) / samples.sum()),
+    }
+
+def make_images(resolutions, formats, count, seed=0):
+    """
+    Generates encoded synthetic images: smooth gradients with noise, so they compress like photos rather than like pure noise.
+
+    Parameters:
+    - resolutions (list): The (width, height) of the images.
+    - formats (list): The PIL format names, such as 'JPEG', 'PNG' or 'GIF'.
+    - count (int): The number of images per resolution and format.
+    - seed (int): The random seed. Default is 0.
+
+    Returns:
+    - dict: The encoded images (list of bytes), keyed by 'FORMAT WIDTHxHEIGHT'.
+    """
+    rng = np.random.default_rng(seed)
+    images = {}
+    for width, height in resolutions:
+        y, x = np.mgrid[0:height, 0:width]
+        for image_format in formats:
+            encoded = []
+            for _ in range(count):
+                phase = rng.random(3) * 2 * np.pi
+                channels = [np.sin(x / width * 6 + phase[c]) + np.cos(y / height * 4 + phase[c]) for c in range(3)]
+                pixels = (np.stack(channels, axis=-1) + 2) * 60 + rng.normal(0, 8, (height, width, 3))
+                image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+                if image_format == 'GIF':
+                    image = image.convert('P', palette=Image.ADAPTIVE)
+                buffer = BytesIO()
+                image.save(buffer, format=image_format)
+                encoded.append(buffer.getvalue())
+            images[f'{image_format} {width}x{height}'] = encoded
+    return images
+
+def benchmark_decode(images, target_size):
+    """
+    Measures how long decoding takes for each image set.
+
+    Parameters:
+    - images (dict): The encoded images, as returned by `make_images`.
+    - target_size (tuple): The (width, height) input size of the model.
+
+    Returns:
+    - tuple: The latency statistics per image set, and all decoded images.
+    """
+    report = {}
+    decoded = []
+    for label, encoded in images.items():
+        samples = []
+        for data in encoded:
+            start = time.perf_counter()
+            image, _ = decode_image(data, target_size)
+            samples.append(time.perf_counter() - start)
+            decoded.append(image)
+        report[label] = latency_stats(samples)
+    return report, decoded
+
+def benchmark_model(model_name, engine, images, batch_sizes, repeat):
+    """
+    Measures decode, preprocess, model-load and predict time for one model.
+
+    Parameters:
+    - model_name (str): The name of the model to benchmark.
+    - engine (str): The name of the inference engine.
+    - images (dict): The encoded images, as returned by `make_images`.
+    - batch_sizes (list): The batch sizes to measure.
+    - repeat (int): The number of timed forward passes per batch size.
+
+    Returns:
+    - dict: The measurements for the model.
+    """
+    report = {}
+    report['decode'], decoded = benchmark_decode(images, get_target_size(model_name))
+
+    clear_models()
+    start = time.perf_counter()
+    model = get_engine(model_name, engine)
+    report['model_load_s'] = time.perf_counter() - start
+    report['model_size_mb'] = model.size_bytes / 1024 / 1024
+
+    report['batches'] = {}
+    for batch_size in batch_sizes:
+        batch_images = [decoded[i % len(decoded)] for i in range(batch_size)]
+        buffer = allocate_batch(batch_size, model_name)
+        preprocess_samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            batch = preprocess_batch(batch_images, model_name, out=buffer)
+            preprocess_samples.append(time.perf_counter() - start)
+        # The first forward pass at a new batch size traces the model, so it is not timed
+        model.predict(batch)
+        predict_samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            model.predict(batch)
+            predict_samples.append(time.perf_counter() - start)
+        report['batches'][str(batch_size)] = {
+            'preprocess': latency_stats(preprocess_samples, batch_size),
+            'predict': latency_stats(predict_samples, batch_size),
+        }
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+def run_worker(args):
+    """
+    Runs the benchmark for one thread count in this process.
+
+    Parameters:
+    - args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+    - dict: The measurements for each model, keyed by the model name (followed by the engine name for non-Keras engines).
+    """
+    # The thread count is applied by the engines, from the environment `main` starts this process with
+    resolutions = [tuple(int(v) for v in resolution.split('x')) for resolution in args.resolutions]
+    images = make_images(resolutions, args.formats, args.images_per_set)
+    return {
+        cache_model_key(model_name, engine): benchmark_model(model_name, engine, images, args.batch_sizes, args.repeat)
+        for model_name in args.models for engine in args.engines
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark decode, preprocess, model-load and predict time.')
+    parser.add_argument('--models', nargs='+', choices=MODEL_NAMES, default=MODEL_NAMES)
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=['keras'])
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 8, 32])
+    parser.add_argument('--threads', nargs='+', type=int, default=[0], help='Intra/inter-op thread counts of TensorFlow and the TFLite interpreter; 0 uses their default.')
+    parser.add_argument('--resolutions', nargs='+', default=['640x480', '1920x1080', '4000x3000'])
+    parser.add_argument('--formats', nargs='+', default=['JPEG', 'PNG', 'GIF'])
+    parser.add_argument('--images-per-set', type=int, default=4, help='Number of synthetic images per resolution and format.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs per batch size.')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of printing it.')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return
+
+    report = {'python': sys.version.split()[0], 'cpu_count': os.cpu_count(), 'runs': {}}
+    for threads in args.threads:
+        command = [sys.executable, os.path.abspath(__file__), '--worker', '--threads', str(threads),
+                   '--models', *args.models, '--engines', *args.engines, '--batch-sizes', *map(str, args.batch_sizes),
+                   '--resolutions', *args.resolutions, '--formats', *args.formats,
+                   '--images-per-set', str(args.images_per_set), '--repeat', str(args.repeat)]
+        # Both engine families read their thread count from the environment when they are imported
+        env = {**os.environ, 'INTRA_OP_THREADS': str(threads), 'INTER_OP_THREADS': str(threads)}
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True, env=env).stdout
+        report['runs'][f'threads={threads}'] = json.loads(output.strip().splitlines()[-1])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+This script measures how long the application takes to start.
+Each measurement runs in a fresh Python process, so nothing is cached in memory between runs:
+- app_import: importing the `main` module, which is what Streamlit does before it can draw the sidebar.
+- tensorflow_import: importing TensorFlow and the Keras applications, which now happens on the first classification or in the background.
+- server_ready (with --server): starting `streamlit run src/main.py` until its health endpoint answers.
+
+The results are printed as JSON, for example:
+
+    python benchmarks/startup_time.py --repeat 5 --server
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+def time_import(statement):
+    """
+    Runs an import statement in a fresh Python process and measures how long it takes.
+
+    Parameters:
+    - statement (str): The Python statement to time.
+
+    Returns:
+    - float: The time taken by the statement, in seconds.
+    """
+    code = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, '-c', code], cwd=SRC_DIR, check=True, capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+def free_port():
+    """
+    Returns a free local TCP port.
+
+    Returns:
+    - int: The port number.
+    """
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def time_server_ready(timeout=120):
+    """
+    Starts the Streamlit app and measures how long it takes until its health endpoint answers.
+
+    Parameters:
+    - timeout (float): The maximum time to wait, in seconds. Default is 120.
+
+    Returns:
+    - float: The time until the server was ready, in seconds.
+    """
+    port = free_port()
+    command = [sys.executable, '-m', 'streamlit', 'run', 'main.py', '--server.headless', 'true', '--server.port', str(port)]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=SRC_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/_stcore/health', timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.05)
+        raise TimeoutError(f"Streamlit did not become ready within {timeout} seconds")
+    finally:
+        process.terminate()
+        process.wait()
+
+def summarize(samples):
+    """
+    Summarizes a list of timings.
+
+    Parameters:
+    - samples (list): The timings, in seconds.
+
+    Returns:
+    - dict: The minimum, median and maximum timing.
+    """
+    return {'min': min(samples), 'median': statistics.median(samples), 'max': max(samples), 'runs': len(samples)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the startup time of the image classification app.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per measurement.')
+    parser.add_argument('--server', action='store_true', help='Also measure the time until the Streamlit server is ready.')
+    parser.add_argument('--skip-tensorflow', action='store_true', help='Do not measure the TensorFlow import.')
+    args = parser.parse_args()
+
+    report = {'app_import': summarize([time_import('import main') for _ in range(args.repeat)])}
+    if not args.skip_tensorflow:
+        report['tensorflow_import'] = summarize([time_import('from tensorflow.keras import applications') for _ in range(args.repeat)])
+    if args.server:
+        report['server_ready'] = summarize([time_server_ready() for _ in range(args.repeat)])
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,90 @@
 This module manages the API usage for fetching images from Unsplash and Pexels.
 It contains functions for checking the API usage, resetting the API usage count, and loading the API access key from a configuration file.
 The `check_api_usage` function ensures that the application does not exceed the API usage limit for the selected site.
+Usage is counted in memory against blocks of quota reserved from a SQLite file, so the file is only touched once per block,
+and concurrent sessions and fetch workers share one budget per site over a rolling time window.
+The rate-limit headers returned by the sites are also taken into account through `update_api_usage_from_headers`.
 """
 
 import json
 import os
+import sqlite3
+import threading
+import time
 
-API_USAGE_FILE = 'api_usage.txt'
+API_USAGE_FILE = 'api_usage.sqlite3'
 API_USAGE_LIMIT = int(os.getenv('API_USAGE_LIMIT', 500))
+API_USAGE_WINDOW = int(os.getenv('API_USAGE_WINDOW', 3600))
+API_QUOTA_BLOCK_SIZE = int(os.getenv('API_QUOTA_BLOCK_SIZE', 10))
+SITE_USAGE_LIMITS = {
+    'Unsplash': int(os.getenv('UNSPLASH_USAGE_LIMIT', API_USAGE_LIMIT)),
+    'Pexels': int(os.getenv('PEXELS_USAGE_LIMIT', API_USAGE_LIMIT)),
+}
+
+_reserved = {}  # Quota reserved by this process but not used yet, per site
+_site_limits = {}  # (remaining, reset time) reported by each site's rate-limit headers
+_lock = threading.Lock()
+
+def _connect():
+    """
+    Opens the API usage file, creating it if it does not exist.
+
+    Returns:
+    - sqlite3.Connection: The connection to the API usage file.
+    """
+    connection = sqlite3.connect(API_USAGE_FILE, timeout=30, isolation_level=None)
+    connection.execute('CREATE TABLE IF NOT EXISTS reservations (site TEXT, reserved_at REAL, amount INTEGER)')
+    return connection
+
+def _reserve_block(site):
+    """
+    Reserves the next block of quota for a site, within the limit for the rolling time window.
+    The reservation runs in an exclusive transaction, so concurrent processes never reserve the same quota.
+
+    Parameters:
+    - site (str): The site to reserve quota for.
+
+    Returns:
+    - int: The number of calls reserved, 0 if the limit has been reached.
+    """
+    now = time.time()
+    connection = _connect()
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        connection.execute('DELETE FROM reservations WHERE reserved_at < ?', (now - API_USAGE_WINDOW,))
+        used = connection.execute('SELECT COALESCE(SUM(amount), 0) FROM reservations WHERE site = ?', (site,)).fetchone()[0]
+        amount = min(API_QUOTA_BLOCK_SIZE, SITE_USAGE_LIMITS.get(site, API_USAGE_LIMIT) - used)
+        if amount > 0:
+            connection.execute('INSERT INTO reservations VALUES (?, ?, ?)', (site, now, amount))
+        connection.execute('COMMIT')
+        return max(amount, 0)
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+
+def _site_limit_reached(site):
+    """
+    Checks whether the site's own rate-limit headers say no calls are left.
+
+    Parameters:
+    - site (str): The site to check.
+
+    Returns:
+    - bool: True if the site reported no remaining calls and the limit has not been reset yet.
+    """
+    remaining, reset_at = _site_limits.get(site, (None, None))
+    if remaining is None or remaining > 0:
+        return False
+    if reset_at is not None and time.time() >= reset_at:
+        del _site_limits[site]
+        return False
+    return True
 
 def check_api_usage(site):
     """
-    Checks the API usage for the specified site.
+    Checks the API usage for the specified site and counts one call against it.
 
     Parameters:
     - site (str): The site to check API usage for ('Unsplash' or 'Pexels').
@@ -20,31 +93,62 @@ def check_api_usage(site):
     Returns:
     - bool: True if the API usage limit has not been reached, False otherwise.
     """
-    # Implementation depends on how API usage is tracked
-    if not os.path.exists(API_USAGE_FILE):
-        with open(API_USAGE_FILE, 'w') as f:
-            f.write(json.dumps({site: 0}))
-    with open(API_USAGE_FILE, 'r') as f:
-        usage = json.loads(f.read().strip())
-    if usage.get(site, 0) >= API_USAGE_LIMIT:
-        print(f"API usage limit reached for {site}. Please wait or reset the API usage.")
-        return False
-    usage[site] = usage.get(site, 0) + 1
-    with open(API_USAGE_FILE, 'w') as f:
-        f.write(json.dumps(usage))
-    return True
+    with _lock:
+        if _site_limit_reached(site):
+            print(f"{site} reports that its rate limit has been reached. Please wait before fetching more images.")
+            return False
+        if _reserved.get(site, 0) <= 0:
+            _reserved[site] = _reserve_block(site)
+        if _reserved[site] <= 0:
+            print(f"API usage limit reached for {site}. Please wait or reset the API usage.")
+            return False
+        _reserved[site] -= 1
+        return True
 
-def reset_api_usage_count():
+def update_api_usage_from_headers(site, headers):
     """
-    Resets the API usage count for the specified site.
+    Records the rate limit reported in a site's response headers.
+    Both sites send 'X-Ratelimit-Remaining'; Pexels also sends 'X-Ratelimit-Reset' as a UNIX timestamp.
+    Without a reset time, the limit is assumed to reset after `API_USAGE_WINDOW` seconds.
 
     Parameters:
-    - site (str): The site to reset API usage count for ('Unsplash' or 'Pexels').
+    - site (str): The site the response came from ('Unsplash' or 'Pexels').
+    - headers (Mapping): The response headers.
+    """
+    try:
+        remaining = int(headers['X-Ratelimit-Remaining'])
+    except (KeyError, TypeError, ValueError):
+        return
+    try:
+        reset_at = float(headers['X-Ratelimit-Reset'])
+    except (KeyError, TypeError, ValueError):
+        reset_at = time.time() + API_USAGE_WINDOW
+    with _lock:
+        _site_limits[site] = (remaining, reset_at)
+        # Never hand out more calls than the site says are left
+        if site in _reserved:
+            _reserved[site] = min(_reserved[site], remaining)
+
+def reset_api_usage_count(site=None):
     """
-    # Implementation depends on how API usage is managed
+    Resets the API usage count for the specified site.
 
-    with open(API_USAGE_FILE, 'w') as f:
-        f.write('0')
+    Parameters:
+    - site (str, optional): The site to reset API usage count for ('Unsplash' or 'Pexels'). Defaults to None, which resets all sites.
+    """
+    with _lock:
+        connection = _connect()
+        try:
+            if site is None:
+                connection.execute('DELETE FROM reservations')
+                _reserved.clear()
+                _site_limits.clear()
+            else:
+                connection.execute('DELETE FROM reservations WHERE site = ?', (site,))
+                _reserved.pop(site, None)
+                _site_limits.pop(site, None)
+        finally:
+            connection.close()
     print("API usage count has been reset.")
 
 def load_api_access_key(site):
@@ -0,0 +1,138 @@
+"""
+This module detects near-duplicate images, such as re-encoded or resized copies of the same photo, before they are classified.
+Each image gets a 64-bit difference hash (dHash) while it is decoded: the image is reduced to 9x8 grayscale pixels, and each bit
+records whether a pixel is brighter than its right neighbour. Copies of the same photo have hashes that differ in a few bits.
+The hashes seen during a run are kept in a BK-tree, which finds every hash within a Hamming distance without comparing against
+all of them. Images with little horizontal detail, such as flat colours or smooth gradients, hash to all zeros or all ones (or a
+few bits from them) and would all look alike; they are never treated as duplicates. `DEDUP_MODE` decides what happens to an image within `DEDUP_DISTANCE` bits of an earlier one:
+- 'off': nothing; every image is classified. This is the default.
+- 'skip': the image is not classified and no result is stored for it.
+- 'link': the image gets the results of the earlier image without a forward pass, and its own result row.
+"""
+
+import os
+from PIL import Image
+
+DEDUP_MODES = ['off', 'skip', 'link']
+DEDUP_MODE = os.getenv('DEDUP_MODE', 'off')
+DEDUP_DISTANCE = int(os.getenv('DEDUP_DISTANCE', 4))
+HASH_SIZE = 8
+
+def dhash(image, hash_size=HASH_SIZE):
+    """
+    Computes the difference hash of an image.
+
+    Parameters:
+    - image (PIL.Image): The decoded image.
+    - hash_size (int): The number of rows and of comparisons per row. Default is 8, for a 64-bit hash.
+
+    Returns:
+    - int: The hash.
+    """
+    pixels = list(image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            left = pixels[row * (hash_size + 1) + column]
+            value = value << 1 | (left > pixels[row * (hash_size + 1) + column + 1])
+    return value
+
+def is_distinctive(image_hash, distance=DEDUP_DISTANCE, hash_size=HASH_SIZE):
+    """
+    Returns whether a hash can be used to find duplicates. Flat and evenly graded images hash to all zeros or all ones, and
+    nearly flat ones to a few bits away from them, so they would match each other within the duplicate distance.
+
+    Parameters:
+    - image_hash (int): The hash.
+    - distance (int): The largest Hamming distance at which images are duplicates. Default is `DEDUP_DISTANCE`.
+    - hash_size (int): The hash size the hash was computed with. Default is 8.
+
+    Returns:
+    - bool: False for the hashes within `distance` bits of all zeros or all ones.
+    """
+    ones = bin(image_hash).count('1')
+    return distance < ones < hash_size * hash_size - distance
+
+def hamming_distance(a, b):
+    """
+    Returns the number of bits that differ between two hashes.
+
+    Parameters:
+    - a (int): The first hash.
+    - b (int): The second hash.
+
+    Returns:
+    - int: The Hamming distance.
+    """
+    return bin(a ^ b).count('1')
+
+class BKTree:
+    """
+    A BK-tree of hashes under the Hamming distance. Each child of a node is keyed by its distance to the node,
+    so a search only descends into the children whose key is within the search distance of the query's distance to the node.
+    """
+
+    def __init__(self):
+        # Each node is [hash, value, {distance: child node}]
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, image_hash, value):
+        """
+        Adds a hash to the tree.
+
+        Parameters:
+        - image_hash (int): The hash.
+        - value: The value returned by `search` for this hash, such as the image's name.
+        """
+        self._size += 1
+        node = [image_hash, value, {}]
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming_distance(image_hash, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, image_hash, max_distance):
+        """
+        Finds the hashes within a Hamming distance of the given hash.
+
+        Parameters:
+        - image_hash (int): The hash to search for.
+        - max_distance (int): The largest distance to return.
+
+        Returns:
+        - list: (distance, value) tuples, closest first.
+        """
+        matches = []
+        pending = [self._root] if self._root is not None else []
+        while pending:
+            node_hash, value, children = pending.pop()
+            distance = hamming_distance(image_hash, node_hash)
+            if distance <= max_distance:
+                matches.append((distance, value))
+            pending.extend(child for key, child in children.items() if distance - max_distance <= key <= distance + max_distance)
+        return sorted(matches, key=lambda match: match[0])
+
+    def nearest(self, image_hash, max_distance):
+        """
+        Finds the closest hash within a Hamming distance of the given hash.
+
+        Parameters:
+        - image_hash (int): The hash to search for.
+        - max_distance (int): The largest distance to accept.
+
+        Returns:
+        - The value of the closest hash, or None if there is none within the distance.
+        """
+        matches = self.search(image_hash, max_distance)
+        return matches[0][1] if matches else None
@@ -3,10 +3,13 @@ This module contains functions for displaying the application's UI, including th
 It provides functionality to display the uploaded image and the classification results in a user-friendly format.
 """
 
+import os
 import pandas as pd
 import streamlit as st
 from PIL import Image
 
+RESULTS_PAGE_SIZE = int(os.getenv('RESULTS_PAGE_SIZE', 10))
+
 def display_app(image_path, results):
     """
     Displays the uploaded image and its classification results in the Streamlit app.
@@ -35,4 +38,67 @@ def display_progress_bar(num_steps, current_step):
     Returns:
     - progress_bar: The progress bar object.
     """
-    progress_bar = st.progress(0)
\ No newline at end of file
+    progress_bar = st.progress(0)
+
+def display_classification(thumbnail, classification_data, caption=None):
+    """
+    Displays an image thumbnail next to its classification results in the Streamlit app.
+
+    Parameters:
+    - thumbnail (PIL.Image or bytes): The thumbnail of the classified image, or its encoded content.
+    - classification_data (pd.DataFrame): The DataFrame containing the classification results.
+    - caption (str, optional): The caption shown under the image. Defaults to None.
+    """
+    col1, col2 = st.columns(2)
+    col1.image(thumbnail, caption=caption, use_column_width=True)
+    col2.markdown("###### Classification Data")
+    col2.dataframe(classification_data)
+
+def page_selector(count, key, page_size=RESULTS_PAGE_SIZE):
+    """
+    Displays a page selector when the results do not fit on one page.
+
+    Parameters:
+    - count (int): The number of results.
+    - key (str): The key of the page selector, unique within the app.
+    - page_size (int): The number of results per page. Default is `RESULTS_PAGE_SIZE`.
+
+    Returns:
+    - int: The index of the first result on the selected page.
+    """
+    pages = max((count + page_size - 1) // page_size, 1)
+    page = st.number_input(f'Page (of {pages})', min_value=1, max_value=pages, value=1, key=key) if pages > 1 else 1
+    return (min(page, pages) - 1) * page_size
+
+def display_job(job, results_count, load_results, page_size=RESULTS_PAGE_SIZE):
+    """
+    Displays the progress of a background job and one page of the results it has produced so far.
+
+    Parameters:
+    - job (dict): The job, as returned by `jobs.get_job`.
+    - results_count (int): The number of results the job has produced so far.
+    - load_results (callable): Called as load_results(start, limit) to load one page of results.
+    - page_size (int): The number of images per page. Default is `RESULTS_PAGE_SIZE`.
+
+    Returns:
+    - bool: True if the user asked to cancel the job.
+    """
+    job_id = job['job_id']
+    params = job['params']
+    if job['kind'] == 'classify':
+        title = f"Classify {len(params['sources'])} uploaded images with {params['model_name']}"
+    else:
+        title = f"Fetch {' and '.join(f'{count} from {site}' for site, count in params['site_counts'])} with {params['model_name']}"
+    st.markdown(f"#### {title}")
+    total = job['total']
+    status = f"{job['status'].capitalize()}: {job['completed']}" + (f" of {total}" if total else "") + " images processed"
+    if job['status'] in ('queued', 'running', 'cancelling'):
+        st.progress(min(job['completed'] / total, 1.0) if total else 0.0, text=status)
+        cancel = job['status'] != 'cancelling' and st.button('Cancel', key=f'cancel_{job_id}')
+    else:
+        (st.error if job['status'] == 'failed' else st.success)(status + (f" ({job['error']})" if job['error'] else ""))
+        cancel = False
+    start = page_selector(results_count, f'job_{job_id}_page', page_size)
+    for name, thumbnail, classification_data in load_results(start, page_size):
+        display_classification(thumbnail, classification_data, caption=name)
+    return cancel
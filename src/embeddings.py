@@ -0,0 +1,349 @@
+"""
+This module keeps the pooled feature vector of each image classified in embedding mode and finds similar images among them.
+The vectors are L2-normalized and stored, as float16, in one file per model in `EMBEDDINGS_DIR`. The file is memory-mapped
+for searching, so neither the archive nor the model has to be loaded to answer a query. The content hash and name of each row
+are kept in `EMBEDDINGS_DIR/embeddings.sqlite3`. The index grows as each batch is classified.
+Several processes can add to the same index: each batch reserves its row numbers in a SQLite write transaction, writes its vectors
+at the matching offset of the file, and then commits. Vectors left behind by a writer that failed before committing are not
+referenced by any row, and are overwritten by the next batch.
+Two searches are available:
+- exact: the cosine similarity with every stored vector, computed in chunks of `EMBEDDING_SEARCH_CHUNK` rows.
+- approximate: random-hyperplane locality-sensitive hashing. Each vector gets an `EMBEDDING_LSH_BITS`-bit signature, and only
+  the rows whose signature differs from the query's in at most `EMBEDDING_LSH_RADIUS` bits are scored. The signatures are computed
+  as vectors are added and kept in a file next to the vectors, so a search in a new process does not read every vector first.
+  It falls back to the exact search when fewer candidates than requested are found.
+"""
+
+import os
+import sqlite3
+import threading
+import numpy as np
+from file_operations import output_dir
+from ingest import ingest_image
+from model_registry import get_engine
+from preprocessing import get_target_size, preprocess_batch
+
+EMBEDDINGS_ENABLED = os.getenv('EMBEDDINGS_ENABLED', '0') == '1'
+EMBEDDINGS_DIR = os.path.join(output_dir, 'embeddings')
+EMBEDDINGS_FILE = os.path.join(EMBEDDINGS_DIR, 'embeddings.sqlite3')
+EMBEDDING_SEARCH_CHUNK = int(os.getenv('EMBEDDING_SEARCH_CHUNK', 65536))
+EMBEDDING_LSH_BITS = min(int(os.getenv('EMBEDDING_LSH_BITS', 16)), 64)
+EMBEDDING_LSH_RADIUS = int(os.getenv('EMBEDDING_LSH_RADIUS', 2))
+# Number of set bits in each byte value, to count differing signature bits without a Python loop
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def normalize(vectors):
+    """
+    Scales vectors to unit length, so their dot product is their cosine similarity.
+
+    Parameters:
+    - vectors (np.array): The vectors, one per row.
+
+    Returns:
+    - np.array: The normalized float32 vectors.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _write_at(path, offset, array):
+    """
+    Writes an array's bytes at an offset of a file, creating the file if needed.
+
+    Parameters:
+    - path (str): The path of the file.
+    - offset (int): The position to write at, in bytes.
+    - array (np.array): The values to write.
+    """
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+        f.seek(offset)
+        f.write(array.tobytes())
+
+class EmbeddingIndex:
+    """
+    The stored feature vectors of one model, with exact and approximate nearest-neighbour search.
+    """
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.vectors_path = os.path.join(EMBEDDINGS_DIR, f'{model_name}.f16')
+        # The signatures depend on the number of bits, so each setting has its own file
+        self.signatures_path = os.path.join(EMBEDDINGS_DIR, f'{model_name}.lsh{EMBEDDING_LSH_BITS}')
+        self._lock = threading.RLock()
+        self._connection = None
+        self._count = 0
+        self._dimensions = None
+        self._vectors = None
+        self._planes = None
+        self._signatures = None
+        self._load()
+
+    def _load(self):
+        """
+        Opens the index.
+        """
+        os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+        self._connection = sqlite3.connect(EMBEDDINGS_FILE, timeout=30, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings (model TEXT, row INTEGER, digest TEXT, name TEXT, PRIMARY KEY (model, row))'
+        )
+        self._connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS embeddings_digest ON embeddings (model, digest)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS embedding_models (model TEXT PRIMARY KEY, dimensions INTEGER)')
+        self._refresh()
+
+    def _refresh(self):
+        """
+        Reads the number of rows and the vector size, which other processes may have changed.
+        """
+        row = self._connection.execute('SELECT dimensions FROM embedding_models WHERE model = ?', (self.model_name,)).fetchone()
+        self._dimensions = row[0] if row else None
+        self._count = self._next_row()
+
+    def _next_row(self):
+        """
+        Returns the number of the next row to add. Rows are numbered from 0 without gaps, so this is also the number of rows.
+        """
+        return self._connection.execute('SELECT COALESCE(MAX(row) + 1, 0) FROM embeddings WHERE model = ?', (self.model_name,)).fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return self._count
+
+    def missing(self, digests):
+        """
+        Returns the images that are not in the index yet.
+
+        Parameters:
+        - digests (list): The content hashes of the images.
+
+        Returns:
+        - set: The content hashes that are not in the index.
+        """
+        digests = set(digests)
+        found = set()
+        with self._lock:
+            chunk_digests = list(digests)
+            # Stay below SQLite's limit on the number of query parameters
+            for start in range(0, len(chunk_digests), 500):
+                chunk = chunk_digests[start:start + 500]
+                found.update(row[0] for row in self._connection.execute(
+                    f'SELECT digest FROM embeddings WHERE model = ? AND digest IN ({",".join("?" * len(chunk))})',
+                    [self.model_name, *chunk]
+                ))
+        return digests - found
+
+    def add(self, digests, names, vectors):
+        """
+        Adds the feature vectors of a batch of images. Images that are already in the index are skipped.
+
+        Parameters:
+        - digests (list): The content hashes of the images.
+        - names (list): The names of the images (entries may be None).
+        - vectors (np.array): The feature vectors, one row per image.
+        """
+        vectors = normalize(vectors)
+        with self._lock, self._connection:
+            # Holding the write lock keeps other processes from taking the same rows or adding the same images
+            self._connection.execute('BEGIN IMMEDIATE')
+            missing = self.missing(digests)
+            rows = []
+            for index, digest in enumerate(digests):
+                if digest in missing:
+                    missing.discard(digest)
+                    rows.append(index)
+            if not rows:
+                return
+            self._refresh()
+            if self._dimensions is None:
+                self._dimensions = vectors.shape[1]
+                self._connection.execute('INSERT INTO embedding_models VALUES (?, ?)', (self.model_name, self._dimensions))
+            start = self._count
+            new_vectors = vectors[rows].astype(np.float16)
+            # The vectors and signatures are written before their rows are committed, so a crash leaves at most unreferenced ones behind
+            _write_at(self.vectors_path, start * self._dimensions * 2, new_vectors)
+            if start:
+                # Signatures missing from an index created before they were stored are filled in first
+                self._all_signatures(self._matrix())
+            _write_at(self.signatures_path, start * 8, self._signature(new_vectors))
+            self._connection.executemany(
+                'INSERT INTO embeddings VALUES (?, ?, ?, ?)',
+                [(self.model_name, start + offset, digests[index], names[index]) for offset, index in enumerate(rows)]
+            )
+
+    def _matrix(self):
+        """
+        Returns the stored vectors as a read-only memory map, reopened when rows have been added by any process.
+
+        Returns:
+        - np.memmap: The vectors of shape (count, dimensions), or None if the index is empty.
+        """
+        self._refresh()
+        if not self._count:
+            return None
+        if self._vectors is None or len(self._vectors) != self._count:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float16, mode='r', shape=(self._count, self._dimensions))
+        return self._vectors
+
+    def vector(self, digest):
+        """
+        Returns the stored feature vector of an image.
+
+        Parameters:
+        - digest (str): The content hash of the image.
+
+        Returns:
+        - np.array: The normalized vector, or None if the image is not in the index.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT row FROM embeddings WHERE model = ? AND digest = ?', (self.model_name, digest)).fetchone()
+            return None if row is None else np.asarray(self._matrix()[row[0]], dtype=np.float32)
+
+    def _signature(self, vectors):
+        """
+        Computes the LSH signatures of vectors: one bit per random hyperplane, set when the vector lies on its positive side.
+
+        Parameters:
+        - vectors (np.array): The vectors, one per row.
+
+        Returns:
+        - np.array: The signatures (uint64), one per row.
+        """
+        if self._planes is None:
+            # A fixed seed keeps the signatures comparable across processes
+            self._planes = np.random.default_rng(0).standard_normal((self._dimensions, EMBEDDING_LSH_BITS)).astype(np.float32)
+        bits = (np.asarray(vectors, dtype=np.float32) @ self._planes) > 0
+        return bits.astype(np.uint64) @ (np.uint64(1) << np.arange(EMBEDDING_LSH_BITS, dtype=np.uint64))
+
+    def _all_signatures(self, matrix):
+        """
+        Returns the signatures of the stored vectors as a read-only memory map. Signatures missing from the file, for example
+        those of an index created before signatures were stored, are computed and stored first.
+
+        Parameters:
+        - matrix (np.memmap): The stored vectors, as returned by `_matrix`.
+
+        Returns:
+        - np.memmap: The signatures (uint64), one per row of the matrix.
+        """
+        count = len(matrix)
+        stored = os.path.getsize(self.signatures_path) // 8 if os.path.exists(self.signatures_path) else 0
+        for start in range(stored, count, EMBEDDING_SEARCH_CHUNK):
+            _write_at(self.signatures_path, start * 8, self._signature(matrix[start:start + EMBEDDING_SEARCH_CHUNK]))
+        if self._signatures is None or len(self._signatures) != count:
+            self._signatures = np.memmap(self.signatures_path, dtype=np.uint64, mode='r', shape=(count,))
+        return self._signatures
+
+    def _rows(self, rows):
+        """
+        Returns the content hash and name of rows.
+
+        Parameters:
+        - rows (list): The row numbers.
+
+        Returns:
+        - dict: The (digest, name) of each row, keyed by row number.
+        """
+        found = {}
+        for start in range(0, len(rows), 500):
+            chunk = [int(row) for row in rows[start:start + 500]]
+            found.update((row, (digest, name)) for row, digest, name in self._connection.execute(
+                f'SELECT row, digest, name FROM embeddings WHERE model = ? AND row IN ({",".join("?" * len(chunk))})',
+                [self.model_name, *chunk]
+            ))
+        return found
+
+    def search(self, query, k=10, approximate=False, exclude=None):
+        """
+        Finds the stored images most similar to a feature vector.
+
+        Parameters:
+        - query (np.array): The feature vector to search for.
+        - k (int): The number of images to return. Default is 10.
+        - approximate (bool): Whether to use the LSH index instead of scoring every stored vector. Default is False.
+        - exclude (str, optional): The content hash of an image to leave out, such as the query image itself.
+
+        Returns:
+        - list: (digest, name, cosine similarity) tuples, most similar first.
+        """
+        query = normalize([query])[0]
+        with self._lock:
+            matrix = self._matrix()
+            if matrix is None:
+                return []
+            wanted = k + (exclude is not None)
+            candidates = None
+            if approximate:
+                distance = self._all_signatures(matrix) ^ self._signature(query[None])[0]
+                distance = _POPCOUNT[distance.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+                candidates = np.flatnonzero(distance <= EMBEDDING_LSH_RADIUS)
+                if len(candidates) < wanted:
+                    candidates = None
+            if candidates is not None:
+                scores = np.asarray(matrix[candidates], dtype=np.float32) @ query
+                rows = candidates
+            else:
+                scores = np.concatenate([
+                    np.asarray(matrix[start:start + EMBEDDING_SEARCH_CHUNK], dtype=np.float32) @ query
+                    for start in range(0, len(matrix), EMBEDDING_SEARCH_CHUNK)
+                ])
+                rows = np.arange(len(matrix))
+            top = min(wanted, len(scores))
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+            details = self._rows(rows[best].tolist())
+        results = [(*details[int(rows[index])], float(scores[index])) for index in best]
+        return [result for result in results if result[0] != exclude][:k]
+
+def get_embedding_index(model_name):
+    """
+    Returns the embedding index of a model, opening it on first use. The index is shared by all threads of the process.
+
+    Parameters:
+    - model_name (str): The name of the model.
+
+    Returns:
+    - EmbeddingIndex: The index.
+    """
+    with _indexes_lock:
+        if model_name not in _indexes:
+            _indexes[model_name] = EmbeddingIndex(model_name)
+        return _indexes[model_name]
+
+def embed_image(source, model_name):
+    """
+    Computes the feature vector of an image, reusing the stored vector if the image is already in the index.
+
+    Parameters:
+    - source (bytes, str or file-like): The encoded image content, a file path, or a readable buffer.
+    - model_name (str): The name of the model.
+
+    Returns:
+    - tuple: The content hash of the image and its normalized feature vector.
+    """
+    digest, image, _ = ingest_image(source, get_target_size(model_name))
+    vector = get_embedding_index(model_name).vector(digest)
+    if vector is None:
+        _, vectors = get_engine(model_name, 'keras').predict(preprocess_batch([image], model_name), features=True)
+        vector = normalize(vectors)[0]
+    return digest, vector
+
+def find_similar(source, model_name, k=10, approximate=False):
+    """
+    Finds the images most similar to the given image among all images embedded with the model.
+
+    Parameters:
+    - source (bytes, str or file-like): The encoded image content, a file path, or a readable buffer.
+    - model_name (str): The name of the model.
+    - k (int): The number of images to return. Default is 10.
+    - approximate (bool): Whether to use the LSH index. Default is False.
+
+    Returns:
+    - list: (digest, name, cosine similarity) tuples, most similar first, without the image itself.
+    """
+    digest, vector = embed_image(source, model_name)
+    return get_embedding_index(model_name).search(vector, k, approximate, exclude=digest)
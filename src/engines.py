@@ -0,0 +1,357 @@
+"""
+This module provides the inference engines that run the pre-trained models on a preprocessed batch.
+Every engine has the same interface: `predict(batch)` returns the class probabilities, and `size_bytes` estimates its memory footprint.
+- 'keras' runs the full-precision Keras model. This is the default.
+- 'tflite-float16' and 'tflite-int8' run a TensorFlow Lite conversion of the model, with float16 weights or int8 quantization.
+  The conversion runs once per model and is cached in `ENGINE_CACHE_DIR`, so later runs load the small .tflite file
+  without building the Keras model. With `ENGINE_CALIBRATION_DIR` set, int8 models are calibrated on those images
+  (full integer quantization); otherwise only the weights are quantized (dynamic range quantization).
+- 'remote' sends the batch to the inference server at `INFERENCE_SERVER_URL` (see `inference_server`), so several processes
+  share the server's warm models and their requests are batched together.
+The Keras engine can also return each image's pooled feature vector (the output of the layer in `FEATURE_LAYERS`) from the same forward pass.
+The TensorFlow thread pools are configured with `INTRA_OP_THREADS` and `INTER_OP_THREADS`, and the TFLite interpreter
+uses `INTRA_OP_THREADS` threads. If the `tflite_runtime` package is installed, it is used to run converted models.
+"""
+
+import os
+import threading
+import time
+from io import BytesIO
+import numpy as np
+from ingest import decode_image
+from prediction_cache import CACHE_DIR
+from preprocessing import PREPROCESSING_VERSION, get_target_size, preprocess_batch
+
+ENGINES = ['keras', 'tflite-float16', 'tflite-int8', 'remote']
+# The pooled feature layer of each model, used for embeddings
+FEATURE_LAYERS = {'ResNet50': 'avg_pool', 'VGG16': 'fc2', 'InceptionV3': 'avg_pool'}
+INFERENCE_ENGINE = os.getenv('INFERENCE_ENGINE', 'keras')
+ENGINE_CACHE_DIR = os.path.join(CACHE_DIR, 'engines')
+ENGINE_CALIBRATION_DIR = os.getenv('ENGINE_CALIBRATION_DIR') or None
+ENGINE_CALIBRATION_IMAGES = int(os.getenv('ENGINE_CALIBRATION_IMAGES', 100))
+INTRA_OP_THREADS = int(os.getenv('INTRA_OP_THREADS', 0))
+INTER_OP_THREADS = int(os.getenv('INTER_OP_THREADS', 0))
+INFERENCE_SERVER_URL = os.getenv('INFERENCE_SERVER_URL', 'http://127.0.0.1:8600')
+INFERENCE_SERVER_TIMEOUT = float(os.getenv('INFERENCE_SERVER_TIMEOUT', 60))
+# Read by the server to reject larger requests, and by `RemoteEngine` to split its batches below it
+INFERENCE_SERVER_MAX_BODY_MB = int(os.getenv('INFERENCE_SERVER_MAX_BODY_MB', 256))
+
+_threads_configured = False
+_threads_lock = threading.Lock()
+
+def configure_threads():
+    """
+    Applies `INTRA_OP_THREADS` and `INTER_OP_THREADS` to TensorFlow, once per process.
+    TensorFlow only accepts this before it runs its first operation, so it is called before the first model is built.
+    """
+    global _threads_configured
+    with _threads_lock:
+        if _threads_configured:
+            return
+        _threads_configured = True
+        if not INTRA_OP_THREADS and not INTER_OP_THREADS:
+            return
+        import tensorflow as tf
+        try:
+            if INTRA_OP_THREADS:
+                tf.config.threading.set_intra_op_parallelism_threads(INTRA_OP_THREADS)
+            if INTER_OP_THREADS:
+                tf.config.threading.set_inter_op_parallelism_threads(INTER_OP_THREADS)
+        except RuntimeError as e:
+            print(f"Could not configure the TensorFlow threads: {e}")
+
+def build_keras_model(model_name):
+    """
+    Builds a pre-trained Keras model with ImageNet weights, importing TensorFlow on first use.
+
+    Parameters:
+    - model_name (str): The name of the model to build.
+
+    Returns:
+    - model: The Keras model.
+    """
+    configure_threads()
+    from tensorflow.keras import applications
+    return getattr(applications, model_name)(weights='imagenet')
+
+class KerasEngine:
+    """
+    Runs the full-precision Keras model.
+    """
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.model = build_keras_model(model_name)
+        # float32 weights
+        self.size_bytes = self.model.count_params() * 4
+        self._feature_model = None
+        self._lock = threading.Lock()
+
+    def _get_feature_model(self):
+        """
+        Returns a model that shares the weights of the classifier and also outputs the pooled features, creating it on first use.
+
+        Returns:
+        - model: The Keras model with the class probabilities and the features as outputs.
+        """
+        with self._lock:
+            if self._feature_model is None:
+                from tensorflow import keras
+                features = self.model.get_layer(FEATURE_LAYERS[self.model_name]).output
+                self._feature_model = keras.Model(self.model.inputs, [self.model.output, features])
+            return self._feature_model
+
+    def predict(self, batch, features=False):
+        """
+        Classifies a preprocessed batch with a single forward pass.
+
+        Parameters:
+        - batch (np.array): The preprocessed images, as returned by `preprocess_batch`.
+        - features (bool): Whether to also return the pooled feature vectors. Default is False.
+
+        Returns:
+        - np.array: The class probabilities of shape (len(batch), 1000), and with `features`, the feature vectors of shape (len(batch), dimensions).
+        """
+        if not features:
+            return np.asarray(self.model.predict_on_batch(batch))
+        probabilities, vectors = self._get_feature_model().predict_on_batch(batch)
+        return np.asarray(probabilities), np.asarray(vectors)
+
+def _calibration_batches(model_name):
+    """
+    Yields the preprocessed calibration images used for full integer quantization, one image per batch.
+
+    Parameters:
+    - model_name (str): The name of the model being converted.
+
+    Yields:
+    - list: A single-element list holding the preprocessed image (np.array of shape (1, height, width, 3)).
+    """
+    count = 0
+    for root, dirs, files in os.walk(ENGINE_CALIBRATION_DIR):
+        dirs.sort()
+        for file in sorted(files):
+            if count >= ENGINE_CALIBRATION_IMAGES:
+                return
+            try:
+                image, _ = decode_image(os.path.join(root, file), get_target_size(model_name))
+            except Exception:
+                # Not an image
+                continue
+            count += 1
+            yield [preprocess_batch([image], model_name)]
+
+def tflite_model_path(model_name, quantization):
+    """
+    Returns where the TFLite conversion of a model is cached.
+    The path includes the preprocessing version, because int8 calibration depends on the preprocessing.
+
+    Parameters:
+    - model_name (str): The name of the model.
+    - quantization (str): 'float16' or 'int8'.
+
+    Returns:
+    - str: The path of the .tflite file.
+    """
+    return os.path.join(ENGINE_CACHE_DIR, f'{model_name}_{quantization}_v{PREPROCESSING_VERSION}.tflite')
+
+def convert_to_tflite(model_name, quantization):
+    """
+    Converts a Keras model to TFLite with the given quantization and caches the result on disk.
+
+    Parameters:
+    - model_name (str): The name of the model.
+    - quantization (str): 'float16' or 'int8'.
+
+    Returns:
+    - str: The path of the converted model.
+    """
+    import tensorflow as tf
+    path = tflite_model_path(model_name, quantization)
+    if os.path.exists(path):
+        return path
+    print(f"Converting {model_name} to TFLite ({quantization}). This only happens once.")
+    converter = tf.lite.TFLiteConverter.from_keras_model(build_keras_model(model_name))
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif ENGINE_CALIBRATION_DIR:
+        converter.representative_dataset = lambda: _calibration_batches(model_name)
+    os.makedirs(ENGINE_CACHE_DIR, exist_ok=True)
+    # Write to a temporary file first, so an interrupted conversion never leaves a truncated model behind
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(converter.convert())
+    os.replace(temporary_path, path)
+    return path
+
+def _create_interpreter(path):
+    """
+    Loads a TFLite model, preferring the standalone `tflite_runtime` package when it is installed.
+
+    Parameters:
+    - path (str): The path of the .tflite file.
+
+    Returns:
+    - Interpreter: The TFLite interpreter.
+    """
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=path, num_threads=INTRA_OP_THREADS or None)
+
+class TFLiteEngine:
+    """
+    Runs a quantized TFLite conversion of the model on the CPU.
+    The interpreter is resized when the batch size changes and is not thread-safe, so calls to `predict` are serialized.
+    """
+
+    def __init__(self, model_name, quantization):
+        self.model_name = model_name
+        self.quantization = quantization
+        self.path = tflite_model_path(model_name, quantization)
+        if not os.path.exists(self.path):
+            convert_to_tflite(model_name, quantization)
+        self.size_bytes = os.path.getsize(self.path)
+        self._interpreter = _create_interpreter(self.path)
+        self._input_index = self._interpreter.get_input_details()[0]['index']
+        self._output_index = self._interpreter.get_output_details()[0]['index']
+        self._batch_size = None
+        self._lock = threading.Lock()
+
+    def predict(self, batch, features=False):
+        """
+        Classifies a preprocessed batch with a single invocation of the interpreter.
+
+        Parameters:
+        - batch (np.array): The preprocessed images, as returned by `preprocess_batch`.
+        - features (bool): Must be False; converted models only output the class probabilities.
+
+        Returns:
+        - np.array: The class probabilities of shape (len(batch), 1000).
+
+        Raises:
+        - ValueError: If feature vectors are requested.
+        """
+        if features:
+            raise ValueError("Feature vectors are only available with the 'keras' engine")
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        with self._lock:
+            if self._batch_size != len(batch):
+                self._interpreter.resize_tensor_input(self._input_index, batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+            self._interpreter.set_tensor(self._input_index, batch)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output_index).copy()
+
+class RemoteEngine:
+    """
+    Runs the model on the inference server. The server picks its own engine (its `INFERENCE_SERVER_ENGINE`).
+    """
+
+    def __init__(self, model_name, url=None):
+        import requests
+        self.model_name = model_name
+        self.url = (url or INFERENCE_SERVER_URL).rstrip('/')
+        # The model is held by the server
+        self.size_bytes = 0
+        self._session = requests.Session()
+
+    def predict(self, batch, features=False):
+        """
+        Classifies a preprocessed batch on the inference server, in as many requests as `INFERENCE_SERVER_MAX_BODY_MB` requires.
+
+        Parameters:
+        - batch (np.array): The preprocessed images, as returned by `preprocess_batch`.
+        - features (bool): Must be False; the server only returns the class probabilities.
+
+        Returns:
+        - np.array: The class probabilities of shape (len(batch), 1000).
+
+        Raises:
+        - ValueError: If feature vectors are requested.
+        - requests.HTTPError: If the server responds with an error status.
+        """
+        if features:
+            raise ValueError("Feature vectors are only available with the 'keras' engine")
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        image_bytes = batch[0].nbytes if len(batch) else 1
+        # Leaves room for the .npy header
+        images_per_request = max(1, (INFERENCE_SERVER_MAX_BODY_MB * 1024 * 1024 - 4096) // image_bytes)
+        results = [self._post(batch[start:start + images_per_request]) for start in range(0, max(len(batch), 1), images_per_request)]
+        return results[0] if len(results) == 1 else np.concatenate(results)
+
+    def _post(self, batch):
+        body = BytesIO()
+        np.save(body, batch)
+        response = self._session.post(
+            f'{self.url}/predict', params={'model': self.model_name}, data=body.getvalue(), timeout=INFERENCE_SERVER_TIMEOUT,
+            headers={'Content-Type': 'application/octet-stream'},
+        )
+        response.raise_for_status()
+        return np.load(BytesIO(response.content), allow_pickle=False)
+
+def create_engine(model_name, engine):
+    """
+    Creates an inference engine for a model.
+
+    Parameters:
+    - model_name (str): The name of the model.
+    - engine (str): The name of the engine, one of `ENGINES`.
+
+    Returns:
+    - KerasEngine, TFLiteEngine or RemoteEngine: The engine.
+
+    Raises:
+    - ValueError: If the engine is not supported.
+    """
+    if engine == 'keras':
+        return KerasEngine(model_name)
+    if engine in ('tflite-float16', 'tflite-int8'):
+        return TFLiteEngine(model_name, engine.split('-')[1])
+    if engine == 'remote':
+        return RemoteEngine(model_name)
+    raise ValueError(f"Unsupported inference engine: {engine}")
+
+def compare_with_keras(batch, model_name, engine, top=5):
+    """
+    Compares the predictions of an engine with those of the Keras model on the same preprocessed images.
+
+    Parameters:
+    - batch (np.array): The preprocessed images, as returned by `preprocess_batch`.
+    - model_name (str): The name of the model.
+    - engine (str): The name of the engine to compare, one of `ENGINES`.
+    - top (int): The number of top predictions to compare. Default is 5.
+
+    Returns:
+    - dict: The share of images with the same top-1 class, the average overlap of the top-k classes,
+      the largest difference in any class probability, the time per image of both engines and their sizes.
+    """
+    reference, candidate = create_engine(model_name, 'keras'), create_engine(model_name, engine)
+    timings = {}
+    outputs = {}
+    for name, runner in (('keras', reference), (engine, candidate)):
+        # The first call traces or allocates the model, so it is not timed
+        runner.predict(batch[:1])
+        start = time.perf_counter()
+        outputs[name] = runner.predict(batch)
+        timings[name] = (time.perf_counter() - start) / len(batch) * 1000
+    expected, actual = outputs['keras'], outputs[engine]
+    expected_top = np.argsort(-expected, axis=1)[:, :top]
+    actual_top = np.argsort(-actual, axis=1)[:, :top]
+    overlap = [len(set(e) & set(a)) / top for e, a in zip(expected_top, actual_top)]
+    return {
+        'model': model_name,
+        'engine': engine,
+        'images': len(batch),
+        'top1_agreement': float(np.mean(expected_top[:, 0] == actual_top[:, 0])),
+        f'top{top}_overlap': float(np.mean(overlap)),
+        'max_probability_difference': float(np.max(np.abs(expected - actual))),
+        'keras_ms_per_image': timings['keras'],
+        'engine_ms_per_image': timings[engine],
+        'keras_size_mb': reference.size_bytes / 1024 / 1024,
+        'engine_size_mb': candidate.size_bytes / 1024 / 1024,
+    }
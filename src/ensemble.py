@@ -0,0 +1,110 @@
+"""
+This module classifies images with ResNet50, VGG16 and InceptionV3 together and combines their predictions.
+Each image is decoded once, at the largest input size the models need, and resized for each model from that decoded image
+(see `ingest.prepare_image`).
+The models then run concurrently on one thread each (TensorFlow releases the GIL during a forward pass), and their top
+predictions are combined with `ENSEMBLE_METHOD`:
+- 'mean': classes are ranked by their rating averaged over the models; a model that does not rank a class in its top
+  predictions counts as 0 for that class.
+- 'vote': classes are ranked by the number of models that rank them in their top predictions, then by their average rating.
+The combined results keep the usual Class ID, Class Name and Class Rating columns and add one rating column per model.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from image_processing import classify_preprocessed
+from model_registry import MODEL_NAMES
+
+ENSEMBLE = 'Ensemble'
+ENSEMBLE_MODELS = MODEL_NAMES
+ENSEMBLE_METHODS = ['mean', 'vote']
+ENSEMBLE_METHOD = os.getenv('ENSEMBLE_METHOD', 'mean')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_model_names(model_name):
+    """
+    Returns the models that run for the given model selection.
+
+    Parameters:
+    - model_name (str): The name of a model, or `ENSEMBLE`.
+
+    Returns:
+    - list: The names of the models to run.
+    """
+    return list(ENSEMBLE_MODELS) if model_name == ENSEMBLE else [model_name]
+
+def _get_executor():
+    """
+    Returns the thread pool that runs the ensemble's models, creating it on first use.
+
+    Returns:
+    - ThreadPoolExecutor: The shared thread pool.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=len(ENSEMBLE_MODELS), thread_name_prefix='ensemble')
+        return _executor
+
+def combine_predictions(model_results, top=5, method=ENSEMBLE_METHOD):
+    """
+    Combines the classification results of several models for one image.
+
+    Parameters:
+    - model_results (dict): The classification results (pd.DataFrame) of each model, keyed by model name.
+    - top (int): The number of combined predictions to return. Default is 5.
+    - method (str): 'mean' or 'vote'. Default is `ENSEMBLE_METHOD`.
+
+    Returns:
+    - pd.DataFrame: The combined results, with a rating column per model (and a Votes column for 'vote').
+
+    Raises:
+    - ValueError: If the method is not supported.
+    """
+    if method not in ENSEMBLE_METHODS:
+        raise ValueError(f"Unsupported ensemble method: {method}")
+    scores = pd.concat(
+        [results.set_index(['Class ID', 'Class Name'])['Class Rating'].rename(model_name) for model_name, results in model_results.items()],
+        axis=1,
+    )
+    votes = scores.notna().sum(axis=1)
+    scores = scores.fillna(0.0)
+    combined = scores.assign(**{'Class Rating': scores.mean(axis=1).round(2)})
+    if method == 'vote':
+        combined['Votes'] = votes
+        combined = combined.sort_values(['Votes', 'Class Rating'], ascending=False)
+    else:
+        combined = combined.sort_values('Class Rating', ascending=False)
+    combined = combined.head(top).reset_index()
+    return combined[['Class ID', 'Class Name', 'Class Rating', *model_results, *(['Votes'] if method == 'vote' else [])]]
+
+def classify_ensemble(batches, digests, top=5, method=ENSEMBLE_METHOD, engine=None, names=None, embed=False):
+    """
+    Classifies a batch with each model concurrently and combines their predictions per image.
+
+    Parameters:
+    - batches (dict): The preprocessed images of each model (np.array), keyed by model name.
+    - digests (list): The content hashes of the images.
+    - top (int): The number of predictions to return per image. Default is 5.
+    - method (str): 'mean' or 'vote'. Default is `ENSEMBLE_METHOD`.
+    - engine (str, optional): The name of the inference engine. Defaults to `INFERENCE_ENGINE`.
+    - names (list, optional): The names of the images, stored with their embeddings.
+    - embed (bool): Whether to also add the images' feature vectors to each model's embedding index. Default is False.
+
+    Returns:
+    - list: One DataFrame of combined classification results per image, in input order.
+    """
+    executor = _get_executor()
+    futures = {
+        model_name: executor.submit(classify_preprocessed, batch, digests, model_name, top, engine, names, embed)
+        for model_name, batch in batches.items()
+    }
+    results = {model_name: future.result() for model_name, future in futures.items()}
+    return [
+        combine_predictions({model_name: results[model_name][index] for model_name in batches}, top, method)
+        for index in range(len(digests))
+    ]
@@ -0,0 +1,236 @@
+"""
+This module provides the HTTP layer used to fetch images from Unsplash and Pexels.
+Photos are listed in bulk through `list_photos`, and `photo_url` picks the smallest image size that still covers the model input.
+All requests go through one shared, pooled session with per-request timeouts and retries with exponential backoff.
+The `iter_completed` function runs fetch jobs on a bounded thread pool and hands each result back as soon as it is ready,
+so downloads keep running while the caller classifies the images that have already arrived.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from api import check_api_usage, update_api_usage_from_headers
+from metrics import increment, timer
+
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', 8))
+CONNECT_TIMEOUT = float(os.getenv('CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.getenv('READ_TIMEOUT', 30))
+FETCH_RETRIES = int(os.getenv('FETCH_RETRIES', 3))
+FETCH_BACKOFF_FACTOR = float(os.getenv('FETCH_BACKOFF_FACTOR', 0.5))
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Largest number of photos each site returns from a single listing call
+UNSPLASH_MAX_COUNT = 30
+PEXELS_MAX_PER_PAGE = 80
+
+# Image sizes offered by each site, smallest first, with the (width, height) box each one is scaled to fit (None means unbounded)
+RENDITIONS = {
+    'Unsplash': [('thumb', (200, None)), ('small', (400, None)), ('regular', (1080, None)), ('full', (None, None))],
+    'Pexels': [('small', (None, 130)), ('medium', (None, 350)), ('large', (940, 650)), ('large2x', (1880, 1300)), ('original', (None, None))],
+}
+KEEP_ORIGINAL_IMAGES = os.getenv('KEEP_ORIGINAL_IMAGES', '0') == '1'
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    Returns the shared HTTP session, creating it on first use.
+    The session keeps a connection pool sized for `FETCH_WORKERS` and retries failed GET requests with exponential backoff.
+
+    Returns:
+    - requests.Session: The shared session.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=FETCH_RETRIES,
+                backoff_factor=FETCH_BACKOFF_FACTOR,
+                status_forcelist=RETRY_STATUS_CODES,
+                allowed_methods=['GET'],
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=FETCH_WORKERS, max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+def http_get(url, **kwargs):
+    """
+    Sends a GET request through the shared session with the default timeouts.
+
+    Parameters:
+    - url (str): The URL to request.
+    - **kwargs: Additional arguments passed to `requests.Session.get`, such as headers and params.
+
+    Returns:
+    - requests.Response: The response.
+    """
+    kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+    return get_session().get(url, **kwargs)
+
+def download(url):
+    """
+    Downloads the content at the given URL.
+
+    Parameters:
+    - url (str): The URL of the file to download.
+
+    Returns:
+    - bytes: The downloaded content.
+
+    Raises:
+    - requests.HTTPError: If the server responds with an error status.
+    """
+    with timer('fetch'):
+        response = http_get(url)
+        response.raise_for_status()
+        content = response.content
+    increment('fetched_bytes', len(content))
+    return content
+
+def iter_completed(func, items, max_workers=FETCH_WORKERS):
+    """
+    Runs `func` on each item on a thread pool and yields the results in completion order.
+    Items are taken from the iterable lazily, with at most twice `max_workers` jobs in flight, so memory stays bounded
+    and the caller can stop early (for example when the API quota runs out) without queueing the remaining work.
+
+    Parameters:
+    - func (callable): The function to run on each item.
+    - items (iterable): The items to process.
+    - max_workers (int): The maximum number of concurrent jobs. Default is `FETCH_WORKERS`.
+
+    Yields:
+    - tuple: (item, result, error), where error is the exception raised by `func`, or None on success.
+    """
+    items = iter(items)
+    max_pending = max_workers * 2
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch') as executor:
+        pending = {}
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < max_pending:
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[executor.submit(func, item)] = item
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    error = future.exception()
+                    yield item, (None if error else future.result()), error
+        finally:
+            # Drop queued jobs if the caller stops early
+            for future in pending:
+                future.cancel()
+
+def list_photos(site, api_key, num_images):
+    """
+    Lists up to `num_images` photos from the selected site, requesting as many photos per API call as the site allows.
+    Pages are requested lazily, as the caller consumes the photos, and each listing call counts once against the API usage limit.
+
+    Parameters:
+    - site (str): The site to list photos from ('Unsplash' or 'Pexels').
+    - api_key (str): The API access key for the site.
+    - num_images (int): The number of photos to list.
+
+    Yields:
+    - dict: The photo metadata returned by the site.
+
+    Raises:
+    - requests.HTTPError: If the site responds with an error status.
+    """
+    remaining = num_images
+    page = 1
+    # Pexels pages by offset, (page - 1) * per_page, so the page size must stay the same for every page: a smaller last page would
+    # start inside the photos already listed. The last page is cut down to the photos still needed instead.
+    per_page = min(num_images, PEXELS_MAX_PER_PAGE)
+    while remaining > 0:
+        if not check_api_usage(site):
+            print(f"API usage limit reached for {site}. Please wait or reset the API usage.")
+            return
+        if site == 'Unsplash':
+            response = http_get(
+                'https://api.unsplash.com/photos/random',
+                headers={'Authorization': f'Client-ID {api_key}'},
+                params={'count': min(remaining, UNSPLASH_MAX_COUNT)}
+            )
+            update_api_usage_from_headers(site, response.headers)
+            response.raise_for_status()
+            photos = response.json()
+        elif site == 'Pexels':
+            response = http_get(
+                'https://api.pexels.com/v1/search',
+                headers={'Authorization': api_key},
+                params={'query': 'nature', 'per_page': per_page, 'page': page}
+            )
+            update_api_usage_from_headers(site, response.headers)
+            response.raise_for_status()
+            photos = response.json().get('photos', [])
+            page += 1
+        else:
+            print(f"Error: Unsupported site '{site}'.")
+            return
+        if not photos:
+            print(f"No photos found in {site} response. Response: {response.json()}")
+            return
+        for photo in photos[:remaining]:
+            yield photo
+        remaining -= len(photos[:remaining])
+
+def rendition_size(width, height, box):
+    """
+    Computes the size of a rendition scaled down to fit a bounding box, keeping the aspect ratio.
+
+    Parameters:
+    - width (int): The width of the original image.
+    - height (int): The height of the original image.
+    - box (tuple): The (width, height) bounds of the rendition. None means unbounded.
+
+    Returns:
+    - tuple: The (width, height) of the rendition.
+    """
+    max_width, max_height = box
+    scale = min(
+        1.0,
+        max_width / width if max_width else 1.0,
+        max_height / height if max_height else 1.0,
+    )
+    return int(width * scale), int(height * scale)
+
+def photo_url(site, photo, target_size, keep_originals=False):
+    """
+    Returns the download URL of a listed photo.
+    Unless originals are kept, this is the smallest rendition whose width and height both reach the model's input size.
+
+    Parameters:
+    - site (str): The site the photo was listed from ('Unsplash' or 'Pexels').
+    - photo (dict): The photo metadata returned by the site.
+    - target_size (tuple): The (width, height) input size of the model.
+    - keep_originals (bool): Whether to download the full-resolution original. Default is False.
+
+    Returns:
+    - str: The URL of the image file.
+    """
+    urls = photo['urls'] if site == 'Unsplash' else photo['src']
+    original = RENDITIONS[site][-1][0]
+    width, height = photo.get('width'), photo.get('height')
+    if keep_originals or not width or not height:
+        return urls[original]
+    for name, box in RENDITIONS[site]:
+        rendition_width, rendition_height = rendition_size(width, height, box)
+        if name in urls and rendition_width >= target_size[0] and rendition_height >= target_size[1]:
+            return urls[name]
+    return urls[original]
@@ -46,10 +46,10 @@ def reset_directory(directory):
 
 def save_uploaded_image(image, image_path):
     """
-    Saves the uploaded image file to the specified path.
+    Saves the uploaded image file to the specified path, byte for byte, without decoding or re-encoding it.
 
     Parameters:
-    - image (PIL.Image): The image to be saved.
+    - image (io.BytesIO): The uploaded file to be saved.
     - image_path (str): The path where the image will be saved.
     """
     # Ensure the directory of the image path exists
@@ -58,7 +58,8 @@ def save_uploaded_image(image, image_path):
     # Save the uploaded image file
     with open(image_path, 'wb') as f:
         if isinstance(image, io.BytesIO): # If image is an uploaded file
-            f.write(image.getvalue())
+            # getbuffer() writes the upload's memory directly instead of copying it first
+            f.write(image.getbuffer())
 
 def save_fetched_image(content, image_path):
     """
@@ -1,39 +1,85 @@
 """
 This module contains functions for processing images, including selecting the appropriate model, preprocessing the image, and classifying the image using the selected model.
 It provides functionality to classify images using pre-trained models and convert the classification results into a DataFrame for easy display and further processing.
+TensorFlow is imported on the first classification rather than when this module is imported.
 """
 
-import numpy as np
+import os
 import pandas as pd
-from tensorflow.keras.applications.resnet50 import ResNet50, preprocess_input, decode_predictions
-from tensorflow.keras.applications import VGG16, InceptionV3
-from tensorflow.keras.preprocessing import image as image_utils
 from PIL import ImageFile
+from embeddings import get_embedding_index
+from engines import INFERENCE_ENGINE
+from metrics import increment, timer
+from model_registry import get_engine, get_model
+from preprocessing import allocate_batch, get_target_size, preprocess_batch
+from prediction_cache import cache_predictions, get_cached_predictions, image_digest
+from topk import decode_top_k
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', 32))
+BATCH_MEMORY_FRACTION = float(os.getenv('BATCH_MEMORY_FRACTION', 0.25))
+# Approximate activation memory used by a forward pass, as a multiple of the input tensor size
+ACTIVATION_MEMORY_FACTOR = 100
+
+def get_available_memory():
+    """
+    Returns the amount of memory available to the process.
+
+    Returns:
+    - int: The available memory in bytes, or None if it cannot be determined.
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def compute_batch_size(model_name, num_images):
+    """
+    Computes how many images to send through the model in a single forward pass.
+    The batch size is limited by `MAX_BATCH_SIZE` and by the share of available memory set in `BATCH_MEMORY_FRACTION`.
+
+    Parameters:
+    - model_name (str): The name of the model to use for classification.
+    - num_images (int): The number of images waiting to be classified.
+
+    Returns:
+    - int: The batch size (at least 1).
+    """
+    width, height = get_target_size(model_name)
+    bytes_per_image = width * height * 3 * 4 * ACTIVATION_MEMORY_FACTOR
+    batch_size = min(MAX_BATCH_SIZE, max(num_images, 1))
+    available = get_available_memory()
+    if available:
+        batch_size = min(batch_size, int(available * BATCH_MEMORY_FRACTION // bytes_per_image))
+    return max(batch_size, 1)
+
 def select_model(model_name):
     """
     Selects the appropriate model based on the user's choice.
+    The model is built once per process and shared through the model registry.
 
     Parameters:
     - model_name (str): The name of the model to use for classification.
 
     Returns:
     - model: The selected model.
+
+    Raises:
+    - ValueError: If the model name is not supported.
     """
-    if model_name == 'ResNet50':
-        return ResNet50(weights='imagenet')
-    elif model_name == 'VGG16':
-        return VGG16(weights='imagenet')
-    elif model_name == 'InceptionV3':
-        return InceptionV3(weights='imagenet')
-    else:
-        raise ValueError(f"Unsupported model: {model_name}")
+    return get_model(model_name)
 
 def process_image(image, model_name):
     """
-    Processes the image to match the model's requirements, including resizing, converting to a numpy array, and adding an extra dimension.
+    Processes the image to match the model's requirements, including mode conversion, resizing, per-model normalization, and adding an extra dimension.
 
     Parameters:
     - image (PIL.Image): The image to be processed.
@@ -42,14 +88,187 @@ def process_image(image, model_name):
     Returns:
     - image (np.array): The processed image.
     """
-    target_size = (224, 224) if model_name != 'InceptionV3' else (299, 299)
-    image = image.resize(target_size)
-    image = np.array(image, dtype='uint8')
-    if len(image.shape) == 2:
-        image = np.stack((image,) * 3, axis=-1)
-    image = np.expand_dims(image, axis=0)
-    image = preprocess_input(image)
-    return image
+    return preprocess_batch([image], model_name)
+
+def predictions_to_dataframe(results):
+    """
+    Converts decoded predictions for one image into a DataFrame.
+
+    Parameters:
+    - results (list): The (class ID, class name, score) tuples of the image, as returned by `TopKPredictions.to_lists`.
+
+    Returns:
+    - results_df (pd.DataFrame): The DataFrame containing the classification results.
+    """
+    results_df = pd.DataFrame(results, columns=['Class ID', 'Class Name', 'Class Rating'])
+    results_df['Class Rating'] = (results_df['Class Rating'] * 100).round(2)
+    return results_df
+
+def cache_model_key(model_name, engine=None):
+    """
+    Returns the model name under which predictions are cached. Quantized engines give slightly different scores,
+    so their predictions are cached separately from the Keras model's.
+
+    Parameters:
+    - model_name (str): The name of the model to use for classification.
+    - engine (str, optional): The name of the inference engine. Defaults to `INFERENCE_ENGINE`.
+
+    Returns:
+    - str: The model name for the prediction cache.
+    """
+    engine = engine or INFERENCE_ENGINE
+    return model_name if engine == 'keras' else f'{model_name}/{engine}'
+
+def predict_batch(batch, model_name, top=5, engine=None, features=False):
+    """
+    Runs a single forward pass over a preprocessed batch and selects the top predictions of each image.
+
+    Parameters:
+    - batch (np.array): The preprocessed images, as returned by `preprocess_batch`.
+    - model_name (str): The name of the model to use for classification.
+    - top (int): The number of predictions to return per image. Default is 5.
+    - engine (str, optional): The name of the inference engine. Defaults to `INFERENCE_ENGINE`.
+    - features (bool): Whether to also return the pooled feature vectors (Keras engine only). Default is False.
+
+    Returns:
+    - TopKPredictions: The top predictions of the batch, and with `features`, the feature vectors (np.array).
+    """
+    model = get_engine(model_name, engine)
+    with timer('predict'):
+        preds = model.predict(batch, features=True) if features else model.predict(batch)
+    if features:
+        preds, vectors = preds
+    increment('predicted_images', len(batch))
+    with timer('postprocess'):
+        results = decode_top_k(preds, top)
+    return (results, vectors) if features else results
+
+def embed_preprocessed(batch, digests, names, model_name):
+    """
+    Adds the feature vectors of the images that are not in the embedding index yet.
+    Converted engines do not output feature vectors, so this runs a separate pass of the Keras model.
+
+    Parameters:
+    - batch (np.array): The preprocessed images, as returned by `preprocess_batch`.
+    - digests (list): The content hashes of the images.
+    - names (list): The names of the images.
+    - model_name (str): The name of the model.
+    """
+    index = get_embedding_index(model_name)
+    missing = index.missing(digests)
+    pending = {}
+    for position, digest in enumerate(digests):
+        if digest in missing and digest not in pending:
+            pending[digest] = position
+    if pending:
+        positions = list(pending.values())
+        with timer('embed'):
+            _, vectors = get_engine(model_name, 'keras').predict(batch[positions], features=True)
+        index.add(list(pending), [names[position] for position in positions], vectors)
+
+def predict_preprocessed(batch, digests, model_name, top=5, engine=None, names=None, embed=False):
+    """
+    Classifies a batch of images that have already been preprocessed, skipping the images found in the prediction cache.
+    This is `classify_preprocessed` without building a DataFrame per image, for callers that only store the results.
+
+    Parameters:
+    - batch (np.array): The preprocessed images, as returned by `preprocess_batch`.
+    - digests (list): The content hashes of the images.
+    - model_name (str): The name of the model to use for classification.
+    - top (int): The number of predictions to return per image. Default is 5.
+    - engine (str, optional): The name of the inference engine. Defaults to `INFERENCE_ENGINE`.
+    - names (list, optional): The names of the images, stored with their embeddings.
+    - embed (bool): Whether to also add the images' feature vectors to the embedding index. Default is False.
+
+    Returns:
+    - list: One list of (class ID, class name, score) tuples per image, in input order.
+    """
+    cache_key = cache_model_key(model_name, engine)
+    predictions = get_cached_predictions(digests, cache_key, top)
+    names = names or [None] * len(digests)
+    # With the Keras engine, the feature vectors come from the same forward pass as the predictions
+    with_features = embed and (engine or INFERENCE_ENGINE) == 'keras'
+    missing = get_embedding_index(model_name).missing(digests) if with_features else set()
+    # Classify each image that is not cached (or not embedded) once, even if it appears several times in the batch
+    pending = {}
+    for index, digest in enumerate(digests):
+        if (digest not in predictions or digest in missing) and digest not in pending:
+            pending[digest] = index
+    if pending:
+        indices = list(pending.values())
+        pending_batch = batch if len(indices) == len(batch) else batch[indices]
+        if with_features:
+            results, vectors = predict_batch(pending_batch, model_name, top, engine, features=True)
+            get_embedding_index(model_name).add(list(pending), [names[index] for index in indices], vectors)
+        else:
+            results = predict_batch(pending_batch, model_name, top, engine)
+        new_predictions = dict(zip(pending, results.to_lists()))
+        cache_predictions(new_predictions, cache_key, top)
+        predictions.update(new_predictions)
+    if embed and not with_features:
+        embed_preprocessed(batch, digests, names, model_name)
+    return [predictions[digest] for digest in digests]
+
+def classify_preprocessed(batch, digests, model_name, top=5, engine=None, names=None, embed=False):
+    """
+    Classifies a batch of images that have already been preprocessed, skipping the images found in the prediction cache.
+
+    Parameters:
+    - batch (np.array): The preprocessed images, as returned by `preprocess_batch`.
+    - digests (list): The content hashes of the images.
+    - model_name (str): The name of the model to use for classification.
+    - top (int): The number of predictions to return per image. Default is 5.
+    - engine (str, optional): The name of the inference engine. Defaults to `INFERENCE_ENGINE`.
+    - names (list, optional): The names of the images, stored with their embeddings.
+    - embed (bool): Whether to also add the images' feature vectors to the embedding index. Default is False.
+
+    Returns:
+    - list: One DataFrame of classification results per image, in input order.
+    """
+    return [predictions_to_dataframe(results) for results in predict_preprocessed(batch, digests, model_name, top, engine, names, embed)]
+
+def classify_batch(images, model_name, top=5, digests=None, engine=None):
+    """
+    Classifies a list of images using the specified model.
+    Images found in the prediction cache are not sent through the model. The remaining images are stacked into
+    batches sized by `compute_batch_size`, and each batch is classified with a single forward pass.
+
+    Parameters:
+    - images (list): The PIL images to be classified.
+    - model_name (str): The name of the model to use for classification.
+    - top (int): The number of predictions to return per image. Default is 5.
+    - digests (list, optional): The content hashes of the images, as returned by `image_digest` for the encoded file content.
+      Defaults to hashing the decoded images.
+    - engine (str, optional): The name of the inference engine. Defaults to `INFERENCE_ENGINE`.
+
+    Returns:
+    - list: One DataFrame of classification results per image, in input order.
+    """
+    if not images:
+        return []
+    if digests is None:
+        digests = [image_digest(img) for img in images]
+    cache_key = cache_model_key(model_name, engine)
+    predictions = get_cached_predictions(digests, cache_key, top)
+
+    # Classify each image that is not cached once, even if it appears several times in the list
+    pending = {}
+    for img, digest in zip(images, digests):
+        if digest not in predictions and digest not in pending:
+            pending[digest] = img
+    if pending:
+        pending_digests = list(pending)
+        pending_images = list(pending.values())
+        batch_size = compute_batch_size(model_name, len(pending_images))
+        # Reuse one preallocated buffer for every batch
+        buffer = allocate_batch(min(batch_size, len(pending_images)), model_name)
+        new_predictions = {}
+        for start in range(0, len(pending_images), batch_size):
+            batch = preprocess_batch(pending_images[start:start + batch_size], model_name, out=buffer)
+            new_predictions.update(zip(pending_digests[start:start + batch_size], predict_batch(batch, model_name, top, engine).to_lists()))
+        cache_predictions(new_predictions, cache_key, top)
+        predictions.update(new_predictions)
+    return [predictions_to_dataframe(predictions[digest]) for digest in digests]
 
 def classify_images(img, model_name):
     """
@@ -62,10 +281,4 @@ def classify_images(img, model_name):
     Returns:
     - results_df (pd.DataFrame): The DataFrame containing the classification results.
     """
-    img = process_image(img, model_name)
-    model = select_model(model_name)
-    preds = model.predict(img)
-    results = decode_predictions(preds, top=5)[0]
-    results_df = pd.DataFrame(results, columns=['Class ID', 'Class Name', 'Class Rating'])
-    results_df['Class Rating'] = (results_df['Class Rating'] * 100).round(2)
-    return results_df
\ No newline at end of file
+    return classify_batch([img], model_name)[0]
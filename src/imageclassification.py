@@ -0,0 +1,200 @@
+"""
+This module is the command-line entry point of the image classification application.
+It runs the same classification pipeline as the Streamlit app without a browser session, for bulk runs over local directories
+or fetches from Unsplash and Pexels. Run it from the `src` directory, for example:
+
+    python -m imageclassification classify ../photos --model ResNet50 --batch-size 64 --workers 8
+    python -m imageclassification fetch --site Pexels --num-images 200 --model VGG16 --engine tflite-int8
+    python -m imageclassification export --output results.xlsx
+    python -m imageclassification serve --models ResNet50 VGG16 --max-batch-size 32 --max-wait-ms 10
+    python -m imageclassification classify ../photos --embed
+    python -m imageclassification classify ../photos --incremental
+    python -m imageclassification classify ../inbox --watch
+    python -m imageclassification similar ../photos/cat.jpg -k 5
+"""
+
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+from dedup import DEDUP_DISTANCE, DEDUP_MODE, DEDUP_MODES
+from embeddings import EMBEDDINGS_ENABLED, find_similar
+from engines import ENGINES, INFERENCE_ENGINE
+from ensemble import ENSEMBLE
+from image_processing import MAX_BATCH_SIZE, cache_model_key
+from inference_server import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, INFERENCE_SERVER_ENGINE, INFERENCE_SERVER_HOST, INFERENCE_SERVER_PORT, SERVER_ENGINES, create_inference_server
+from manifest import WATCH_INTERVAL, Manifest
+from model_registry import MODEL_NAMES, WARM_UP_MODELS, warm_up_models
+from pipeline import PIPELINE_WORKERS, classify_sources, fetch_and_classify, iter_image_files
+from results import EXCEL_FILE, export_results_to_excel
+
+def print_progress(start_time):
+    """
+    Creates an `on_progress` callback that prints the progress and throughput to stderr.
+
+    Parameters:
+    - start_time (float): The time the run started, as returned by `time.time()`.
+
+    Returns:
+    - callable: The callback, called as on_progress(completed, total).
+    """
+    def on_progress(completed, total):
+        elapsed = max(time.time() - start_time, 1e-9)
+        of_total = f"/{total}" if total else ""
+        print(f"\rProcessed {completed}{of_total} images ({completed / elapsed:.1f} images/s)", end='', file=sys.stderr, flush=True)
+    return on_progress
+
+def print_result(name, thumbnail, classification_data):
+    """
+    An `on_result` callback that prints the top prediction of each image.
+
+    Parameters:
+    - name (str): The name of the image.
+    - thumbnail (bytes): The JPEG-encoded thumbnail of the image (unused).
+    - classification_data (pd.DataFrame): The DataFrame containing the classification results.
+    """
+    top = classification_data.iloc[0]
+    print(f"{name}\t{top['Class Name']}\t{top['Class Rating']}")
+
+def print_duplicate(name, original_name):
+    """
+    An `on_duplicate` callback that prints each near-duplicate image.
+
+    Parameters:
+    - name (str): The name of the image.
+    - original_name (str): The name of the earlier image it duplicates.
+    """
+    print(f"{name}\tduplicate of {original_name}")
+
+def main(argv=None):
+    """
+    Parses the command-line arguments and runs the requested command.
+
+    Parameters:
+    - argv (list, optional): The command-line arguments. Defaults to `sys.argv[1:]`.
+
+    Returns:
+    - int: The exit status.
+    """
+    parser = argparse.ArgumentParser(prog='imageclassification', description='Classify images with pre-trained models.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    classify_parser = subparsers.add_parser('classify', help='Classify local images.')
+    classify_parser.add_argument('paths', nargs='+', help='Directories, files or glob patterns of the images to classify.')
+    classify_parser.add_argument('--model', choices=[*MODEL_NAMES, ENSEMBLE], default='ResNet50')
+    classify_parser.add_argument('--batch-size', type=int, default=MAX_BATCH_SIZE)
+    classify_parser.add_argument('--engine', choices=ENGINES, default=INFERENCE_ENGINE, help='Inference engine; TFLite engines run a quantized copy of the model.')
+    classify_parser.add_argument('--workers', type=int, default=PIPELINE_WORKERS, help='Processes used to decode and preprocess images (0 decodes on a thread).')
+    classify_parser.add_argument('--embed', action='store_true', default=EMBEDDINGS_ENABLED, help='Also add the feature vectors of the images to the similarity index.')
+    classify_parser.add_argument('--dedup', choices=DEDUP_MODES, default=DEDUP_MODE, help='Skip near-duplicate images, or give them the results of the first copy (link).')
+    classify_parser.add_argument('--dedup-distance', type=int, default=DEDUP_DISTANCE, help='Largest number of differing perceptual hash bits between near-duplicates.')
+    classify_parser.add_argument('--incremental', action='store_true', help='Only classify files that are new or changed since they were last classified.')
+    classify_parser.add_argument('--watch', action='store_true', help='Incremental, then keep classifying new files as they appear in the directories until Ctrl+C.')
+    classify_parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, help='Seconds between scans when watching without inotify.')
+    classify_parser.add_argument('--verbose', action='store_true', help='Print the top prediction of each image.')
+
+    fetch_parser = subparsers.add_parser('fetch', help='Fetch images from Unsplash or Pexels and classify them.')
+    fetch_parser.add_argument('--site', choices=['Unsplash', 'Pexels'], required=True)
+    fetch_parser.add_argument('--num-images', type=int, required=True)
+    fetch_parser.add_argument('--model', choices=[*MODEL_NAMES, ENSEMBLE], default='ResNet50')
+    fetch_parser.add_argument('--batch-size', type=int, default=MAX_BATCH_SIZE)
+    fetch_parser.add_argument('--engine', choices=ENGINES, default=INFERENCE_ENGINE, help='Inference engine; TFLite engines run a quantized copy of the model.')
+    fetch_parser.add_argument('--keep-originals', action='store_true', help='Download full-resolution originals.')
+    fetch_parser.add_argument('--embed', action='store_true', default=EMBEDDINGS_ENABLED, help='Also add the feature vectors of the images to the similarity index.')
+    fetch_parser.add_argument('--dedup', choices=DEDUP_MODES, default=DEDUP_MODE, help='Skip near-duplicate images, or give them the results of the first copy (link).')
+    fetch_parser.add_argument('--dedup-distance', type=int, default=DEDUP_DISTANCE, help='Largest number of differing perceptual hash bits between near-duplicates.')
+    fetch_parser.add_argument('--verbose', action='store_true', help='Print the top prediction of each image.')
+
+    similar_parser = subparsers.add_parser('similar', help='Find the embedded images most similar to an image.')
+    similar_parser.add_argument('image', help='The image to search for.')
+    similar_parser.add_argument('--model', choices=MODEL_NAMES, default='ResNet50')
+    similar_parser.add_argument('-k', type=int, default=10, help='Number of similar images to list.')
+    similar_parser.add_argument('--approximate', action='store_true', help='Search the LSH index instead of every stored vector.')
+
+    serve_parser = subparsers.add_parser('serve', help='Serve the models over HTTP, batching concurrent requests.')
+    serve_parser.add_argument('--host', default=INFERENCE_SERVER_HOST)
+    serve_parser.add_argument('--port', type=int, default=INFERENCE_SERVER_PORT)
+    serve_parser.add_argument('--models', nargs='+', choices=MODEL_NAMES, default=WARM_UP_MODELS or ['ResNet50'], help='Models to load before serving.')
+    serve_parser.add_argument('--max-batch-size', type=int, default=BATCH_MAX_SIZE, help='Largest number of images per forward pass.')
+    serve_parser.add_argument('--max-wait-ms', type=float, default=BATCH_MAX_WAIT_MS, help='Longest time a batch waits for more requests.')
+    serve_parser.add_argument('--engine', choices=SERVER_ENGINES, default=INFERENCE_SERVER_ENGINE, help='Inference engine of requests that do not name one.')
+
+    export_parser = subparsers.add_parser('export', help='Export the saved results to an Excel file.')
+    export_parser.add_argument('--output', default=EXCEL_FILE)
+
+    args = parser.parse_args(argv)
+    start_time = time.time()
+
+    if args.command == 'classify':
+        if args.watch and not all(os.path.isdir(path) for path in args.paths):
+            # Glob patterns and single files cannot be watched for new files
+            parser.error('--watch only accepts directories')
+        manifest = Manifest(cache_model_key(args.model, args.engine)) if args.incremental or args.watch else None
+        if args.watch:
+            stop = threading.Event()
+            # Ctrl+C ends the stream, so the images already queued are still classified and recorded
+            signal.signal(signal.SIGINT, lambda *_: stop.set())
+            paths = manifest.watch(args.paths, stop, args.interval)
+        elif manifest is not None:
+            paths = manifest.changed_files(args.paths)
+        else:
+            paths = (path for pattern in args.paths for path in iter_image_files(pattern))
+        try:
+            count = classify_sources(
+                ((path, path) for path in paths), args.model, batch_size=args.batch_size, workers=args.workers,
+                on_result=print_result if args.verbose else None,
+                on_progress=print_progress(start_time),
+                engine=args.engine,
+                embed=args.embed,
+                dedup=args.dedup,
+                dedup_distance=args.dedup_distance,
+                on_duplicate=print_duplicate if args.verbose else None,
+                on_saved=manifest.record if manifest is not None else None,
+            )
+        finally:
+            if manifest is not None:
+                manifest.close()
+        print(f"\nClassified {count} images in {time.time() - start_time:.1f}s.", file=sys.stderr)
+    elif args.command == 'fetch':
+        directory = 'unsplash_images' if args.site == 'Unsplash' else 'pexels_images'
+        image_paths = fetch_and_classify(
+            args.site, args.num_images, args.model, directory, args.site.lower(), args.keep_originals,
+            on_result=print_result if args.verbose else None,
+            on_progress=print_progress(start_time),
+            batch_size=args.batch_size,
+            engine=args.engine,
+            embed=args.embed,
+            dedup=args.dedup,
+            dedup_distance=args.dedup_distance,
+            on_duplicate=print_duplicate if args.verbose else None,
+        )
+        print(f"\nFetched and classified {len(image_paths)} images in {time.time() - start_time:.1f}s.", file=sys.stderr)
+    elif args.command == 'similar':
+        matches = find_similar(args.image, args.model, args.k, args.approximate)
+        if not matches:
+            print(f"There are no {args.model} embeddings yet. Classify images with --embed first.", file=sys.stderr)
+            return 1
+        for digest, name, similarity in matches:
+            print(f"{name or digest}\t{similarity:.4f}")
+    elif args.command == 'serve':
+        warm_up_models(args.models, args.engine)
+        server = create_inference_server(args.host, args.port, args.max_batch_size, args.max_wait_ms, args.engine)
+        print(f"Serving on http://{args.host}:{args.port} (Ctrl+C to stop).", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    elif args.command == 'export':
+        excel_file = export_results_to_excel(args.output)
+        if excel_file is None:
+            print("There are no classification results to export yet.", file=sys.stderr)
+            return 1
+        print(excel_file)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+"""
+This module serves the classification models over HTTP, so other tools and several app processes can share one warm copy of each model.
+Start it from the `src` directory with `python -m imageclassification serve`. It listens on `INFERENCE_SERVER_HOST` and
+`INFERENCE_SERVER_PORT`, runs the models with `INFERENCE_SERVER_ENGINE` unless a request names an engine, and answers:
+- POST /classify?model=ResNet50&top=5: the body is an encoded image, or a JSON object {"paths": [...]} naming image files the
+  server can read. Returns the top predictions of each image as JSON. The prediction cache is used as in the app.
+- POST /predict?model=ResNet50: the body is a preprocessed batch saved with `np.save`, and the response is the class
+  probabilities saved the same way. The 'remote' inference engine (see `engines.RemoteEngine`) calls this endpoint.
+- GET /health: the loaded models.
+Each request is handled on its own thread. Concurrent requests for the same model are grouped by a `MicroBatcher` into one forward
+pass of up to `BATCH_MAX_SIZE` images: once the first request arrives, it waits at most `BATCH_MAX_WAIT_MS` for more.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+from engines import ENGINES, INFERENCE_SERVER_MAX_BODY_MB
+from ensemble import ENSEMBLE, classify_ensemble, get_model_names
+from image_processing import classify_preprocessed
+from ingest import get_decode_size, ingest_image
+from metrics import increment
+from model_registry import MODEL_NAMES, get_engine, loaded_models
+from preprocessing import get_target_size, preprocess_batch
+
+INFERENCE_SERVER_HOST = os.getenv('INFERENCE_SERVER_HOST', '127.0.0.1')
+INFERENCE_SERVER_PORT = int(os.getenv('INFERENCE_SERVER_PORT', 8600))
+# Separate from `INFERENCE_ENGINE`, which the clients of the server set to 'remote'
+INFERENCE_SERVER_ENGINE = os.getenv('INFERENCE_SERVER_ENGINE', 'keras')
+SERVER_ENGINES = [engine for engine in ENGINES if engine != 'remote']
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', 32))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', 10))
+
+class MicroBatcher:
+    """
+    Groups items submitted from concurrent threads and processes them together on a background thread.
+    A batch is processed as soon as it holds `max_batch_size` images, or `max_wait` seconds after its first item arrived.
+    Items are checked as they are submitted, since one invalid item would fail the whole batch it joins.
+    """
+
+    def __init__(self, process, max_batch_size=BATCH_MAX_SIZE, max_wait=BATCH_MAX_WAIT_MS / 1000, name='micro-batcher', check=None):
+        """
+        Parameters:
+        - process (callable): Called with the list of items of a batch; returns one result per item, in order.
+        - max_batch_size (int): The largest number of images per batch. Default is `BATCH_MAX_SIZE`.
+        - max_wait (float): The longest time in seconds a batch waits for more items. Default is `BATCH_MAX_WAIT_MS`.
+        - name (str): The name of the background thread.
+        - check (callable, optional): Called with each submitted item; raises ValueError if it cannot join a batch.
+        """
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._process = process
+        self._check = check
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def submit(self, item, size=1):
+        """
+        Adds an item to the next batch.
+
+        Parameters:
+        - item: The item to process.
+        - size (int): The number of images in the item. Default is 1.
+
+        Returns:
+        - Future: Resolves to the item's result.
+
+        Raises:
+        - ValueError: If the item is rejected by the batcher's check.
+        """
+        if self._check is not None:
+            self._check(item)
+        future = Future()
+        self._queue.put((item, size, future))
+        return future
+
+    def _collect(self, first):
+        """
+        Collects the items of one batch, starting with the given item.
+
+        Parameters:
+        - first (tuple): The first (item, size, future) entry of the batch.
+
+        Returns:
+        - tuple: The entries of the batch, and the entry that did not fit in it (or None).
+        """
+        entries = [first]
+        count = first[1]
+        deadline = time.monotonic() + self.max_wait
+        while count < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if count + entry[1] > self.max_batch_size:
+                return entries, entry
+            entries.append(entry)
+            count += entry[1]
+        return entries, None
+
+    def _run(self):
+        carried = None
+        while True:
+            entries, carried = self._collect(carried or self._queue.get())
+            increment('server_batches')
+            increment('server_batched_images', sum(size for _, size, _ in entries))
+            try:
+                results = self._process([item for item, _, _ in entries])
+            except Exception as e:
+                for _, _, future in entries:
+                    future.set_exception(e)
+                continue
+            for (_, _, future), result in zip(entries, results):
+                future.set_result(result)
+
+def _classify_items(model_name, top, engine):
+    """
+    Creates the batch function of /classify, which classifies preprocessed images with the prediction cache.
+
+    Parameters:
+    - model_name (str): The name of the model, or `ENSEMBLE`.
+    - top (int): The number of predictions per image.
+    - engine (str): The name of the inference engine.
+
+    Returns:
+    - callable: Called with (digest, {model name: preprocessed image}) items; returns one DataFrame per item.
+    """
+    def process(items):
+        digests = [digest for digest, _ in items]
+        batches = {name: np.concatenate([images[name] for _, images in items]) for name in get_model_names(model_name)}
+        if model_name == ENSEMBLE:
+            return classify_ensemble(batches, digests, top, engine=engine)
+        return classify_preprocessed(batches[model_name], digests, model_name, top, engine)
+    return process
+
+def _predict_items(model_name, engine):
+    """
+    Creates the batch function of /predict, which returns the raw class probabilities.
+
+    Parameters:
+    - model_name (str): The name of the model.
+    - engine (str): The name of the inference engine.
+
+    Returns:
+    - callable: Called with preprocessed batches (np.array); returns the probabilities of each batch.
+    """
+    def process(items):
+        probabilities = get_engine(model_name, engine).predict(np.concatenate(items))
+        return np.split(probabilities, np.cumsum([len(item) for item in items])[:-1])
+    return process
+
+def _check_input_shape(model_name):
+    """
+    Creates the item check of /predict, which rejects batches that do not match the model's input.
+
+    Parameters:
+    - model_name (str): The name of the model.
+
+    Returns:
+    - callable: Called with a preprocessed batch (np.array); raises ValueError if its images have the wrong shape.
+    """
+    width, height = get_target_size(model_name)
+    def check(batch):
+        if batch.shape[1:] != (height, width, 3):
+            raise ValueError(f"{model_name} expects images of shape {(height, width, 3)}, got {batch.shape[1:]}")
+    return check
+
+class InferenceServer(ThreadingHTTPServer):
+    """
+    The HTTP server, holding one `MicroBatcher` per endpoint, model, engine and number of predictions.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS, engine=INFERENCE_SERVER_ENGINE):
+        if engine not in SERVER_ENGINES:
+            raise ValueError(f"Unsupported server inference engine: {engine}")
+        super().__init__(address, _InferenceHandler)
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._batchers = {}
+        self._batchers_lock = threading.Lock()
+
+    def get_batcher(self, key, create_process, check=None):
+        """
+        Returns the batcher for the given key, creating it on first use.
+
+        Parameters:
+        - key (tuple): The endpoint, model, engine and number of predictions.
+        - create_process (callable): Creates the batch function of a new batcher.
+        - check (callable, optional): The item check of a new batcher.
+
+        Returns:
+        - MicroBatcher: The batcher.
+        """
+        with self._batchers_lock:
+            if key not in self._batchers:
+                self._batchers[key] = MicroBatcher(create_process(), self.max_batch_size, self.max_wait, name=f"batcher-{'-'.join(map(str, key))}", check=check)
+            return self._batchers[key]
+
+class _InferenceHandler(BaseHTTPRequestHandler):
+    def _send(self, status, body, content_type='application/json'):
+        if content_type == 'application/json':
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length > INFERENCE_SERVER_MAX_BODY_MB * 1024 * 1024:
+            raise ValueError(f"The request body exceeds {INFERENCE_SERVER_MAX_BODY_MB} MB")
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/health':
+            self.send_error(404)
+            return
+        self._send(200, {'status': 'ok', 'models': [f'{model_name}/{engine}' for model_name, engine in loaded_models()]})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path not in ('/classify', '/predict'):
+            self.send_error(404)
+            return
+        try:
+            model_name = params.get('model', 'ResNet50')
+            engine = params.get('engine') or self.server.engine
+            if model_name not in (*MODEL_NAMES, ENSEMBLE) or (url.path == '/predict' and model_name == ENSEMBLE):
+                raise ValueError(f"Unsupported model: {model_name}")
+            if engine not in SERVER_ENGINES:
+                raise ValueError(f"Unsupported server inference engine: {engine}")
+            body = self._read_body()
+            if url.path == '/classify':
+                self._send(200, self._classify(body, params, model_name, engine))
+            else:
+                self._send(200, self._predict(body, model_name, engine), 'application/octet-stream')
+        except ValueError as e:
+            self._send(400, {'error': str(e)})
+        except Exception as e:
+            self._send(500, {'error': str(e)})
+
+    def _classify(self, body, params, model_name, engine):
+        top = int(params.get('top', 5))
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            sources = [(path, path) for path in json.loads(body).get('paths', [])]
+        else:
+            sources = [(params.get('name'), body)]
+        model_names = get_model_names(model_name)
+        batcher = self.server.get_batcher(('classify', model_name, engine, top), lambda: _classify_items(model_name, top, engine))
+        pending = []
+        for name, source in sources:
+            try:
+                digest, image, thumbnail = ingest_image(source, get_decode_size(model_names))
+            except Exception as e:
+                pending.append((name, None, str(e)))
+                continue
+            images = {image_model: preprocess_batch([image], image_model) for image_model in model_names}
+            image.close()
+            thumbnail.close()
+            pending.append((name, digest, batcher.submit((digest, images))))
+        results = []
+        for name, digest, outcome in pending:
+            if digest is None:
+                results.append({'name': name, 'error': outcome})
+            else:
+                results.append({'name': name, 'digest': digest, 'predictions': outcome.result().to_dict(orient='records')})
+        return {'model': model_name, 'engine': engine, 'results': results}
+
+    def _predict(self, body, model_name, engine):
+        batch = np.load(BytesIO(body), allow_pickle=False)
+        if batch.ndim != 4:
+            raise ValueError(f"Expected a batch of shape (images, height, width, channels), got {batch.shape}")
+        batcher = self.server.get_batcher(('predict', model_name, engine), lambda: _predict_items(model_name, engine), _check_input_shape(model_name))
+        output = BytesIO()
+        np.save(output, batcher.submit(batch, len(batch)).result())
+        return output.getvalue()
+
+    def log_message(self, format, *args):
+        pass
+
+def create_inference_server(host=INFERENCE_SERVER_HOST, port=INFERENCE_SERVER_PORT, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                            engine=INFERENCE_SERVER_ENGINE):
+    """
+    Creates the inference server. Call `serve_forever` on it to handle requests.
+
+    Parameters:
+    - host (str): The address to listen on. Default is `INFERENCE_SERVER_HOST`.
+    - port (int): The port to listen on. Default is `INFERENCE_SERVER_PORT`.
+    - max_batch_size (int): The largest number of images per forward pass. Default is `BATCH_MAX_SIZE`.
+    - max_wait_ms (float): The longest time in milliseconds a batch waits for more requests. Default is `BATCH_MAX_WAIT_MS`.
+    - engine (str): The inference engine of requests that do not name one; any of `SERVER_ENGINES`. Default is `INFERENCE_SERVER_ENGINE`.
+
+    Returns:
+    - InferenceServer: The server.
+
+    Raises:
+    - ValueError: If the engine is not supported by the server.
+    """
+    return InferenceServer((host, port), max_batch_size, max_wait_ms, engine)
@@ -0,0 +1,156 @@
+"""
+This module decodes uploaded and fetched images for classification and display.
+JPEG images are decoded with PIL's draft mode, which lets the decoder scale the image down by 1/2, 1/4 or 1/8 while decoding,
+so a large photo is never fully decoded when the model only needs a few hundred pixels.
+The same decode also produces the thumbnail shown in the app, which is kept as a small JPEG rather than as decoded pixels.
+"""
+
+import os
+import signal
+from io import BytesIO
+from PIL import Image
+from dedup import dhash
+from metrics import drain, reset_metrics, timer
+from prediction_cache import image_digest
+from preprocessing import get_target_size, preprocess_batch
+
+THUMBNAIL_SIZE = (int(os.getenv('THUMBNAIL_SIZE', 384)),) * 2
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', 85))
+
+def open_image(source):
+    """
+    Opens an image without decoding it.
+
+    Parameters:
+    - source (bytes, str or file-like): The encoded image content, a file path, or a readable buffer such as a Streamlit upload.
+
+    Returns:
+    - image (PIL.Image): The opened image.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        # BytesIO shares the bytes object until it is written to, so this does not copy the content
+        source = BytesIO(source)
+    elif hasattr(source, 'seek'):
+        source.seek(0)
+    return Image.open(source)
+
+def decode_image(source, target_size, thumbnail_size=THUMBNAIL_SIZE):
+    """
+    Decodes an image close to the size it is needed at and creates its display thumbnail.
+    For JPEGs the decoder scales the image down to the smallest size that still covers both the model's input size
+    and the thumbnail size. Other formats are decoded at full size.
+
+    Parameters:
+    - source (bytes, str or file-like): The encoded image content, a file path, or a readable buffer such as a Streamlit upload.
+    - target_size (tuple): The (width, height) input size of the model.
+    - thumbnail_size (tuple): The bounding box of the thumbnail. Default is `THUMBNAIL_SIZE`.
+
+    Returns:
+    - tuple: The decoded image (PIL.Image) and its thumbnail (PIL.Image).
+    """
+    with timer('decode'):
+        image = open_image(source)
+        if image.format == 'JPEG':
+            draft_size = (max(target_size[0], thumbnail_size[0]), max(target_size[1], thumbnail_size[1]))
+            image.draft(image.mode, draft_size)
+        image.load()
+        thumbnail = image.copy()
+        thumbnail.thumbnail(thumbnail_size)
+    return image, thumbnail
+
+def ingest_image(source, target_size, thumbnail_size=THUMBNAIL_SIZE):
+    """
+    Reads an image once to compute its content hash, decode it and create its thumbnail.
+
+    Parameters:
+    - source (bytes, str or file-like): The encoded image content, a file path, or a readable buffer such as a Streamlit upload.
+    - target_size (tuple): The (width, height) input size of the model.
+    - thumbnail_size (tuple): The bounding box of the thumbnail. Default is `THUMBNAIL_SIZE`.
+
+    Returns:
+    - tuple: The content hash (str), the decoded image (PIL.Image) and its thumbnail (PIL.Image).
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            source = f.read()
+    digest = image_digest(source.getbuffer() if hasattr(source, 'getbuffer') else source)
+    image, thumbnail = decode_image(source, target_size, thumbnail_size)
+    return digest, image, thumbnail
+
+def encode_thumbnail(thumbnail, quality=THUMBNAIL_QUALITY):
+    """
+    Encodes a thumbnail as JPEG, which takes a fraction of the memory of its decoded pixels.
+
+    Parameters:
+    - thumbnail (PIL.Image): The thumbnail.
+    - quality (int): The JPEG quality. Default is `THUMBNAIL_QUALITY`.
+
+    Returns:
+    - bytes: The encoded thumbnail.
+    """
+    if thumbnail.mode not in ('RGB', 'L'):
+        thumbnail = thumbnail.convert('RGB')
+    buffer = BytesIO()
+    thumbnail.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+def get_decode_size(model_names):
+    """
+    Returns the size an image must be decoded at to serve all the given models.
+
+    Parameters:
+    - model_names (list): The names of the models.
+
+    Returns:
+    - tuple: The largest (width, height) input size of the models.
+    """
+    sizes = [get_target_size(model_name) for model_name in model_names]
+    return max(width for width, _ in sizes), max(height for _, height in sizes)
+
+def prepare_image(name, source, model_names, thumbnail_size=THUMBNAIL_SIZE):
+    """
+    Reads and decodes one image once, then preprocesses it for each of the given models and computes its perceptual hash.
+    This function runs in the pipeline's worker processes, so its arguments and return value must be picklable.
+
+    Parameters:
+    - name (str): The name of the image.
+    - source (bytes or str): The encoded image content or a file path.
+    - model_names (list): The names of the models to use for classification.
+    - thumbnail_size (tuple): The bounding box of the thumbnail. Default is `THUMBNAIL_SIZE`.
+
+    Returns:
+    - tuple: The name, the content hash, the preprocessed image of each model (dict of np.array of shape (1, height, width, 3),
+      keyed by model name), the JPEG-encoded thumbnail (bytes) and the difference hash (int) used to find near-duplicates.
+    """
+    digest, image, thumbnail = ingest_image(source, get_decode_size(model_names), thumbnail_size)
+    preprocessed = {model_name: preprocess_batch([image], model_name) for model_name in model_names}
+    image_hash = dhash(image)
+    # Release the decoded pixels now rather than when the worker picks up its next image
+    image.close()
+    return name, digest, preprocessed, encode_thumbnail(thumbnail), image_hash
+
+def init_worker():
+    """
+    Prepares a worker process of the pipeline. Ctrl+C reaches every process in the terminal's process group; only the parent
+    process handles it, so the workers keep decoding the images already submitted.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Forked workers inherit the parent's metrics, which must not be sent back a second time
+    reset_metrics()
+
+def prepare_image_in_worker(name, source, model_names, collect_metrics):
+    """
+    Decodes and preprocesses one image in a worker of the pipeline, returning the metrics the worker recorded along with the result.
+    The pipeline's worker processes run this module's functions, so they only import PIL, NumPy and the preprocessing code.
+
+    Parameters:
+    - name (str): The name of the image.
+    - source (bytes or str): The encoded image content or a file path.
+    - model_names (list): The names of the models to preprocess the image for.
+    - collect_metrics (bool): Whether the worker runs in another process, whose metrics must be sent back.
+
+    Returns:
+    - tuple: The result of `prepare_image`, and the worker's metrics as returned by `metrics.drain` (or None).
+    """
+    result = prepare_image(name, source, model_names)
+    return result, drain() if collect_metrics else None
@@ -15,15 +15,17 @@ def instructions():
 
     **Local Image Handling**
     - Upload an image from your local host or folder using the file uploader.
-    - Choose a model for classification from the dropdown menu.
+    - Choose a model for classification from the dropdown menu, or "Ensemble" to combine the predictions of all three models.
     - Click the "Classify" button
-    - The uploaded image will be classified, and the results will be displayed and saved to an Excel file.
+    - The uploaded image will be classified, and the results will be displayed and saved.
+    - Click the "Export Results to Excel" button to write the saved results to an Excel file.
 
     **Online Image Handling**
     - Select the number of images to download from Unsplash.
     - Click "Fetch & Classify" button to download and display the images.
     - Choose a model for classification from the dropdown menu.
-    - The images will be classified, and the results will be displayed and saved to an Excel file.
+    - The images will be classified, and the results will be displayed and saved.
+    - Classification runs in the background: you can keep using the app while it runs, or cancel it.
 
     --- 
     ### User Selected Images
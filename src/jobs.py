@@ -0,0 +1,483 @@
+"""
+This module runs classification and fetch jobs in the background, so they keep running when the Streamlit script reruns or the browser tab closes.
+Jobs are queued in a SQLite file and run by a pool of worker threads in the server process. All sessions share the same workers,
+so every job uses the models already loaded in the model registry. Each classified image is written to the job's results as it completes,
+and the UI polls `get_job` and `get_job_results` to show the progress and the results incrementally.
+While a job runs, a heartbeat thread updates it every `JOB_HEARTBEAT_SECONDS`, even when no image completes for a while (for example
+while model weights are downloaded or converted). A job left 'running' by a server that stopped is put back in the queue once it has not
+been updated for `JOB_STALE_SECONDS`.
+Cancelling a running job marks it 'cancelling' in the jobs file, so any process can cancel it; the job checks its status after each
+image and on each heartbeat, and stops after the image it is working on. Finished jobs and their results (which hold the thumbnails)
+are deleted `JOB_RETENTION_SECONDS` after they finished.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from io import StringIO
+import pandas as pd
+from file_operations import output_dir
+from pipeline import classify_sources, fetch_and_classify
+
+JOBS_FILE = os.path.join(output_dir, 'jobs.sqlite3')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 1))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', 300))
+JOB_CANCEL_TIMEOUT = float(os.getenv('JOB_CANCEL_TIMEOUT', 30))
+JOB_HEARTBEAT_SECONDS = float(os.getenv('JOB_HEARTBEAT_SECONDS', min(30, JOB_STALE_SECONDS / 3)))
+JOB_RETENTION_SECONDS = float(os.getenv('JOB_RETENTION_SECONDS', 24 * 3600))
+JOB_KINDS = ['classify', 'fetch']
+FETCH_DIRECTORIES = {'Unsplash': ('unsplash_images', 'unsplash'), 'Pexels': ('pexels_images', 'pexels')}
+# The statuses of jobs that have not finished
+ACTIVE_JOB_STATUSES = ('queued', 'running', 'cancelling')
+
+_local = threading.local()
+_lock = threading.Lock()
+_wake = threading.Condition()
+_workers = []
+
+class JobCancelled(Exception):
+    """
+    Raised inside a running job to stop it when its cancellation was requested.
+    """
+
+def _get_connection():
+    """
+    Returns the SQLite connection of the current thread, creating the jobs file on first use.
+
+    Returns:
+    - sqlite3.Connection: The connection to the jobs file.
+    """
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        os.makedirs(output_dir, exist_ok=True)
+        connection = sqlite3.connect(JOBS_FILE, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'job_id TEXT PRIMARY KEY, kind TEXT, params TEXT, status TEXT, completed INTEGER, total INTEGER, '
+            'error TEXT, created_at REAL, started_at REAL, updated_at REAL, finished_at REAL)'
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS job_results ('
+            'job_id TEXT, seq INTEGER, name TEXT, thumbnail BLOB, predictions TEXT, PRIMARY KEY (job_id, seq))'
+        )
+        _local.connection = connection
+    return connection
+
+def submit_job(kind, params):
+    """
+    Adds a job to the queue and wakes up a worker.
+
+    Parameters:
+    - kind (str): 'classify' or 'fetch'.
+    - params (dict): The JSON-serializable parameters of the job (see `submit_classify_job` and `submit_fetch_job`).
+
+    Returns:
+    - str: The ID of the job.
+
+    Raises:
+    - ValueError: If the kind of job is not supported.
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unsupported job kind: {kind}")
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    connection = _get_connection()
+    with connection:
+        connection.execute(
+            'INSERT INTO jobs VALUES (?, ?, ?, ?, 0, NULL, NULL, ?, NULL, ?, NULL)',
+            (job_id, kind, json.dumps(params), 'queued', now, now)
+        )
+    with _wake:
+        _wake.notify()
+    return job_id
+
+def submit_classify_job(sources, model_name, engine=None):
+    """
+    Queues a job that classifies images saved on disk.
+
+    Parameters:
+    - sources (list): (name, path) pairs of the images to classify.
+    - model_name (str): The name of the model to use for classification.
+    - engine (str, optional): The name of the inference engine. Defaults to `INFERENCE_ENGINE`.
+
+    Returns:
+    - str: The ID of the job.
+    """
+    return submit_job('classify', {'sources': [list(source) for source in sources], 'model_name': model_name, 'engine': engine})
+
+def submit_fetch_job(site_counts, model_name, keep_originals=False, engine=None):
+    """
+    Queues a job that fetches images from Unsplash and/or Pexels and classifies them.
+
+    Parameters:
+    - site_counts (list): (site, number of images) pairs, fetched in order.
+    - model_name (str): The name of the model to use for classification.
+    - keep_originals (bool): Whether to download full-resolution originals. Default is False.
+    - engine (str, optional): The name of the inference engine. Defaults to `INFERENCE_ENGINE`.
+
+    Returns:
+    - str: The ID of the job.
+    """
+    return submit_job('fetch', {
+        'site_counts': [list(site_count) for site_count in site_counts], 'model_name': model_name,
+        'keep_originals': keep_originals, 'engine': engine,
+    })
+
+def _row_to_job(row):
+    """
+    Converts a row of the jobs table to a dictionary.
+
+    Parameters:
+    - row (tuple): The row.
+
+    Returns:
+    - dict: The job.
+    """
+    keys = ['job_id', 'kind', 'params', 'status', 'completed', 'total', 'error', 'created_at', 'started_at', 'updated_at', 'finished_at']
+    job = dict(zip(keys, row))
+    job['params'] = json.loads(job['params'])
+    return job
+
+def get_job(job_id):
+    """
+    Returns the state of a job.
+
+    Parameters:
+    - job_id (str): The ID of the job.
+
+    Returns:
+    - dict: The job's kind, parameters, status ('queued', 'running', 'cancelling', 'done', 'failed' or 'cancelled'),
+      number of completed and total images, error message and timestamps. None if the job does not exist.
+    """
+    row = _get_connection().execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+    return _row_to_job(row) if row else None
+
+def list_jobs(limit=20):
+    """
+    Returns the most recent jobs.
+
+    Parameters:
+    - limit (int): The maximum number of jobs to return. Default is 20.
+
+    Returns:
+    - list: The jobs, most recent first, as returned by `get_job`.
+    """
+    rows = _get_connection().execute('SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?', (limit,)).fetchall()
+    return [_row_to_job(row) for row in rows]
+
+def get_job_results(job_id, start=0, limit=None):
+    """
+    Returns the results a job has produced so far, in the order the images completed.
+
+    Parameters:
+    - job_id (str): The ID of the job.
+    - start (int): The number of results to skip. Default is 0.
+    - limit (int, optional): The maximum number of results to return. Defaults to all.
+
+    Returns:
+    - list: The (name, JPEG thumbnail, classification_data) tuples of the classified images.
+    """
+    rows = _get_connection().execute(
+        'SELECT name, thumbnail, predictions FROM job_results WHERE job_id = ? ORDER BY seq LIMIT ? OFFSET ?',
+        (job_id, -1 if limit is None else limit, start)
+    ).fetchall()
+    return [(name, thumbnail, pd.read_json(StringIO(predictions), orient='split')) for name, thumbnail, predictions in rows]
+
+def count_job_results(job_id):
+    """
+    Returns the number of results a job has produced so far.
+
+    Parameters:
+    - job_id (str): The ID of the job.
+
+    Returns:
+    - int: The number of classified images.
+    """
+    return _get_connection().execute('SELECT COUNT(*) FROM job_results WHERE job_id = ?', (job_id,)).fetchone()[0]
+
+def cancel_job(job_id):
+    """
+    Cancels a job. A queued job is cancelled immediately; a running job, in any process, is marked 'cancelling' and stops
+    after the image it is working on.
+
+    Parameters:
+    - job_id (str): The ID of the job.
+    """
+    connection = _get_connection()
+    with connection:
+        connection.execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE job_id = ? AND status = 'queued'", (time.time(), job_id)
+        )
+        connection.execute("UPDATE jobs SET status = 'cancelling' WHERE job_id = ? AND status = 'running'", (job_id,))
+
+def delete_job(job_id):
+    """
+    Deletes a finished job and its results. Jobs that have not finished are kept.
+
+    Parameters:
+    - job_id (str): The ID of the job.
+
+    Returns:
+    - bool: True if the job was deleted.
+    """
+    connection = _get_connection()
+    with connection:
+        deleted = connection.execute(
+            f"DELETE FROM jobs WHERE job_id = ? AND status NOT IN ({', '.join('?' * len(ACTIVE_JOB_STATUSES))})", (job_id, *ACTIVE_JOB_STATUSES)
+        ).rowcount
+        if deleted:
+            connection.execute('DELETE FROM job_results WHERE job_id = ?', (job_id,))
+    return bool(deleted)
+
+def delete_expired_jobs(retention_seconds=JOB_RETENTION_SECONDS):
+    """
+    Deletes the jobs that finished more than `retention_seconds` ago, with their results.
+
+    Parameters:
+    - retention_seconds (float): How long a finished job and its results are kept. Default is `JOB_RETENTION_SECONDS`.
+
+    Returns:
+    - int: The number of deleted jobs.
+    """
+    connection = _get_connection()
+    with connection:
+        expired = [row[0] for row in connection.execute(
+            'SELECT job_id FROM jobs WHERE finished_at < ?', (time.time() - retention_seconds,)
+        )]
+        for job_id in expired:
+            connection.execute('DELETE FROM job_results WHERE job_id = ?', (job_id,))
+            connection.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+    return len(expired)
+
+def list_active_jobs(kind=None):
+    """
+    Returns the jobs that are queued or running, in any session or process.
+
+    Parameters:
+    - kind (str, optional): Only return jobs of this kind ('classify' or 'fetch'). Defaults to all kinds.
+
+    Returns:
+    - list: The jobs, oldest first, as returned by `get_job`.
+    """
+    query = f"SELECT * FROM jobs WHERE status IN ({', '.join('?' * len(ACTIVE_JOB_STATUSES))})" + (' AND kind = ?' if kind else '') + ' ORDER BY created_at'
+    rows = _get_connection().execute(query, (*ACTIVE_JOB_STATUSES, kind) if kind else ACTIVE_JOB_STATUSES).fetchall()
+    return [_row_to_job(row) for row in rows]
+
+def wait_for_jobs(job_ids, timeout=JOB_CANCEL_TIMEOUT):
+    """
+    Waits until jobs are no longer queued or running, for example after cancelling them.
+
+    Parameters:
+    - job_ids (list): The IDs of the jobs.
+    - timeout (float): The longest time to wait in seconds. Default is `JOB_CANCEL_TIMEOUT`.
+
+    Returns:
+    - bool: True if all the jobs have stopped, False if the timeout expired first.
+    """
+    deadline = time.monotonic() + timeout
+    pending = list(job_ids)
+    while True:
+        pending = [job_id for job_id in pending if (get_job(job_id) or {}).get('status') in ACTIVE_JOB_STATUSES]
+        if not pending:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(JOB_POLL_INTERVAL)
+
+def requeue_interrupted_jobs(stale_seconds=JOB_STALE_SECONDS):
+    """
+    Puts jobs that are marked as running but have not been updated recently back in the queue.
+    Their partial results are removed, and the images they had already classified are answered from the prediction cache.
+    Interrupted jobs that were being cancelled are marked as cancelled instead.
+
+    Parameters:
+    - stale_seconds (float): How long a running job may go without an update before it is considered interrupted. Default is `JOB_STALE_SECONDS`.
+
+    Returns:
+    - int: The number of requeued jobs.
+    """
+    connection = _get_connection()
+    with connection:
+        stale = [row[0] for row in connection.execute(
+            "SELECT job_id FROM jobs WHERE status = 'running' AND updated_at < ?", (time.time() - stale_seconds,)
+        )]
+        for job_id in stale:
+            connection.execute('DELETE FROM job_results WHERE job_id = ?', (job_id,))
+            connection.execute("UPDATE jobs SET status = 'queued', completed = 0, started_at = NULL WHERE job_id = ?", (job_id,))
+        connection.execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE status = 'cancelling' AND updated_at < ?",
+            (time.time(), time.time() - stale_seconds)
+        )
+    for job_id in stale:
+        print(f"Requeued interrupted job {job_id}.")
+    return len(stale)
+
+def _claim_next_job():
+    """
+    Marks the oldest queued job as running and returns it. The claim runs in an exclusive transaction,
+    so a job is never picked up by two workers, even across processes.
+
+    Returns:
+    - dict: The claimed job, or None if the queue is empty.
+    """
+    connection = _get_connection()
+    now = time.time()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        row = connection.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+        if row is not None:
+            connection.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, updated_at = ? WHERE job_id = ?", (now, now, row[0])
+            )
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return _row_to_job(row) if row else None
+
+def _is_cancelling(connection, job_id):
+    """
+    Returns whether the cancellation of a running job was requested.
+
+    Parameters:
+    - connection (sqlite3.Connection): The connection of the current thread.
+    - job_id (str): The ID of the job.
+
+    Returns:
+    - bool: True if the job is marked 'cancelling'.
+    """
+    row = connection.execute('SELECT status FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+    return row is not None and row[0] == 'cancelling'
+
+def _heartbeat(job_id, stop, cancelled):
+    """
+    Updates a running job every `JOB_HEARTBEAT_SECONDS` until it finishes, so it is not mistaken for an interrupted job,
+    and checks whether its cancellation was requested.
+
+    Parameters:
+    - job_id (str): The ID of the job.
+    - stop (threading.Event): Set when the job has finished.
+    - cancelled (threading.Event): Set by the heartbeat once the job is marked 'cancelling'.
+    """
+    connection = _get_connection()
+    try:
+        while not stop.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                with connection:
+                    connection.execute(
+                        "UPDATE jobs SET updated_at = ? WHERE job_id = ? AND status IN ('running', 'cancelling')", (time.time(), job_id)
+                    )
+                if _is_cancelling(connection, job_id):
+                    cancelled.set()
+            except sqlite3.Error as e:
+                print(f"Could not update job {job_id}: {e}")
+    finally:
+        connection.close()
+        _local.connection = None
+
+def _run_job(job):
+    """
+    Runs a claimed job to completion and records its results, progress and final status.
+
+    Parameters:
+    - job (dict): The job, as returned by `_claim_next_job`.
+    """
+    connection = _get_connection()
+    job_id, params = job['job_id'], job['params']
+    results = [0]
+    offset = [0]
+
+    def on_result(name, thumbnail, classification_data):
+        results[0] += 1
+        with connection:
+            connection.execute(
+                'INSERT INTO job_results VALUES (?, ?, ?, ?, ?)',
+                (job_id, results[0], name, thumbnail, classification_data.to_json(orient='split', index=False))
+            )
+
+    def on_progress(completed, total):
+        with connection:
+            connection.execute(
+                'UPDATE jobs SET completed = ?, updated_at = ? WHERE job_id = ?', (offset[0] + completed, time.time(), job_id)
+            )
+        if cancelled.is_set() or _is_cancelling(connection, job_id):
+            raise JobCancelled()
+
+    status, error = 'done', None
+    stop_heartbeat = threading.Event()
+    cancelled = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, stop_heartbeat, cancelled), name=f'job-heartbeat-{job_id}', daemon=True).start()
+    try:
+        if job['kind'] == 'classify':
+            sources = [tuple(source) for source in params['sources']]
+            with connection:
+                connection.execute('UPDATE jobs SET total = ? WHERE job_id = ?', (len(sources), job_id))
+            classify_sources(
+                sources, params['model_name'], on_result=on_result, on_progress=on_progress,
+                total=len(sources), engine=params.get('engine'),
+            )
+        else:
+            with connection:
+                connection.execute('UPDATE jobs SET total = ? WHERE job_id = ?', (sum(count for _, count in params['site_counts']), job_id))
+            for site, num_images in params['site_counts']:
+                directory, filename = FETCH_DIRECTORIES[site]
+                fetch_and_classify(
+                    site, num_images, params['model_name'], directory, filename, params.get('keep_originals', False),
+                    on_result=on_result, on_progress=on_progress, engine=params.get('engine'),
+                )
+                offset[0] += num_images
+    except JobCancelled:
+        status = 'cancelled'
+    except Exception as e:
+        print(f"Job {job_id} failed: {e}")
+        status, error = 'failed', str(e)
+    finally:
+        stop_heartbeat.set()
+    with connection:
+        connection.execute(
+            'UPDATE jobs SET status = ?, error = ?, updated_at = ?, finished_at = ? WHERE job_id = ?',
+            (status, error, time.time(), time.time(), job_id)
+        )
+
+def _work():
+    """
+    Runs queued jobs one after another. Waits for `submit_job` to wake it up, or polls the queue every `JOB_POLL_INTERVAL`
+    seconds for jobs submitted by other processes.
+    """
+    while True:
+        try:
+            requeue_interrupted_jobs()
+            delete_expired_jobs()
+            job = _claim_next_job()
+        except sqlite3.Error as e:
+            print(f"Could not read the job queue: {e}")
+            job = None
+        if job is None:
+            with _wake:
+                _wake.wait(timeout=JOB_POLL_INTERVAL)
+            continue
+        _run_job(job)
+
+def start_job_workers(workers=JOB_WORKERS):
+    """
+    Starts the worker threads that run the queued jobs, once per process.
+
+    Parameters:
+    - workers (int): The number of jobs that run at the same time. Default is `JOB_WORKERS`.
+
+    Returns:
+    - list: The worker threads.
+    """
+    with _lock:
+        if not _workers:
+            for index in range(max(workers, 1)):
+                thread = threading.Thread(target=_work, name=f'job-worker-{index}', daemon=True)
+                thread.start()
+                _workers.append(thread)
+        return list(_workers)
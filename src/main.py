@@ -4,13 +4,16 @@ It orchestrates the application's workflow, including handling user inputs, clas
 """
 
 import streamlit as st
-from PIL import Image
-from io import BytesIO
-from sidebar import display_sidebar
-from image_processing import classify_images
-from file_operations import save_image_to_local, delete_uploaded_images
-from results import process_and_save_results
-from app_mgt import fetch_and_classify_unsplash_images, fetch_and_classify_pexels_images, reset_fetched_images_state, fetch_alternating_images
+import os
+import time
+from sidebar import display_sidebar, display_performance_panel
+from file_operations import save_uploaded_image, delete_uploaded_images
+from display_app import display_job
+from results import export_results_button
+from app_mgt import reset_fetched_images_state, split_site_counts
+from jobs import ACTIVE_JOB_STATUSES, JOB_POLL_INTERVAL, cancel_job, count_job_results, get_job, get_job_results, start_job_workers, submit_classify_job, submit_fetch_job
+from model_registry import start_background_warm_up
+from metrics import start_metrics_server
 
 def main():
     # Initialize session state if it's not already initialized
@@ -18,18 +21,30 @@ def main():
         st.session_state.reset_fetched_images = False
     if 'first_run' not in st.session_state:
         st.session_state.first_run = True
+    if 'jobs' not in st.session_state:
+        st.session_state.jobs = []
+
+    # Import TensorFlow and load the models named in WARM_UP_MODELS in the background, once per process
+    start_background_warm_up()
+    # Serve the metrics at /metrics if METRICS_PORT is set, once per process
+    start_metrics_server()
+    # Run classification and fetch jobs on background threads shared by all sessions, once per process
+    start_job_workers()
 
     st.markdown('<style>h1{font-size: 35px;}</style>', unsafe_allow_html=True)
     st.title('Image Classification with Pre-Trained Models')
 
     # Display the sidebar and get the values of the buttons
-    image_files, model_name, classify, reset, num_images, site, fetch_classify, reset_images, _ = display_sidebar()
+    image_files, model_name, classify, reset, num_images, site, model_name_fetch, fetch_classify, reset_images, keep_originals = display_sidebar()
 
     # Check if the reset button was clicked and reset the state accordingly
     if reset or reset_images:
-        reset_fetched_images_state()
+        # The jobs of this session are cancelled before their images are deleted, and stay listed if they could not be stopped
+        if reset_fetched_images_state(st.session_state.jobs):
+            st.session_state.jobs = []
         st.session_state.reset_fetched_images = False # Reset the flag after handling
 
+    active = False
     if st.session_state.first_run:
         st.success("Read the instructions on the left side panel for detailed steps.")
         st.session_state.first_run = False
@@ -39,46 +54,45 @@ def main():
             st.session_state.first_run = True
             st.rerun()
 
+        # Write the Excel file from the saved results only when the user asks for it
+        export_results_button()
+
         if classify:
             if image_files:
-                # Initialize a progress bar
-                progress_bar = st.progress(0)
-                total_images = len(image_files)
-
-                for i, uploaded_file in enumerate(image_files):
-                    image = Image.open(BytesIO(uploaded_file.read()))
-                    save_image_to_local(image)
-
-                    classification_data = classify_images(image, model_name)
-                    col1, col2 = st.columns(2)
-                    col1.image(image, caption='Uploaded Image.', use_column_width=True)
-                    col2.markdown("###### Classification Data")
-                    col2.dataframe(classification_data)
-                    process_and_save_results(image, model_name, classification_data)
-
-                    # Update the progress bar
-                    progress = (i + 1) / total_images
-                    progress_bar.progress(progress)
-
-                # Complete the progress bar
-                progress_bar.progress(1.0)
-                st.success("All images have been classified!")
+                # Save each original file as uploaded; the job's pipeline workers read and decode them from disk one at a time
+                sources = []
+                for uploaded_file in image_files:
+                    image_path = os.path.join('local_images', f'{time.time()}_{uploaded_file.name}')
+                    save_uploaded_image(uploaded_file, image_path)
+                    sources.append((uploaded_file.name, image_path))
+                st.session_state.jobs.append(submit_classify_job(sources, model_name))
             else:
                 st.warning("Please upload at least one image.")
 
         if fetch_classify:
-            if site == 'Unsplash':
-                results = fetch_and_classify_unsplash_images(num_images, model_name, fetch_classify)
-            elif site == 'Pexels':
-                results = fetch_and_classify_pexels_images(num_images, model_name, fetch_classify)
-            elif site == 'Both':
-                # Implement logic for fetching and classifying images from both sites alternatively
-                results = fetch_alternating_images(num_images, model_name, fetch_classify)
+            site_counts = split_site_counts(site, num_images)
+            if site_counts:
+                st.session_state.jobs.append(submit_fetch_job(site_counts, model_name_fetch, keep_originals))
             else:
-                results = []
-            
-            # Display the results DataFrame
-            st.dataframe(results)
+                st.warning("Please select the number of images to fetch.")
+
+        # Show the jobs started in this session, most recent first. They run in the background, so reruns do not interrupt them.
+        for job_id in reversed(st.session_state.jobs):
+            job = get_job(job_id)
+            if job is None:
+                continue
+            load_results = lambda start, limit, job_id=job_id: get_job_results(job_id, start, limit)
+            if display_job(job, count_job_results(job_id), load_results):
+                cancel_job(job_id)
+            active = active or job['status'] in ACTIVE_JOB_STATUSES
+
+    # Drawn last, so the panel includes the timings of this run
+    display_performance_panel()
+
+    # Poll the running jobs by rerunning the script until they finish
+    if active:
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,362 @@
+"""
+This module records which image files have already been classified, so repeated runs over the same folders only classify what changed.
+The manifest is a SQLite table in `MANIFEST_FILE` with one row per file and model: its path, size, modification time, content hash
+and the ID of its result in the results store. A file is classified again only if its size or modification time changed.
+Two ways of finding the files to classify are provided:
+- `Manifest.changed_files` lists the files of a directory or glob pattern that are new or modified since they were recorded.
+  This costs one `os.stat` per file, but no reads or decodes for unchanged files.
+- `FileWatcher` reports files as they are written to a set of directories, using inotify on Linux and polling elsewhere
+  (or when `WATCH_POLLING` is set), so a long-running process only touches new files. `Manifest.watch` starts watching, then scans
+  for changes, so files written during the scan are reported too; a file reported by both is only classified once.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from file_operations import output_dir
+from pipeline import IMAGE_EXTENSIONS, iter_image_files
+from results_store import flush_results
+
+MANIFEST_FILE = os.path.join(output_dir, 'manifest.sqlite3')
+MANIFEST_FLUSH_ROWS = int(os.getenv('MANIFEST_FLUSH_ROWS', 200))
+MANIFEST_FLUSH_SECONDS = float(os.getenv('MANIFEST_FLUSH_SECONDS', 5))
+WATCH_INTERVAL = float(os.getenv('WATCH_INTERVAL', 2))
+WATCH_POLLING = os.getenv('WATCH_POLLING', '0') == '1'
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_ISDIR = 0x40000000
+_EVENT_HEADER = struct.Struct('iIII')
+
+class Manifest:
+    """
+    The classified files of one model, as recorded in the manifest.
+    Records are buffered and written together, after the results they point to have been flushed to the results store.
+    """
+
+    def __init__(self, model_name, path=MANIFEST_FILE):
+        """
+        Parameters:
+        - model_name (str): The model (and engine) the files were classified with, as returned by `image_processing.cache_model_key`.
+        - path (str): The path of the manifest database. Default is `MANIFEST_FILE`.
+        """
+        self.model_name = model_name
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS manifest (path TEXT, model TEXT, size INTEGER, mtime_ns INTEGER, digest TEXT, '
+            'result_id TEXT, classified_at REAL, PRIMARY KEY (path, model))'
+        )
+        self._lock = threading.Lock()
+        # The size and modification time of the files handed out for classification, keyed by path
+        self._queued = {}
+        self._buffer = []
+        self._flushed_at = time.monotonic()
+
+    def recorded(self):
+        """
+        Returns the size and modification time of every file recorded for the model.
+
+        Returns:
+        - dict: The (size, mtime_ns) of each recorded file, keyed by path.
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT path, size, mtime_ns FROM manifest WHERE model = ?', (self.model_name,))
+            return {path: (size, mtime_ns) for path, size, mtime_ns in rows}
+
+    def queue(self, path, stat=None):
+        """
+        Remembers the size and modification time of a file about to be classified, so that `record` stores the version that was read.
+
+        Parameters:
+        - path (str): The path of the file.
+        - stat (os.stat_result, optional): The file's status. Defaults to calling `os.stat`.
+        """
+        stat = stat or os.stat(path)
+        with self._lock:
+            self._queued[path] = (stat.st_size, stat.st_mtime_ns)
+
+    def _queue_if_changed(self, path, known):
+        """
+        Queues a file if its size or modification time differs from the known version, and makes it the known version.
+
+        Parameters:
+        - path (str): The absolute path of the file.
+        - known (dict): The (size, mtime_ns) of the files recorded or already handed out, keyed by path.
+
+        Returns:
+        - bool: True if the file was queued.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Deleted before it could be classified
+            return False
+        version = (stat.st_size, stat.st_mtime_ns)
+        if known.get(path) == version:
+            return False
+        known[path] = version
+        self.queue(path, stat)
+        return True
+
+    def changed_files(self, patterns, known=None):
+        """
+        Lists the image files that are new or modified since they were recorded, and queues them.
+
+        Parameters:
+        - patterns (list): Directories, files or glob patterns, as accepted by `pipeline.iter_image_files`.
+        - known (dict, optional): The (size, mtime_ns) of the files not to list, keyed by path; the listed files are added to it.
+          Defaults to the recorded files.
+
+        Yields:
+        - str: The path of each new or modified file.
+        """
+        known = self.recorded() if known is None else known
+        for pattern in patterns:
+            for path in iter_image_files(pattern):
+                path = os.path.abspath(path)
+                if self._queue_if_changed(path, known):
+                    yield path
+
+    def watch(self, directories, stop=None, interval=WATCH_INTERVAL):
+        """
+        Lists the files that are new or modified since they were recorded, then the files written to the directories while watching.
+        Watching starts before the directories are scanned, so no file written in between is missed.
+
+        Parameters:
+        - directories (list): The directories to scan and watch.
+        - stop (threading.Event, optional): Set to stop watching. Defaults to watching until the generator is closed.
+        - interval (float): The time between scans in seconds when polling. Default is `WATCH_INTERVAL`.
+
+        Yields:
+        - str: The path of each new or modified file.
+
+        Raises:
+        - ValueError: If one of the paths is not a directory.
+        """
+        stop = stop or threading.Event()
+        watcher = FileWatcher(directories, stop, interval)
+        try:
+            # A file written during the scan can be both listed and reported by the watcher; it is only handed out once per version
+            known = self.recorded()
+            for path in self.changed_files(directories, known):
+                if stop.is_set():
+                    return
+                yield path
+            for path in watcher:
+                if self._queue_if_changed(path, known):
+                    yield path
+        finally:
+            watcher.close()
+
+    def record(self, path, digest, result_id):
+        """
+        Records a file as classified. Files that could not be read are recorded too, so they are retried only once they change.
+        This is the `on_saved` callback of `pipeline.classify_sources`.
+
+        Parameters:
+        - path (str): The path of the file.
+        - digest (str): The content hash of the file, or None if it could not be read.
+        - result_id (str): The ID of its result in the results store, or None if no result was stored.
+        """
+        with self._lock:
+            size, mtime_ns = self._queued.pop(path, (None, None))
+            self._buffer.append((path, self.model_name, size, mtime_ns, digest, result_id, time.time()))
+            if len(self._buffer) >= MANIFEST_FLUSH_ROWS or time.monotonic() - self._flushed_at >= MANIFEST_FLUSH_SECONDS:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        """
+        Writes the buffered records. Must be called with `_lock` held.
+        """
+        self._flushed_at = time.monotonic()
+        if not self._buffer:
+            return
+        # A record must never point to a result that is still only in memory
+        flush_results()
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?, ?, ?, ?)', self._buffer)
+        self._buffer.clear()
+
+    def flush(self):
+        """
+        Writes the buffered records.
+        """
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """
+        Writes the buffered records and closes the manifest.
+        """
+        self.flush()
+        self._connection.close()
+
+def _load_inotify():
+    """
+    Loads the inotify functions of the C library.
+
+    Returns:
+    - ctypes.CDLL: The C library, or None if inotify is not available.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+def _is_image(path):
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+class FileWatcher:
+    """
+    Reports the image files written to a set of directories or their subdirectories. Watching starts when the watcher is created,
+    so files written while the directories are scanned for earlier changes are not missed. Iterate over the watcher to receive
+    the absolute path of each new or modified file, and call `close` when done.
+    """
+
+    def __init__(self, directories, stop=None, interval=WATCH_INTERVAL):
+        """
+        Parameters:
+        - directories (list): The directories to watch.
+        - stop (threading.Event, optional): Set to stop watching. Defaults to watching until the iteration is closed.
+        - interval (float): The time between scans in seconds when polling. Default is `WATCH_INTERVAL`.
+
+        Raises:
+        - ValueError: If one of the paths is not a directory.
+        """
+        for directory in directories:
+            if not os.path.isdir(directory):
+                raise ValueError(f"Only directories can be watched: {directory}")
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.stop = stop or threading.Event()
+        self.interval = interval
+        self._libc = None
+        self._fd = None
+        self._watches = {}
+        # The (size, mtime_ns) of each file seen by the previous scan when polling
+        self._seen = None
+        libc = None if WATCH_POLLING else _load_inotify()
+        if libc is not None:
+            try:
+                self._start_inotify(libc)
+                return
+            except OSError as e:
+                self.close()
+                print(f"Could not watch the directories with inotify, polling instead: {e}")
+        self._seen = {}
+        # The files already present are recorded without being reported
+        for _ in self._scan():
+            pass
+
+    def _start_inotify(self, libc):
+        """
+        Creates an inotify instance and watches every directory and subdirectory.
+
+        Parameters:
+        - libc (ctypes.CDLL): The C library.
+        """
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            self._fd = None
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        for directory in self.directories:
+            for root, _, _ in os.walk(directory):
+                self._add_watch(root)
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd >= 0:
+            self._watches[wd] = directory
+
+    def __iter__(self):
+        try:
+            yield from self._read_inotify() if self._fd is not None else self._poll()
+        finally:
+            self.close()
+
+    def _read_inotify(self):
+        """
+        Yields the image files closed after writing, or moved, into the watched directories.
+        """
+        while not self.stop.is_set():
+            readable, _, _ = select.select([self._fd], [], [], 0.5)
+            if not readable:
+                continue
+            data = os.read(self._fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + length].rstrip(b'\0')
+                offset += _EVENT_HEADER.size + length
+                if wd not in self._watches or not name:
+                    continue
+                path = os.path.join(self._watches[wd], os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        # Files written before the watch was added are found by listing the new directory
+                        self._add_watch(path)
+                        yield from (os.path.abspath(file) for file in iter_image_files(path))
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and _is_image(path):
+                    yield path
+
+    def _scan(self):
+        """
+        Yields the image files that appeared or changed in the watched directories since the previous scan.
+        """
+        for directory in self.directories:
+            for path in iter_image_files(directory):
+                path = os.path.abspath(path)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                version = (stat.st_size, stat.st_mtime_ns)
+                if self._seen.get(path) != version:
+                    self._seen[path] = version
+                    yield path
+
+    def _poll(self):
+        """
+        Yields the image files that appeared or changed in the watched directories, scanning every `interval` seconds.
+        """
+        while not self.stop.wait(self.interval):
+            yield from self._scan()
+
+    def close(self):
+        """
+        Stops watching.
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+def watch_files(directories, stop=None, interval=WATCH_INTERVAL):
+    """
+    Yields image files as they are written to the directories. Watching starts on the first iteration, and files already present
+    are not yielded; to list those without missing files written in between, create a `FileWatcher` before scanning the
+    directories, as `Manifest.watch` does.
+
+    Parameters:
+    - directories (list): The directories to watch, including their subdirectories.
+    - stop (threading.Event, optional): Set to stop watching. Defaults to watching until the generator is closed.
+    - interval (float): The time between scans in seconds when polling. Default is `WATCH_INTERVAL`.
+
+    Yields:
+    - str: The absolute path of each new or modified image file.
+    """
+    yield from FileWatcher(directories, stop, interval)
@@ -0,0 +1,248 @@
+"""
+This module collects lightweight timings, counters and gauges on the hot paths of the application:
+fetching, decoding, preprocessing, model loading, prediction, top-k decoding and persistence, as well as prediction cache hits and pipeline queue depths.
+The metrics can be read in three ways:
+- `snapshot()` returns them as a dictionary (the "Performance" panel in the sidebar shows it).
+- `render_prometheus()` formats them in the Prometheus text format, which `dump_metrics` writes to `METRICS_FILE`
+  and `start_metrics_server` serves on `METRICS_PORT`.
+When `METRICS_ENABLED` is set to 0, the recording functions return immediately and `timer` returns a shared no-op context manager.
+"""
+
+import contextlib
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') != '0'
+METRICS_FILE = os.getenv('METRICS_FILE') or None
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_PREFIX = 'imageclassification'
+
+# Timer statistics are [count, total seconds, max seconds]
+_timers = {}
+_counters = {}
+_gauges = {}
+_lock = threading.Lock()
+_server = None
+_NULL_TIMER = contextlib.nullcontext()
+
+def observe(name, seconds):
+    """
+    Records one timing.
+
+    Parameters:
+    - name (str): The name of the timed stage, such as 'decode' or 'predict'.
+    - seconds (float): The duration in seconds.
+    """
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        stats = _timers.get(name)
+        if stats is None:
+            _timers[name] = [1, seconds, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds > stats[2]:
+                stats[2] = seconds
+
+@contextlib.contextmanager
+def _timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def timer(name):
+    """
+    Returns a context manager that records how long its block takes.
+
+    Parameters:
+    - name (str): The name of the timed stage, such as 'decode' or 'predict'.
+
+    Returns:
+    - context manager: The timer, or a no-op context manager when metrics are disabled.
+    """
+    return _timer(name) if METRICS_ENABLED else _NULL_TIMER
+
+def increment(name, amount=1):
+    """
+    Increases a counter.
+
+    Parameters:
+    - name (str): The name of the counter, such as 'cache_hits'.
+    - amount (int): The amount to add. Default is 1.
+    """
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def set_gauge(name, value):
+    """
+    Sets a gauge to its current value.
+
+    Parameters:
+    - name (str): The name of the gauge, such as 'queue_depth_prepared'.
+    - value (float): The current value.
+    """
+    if METRICS_ENABLED:
+        _gauges[name] = value
+
+def snapshot():
+    """
+    Returns the metrics collected so far in this process.
+
+    Returns:
+    - dict: The timers (count, total, mean and max), counters, gauges and the prediction cache hit rate.
+    """
+    with _lock:
+        timers = {
+            name: {'count': count, 'total_s': total, 'mean_ms': total / count * 1000, 'max_ms': longest * 1000}
+            for name, (count, total, longest) in _timers.items()
+        }
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+    lookups = counters.get('cache_hits', 0) + counters.get('cache_misses', 0)
+    return {
+        'enabled': METRICS_ENABLED,
+        'timers': timers,
+        'counters': counters,
+        'gauges': gauges,
+        'cache_hit_rate': counters.get('cache_hits', 0) / lookups if lookups else None,
+    }
+
+def drain():
+    """
+    Returns the raw metrics of this process and resets them.
+    The pipeline's worker processes use it to send their timings back with each result.
+
+    Returns:
+    - tuple: The timers, counters and gauges.
+    """
+    with _lock:
+        drained = (dict(_timers), dict(_counters), dict(_gauges))
+        _timers.clear()
+        _counters.clear()
+        _gauges.clear()
+    return drained
+
+def merge(drained):
+    """
+    Adds metrics returned by `drain` in another process to the metrics of this process.
+
+    Parameters:
+    - drained (tuple): The timers, counters and gauges.
+    """
+    timers, counters, _ = drained
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        for name, (count, total, longest) in timers.items():
+            stats = _timers.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += count
+            stats[1] += total
+            stats[2] = max(stats[2], longest)
+        for name, amount in counters.items():
+            _counters[name] = _counters.get(name, 0) + amount
+
+def reset_metrics():
+    """
+    Clears all metrics.
+    """
+    drain()
+
+def render_prometheus():
+    """
+    Formats the metrics in the Prometheus text exposition format.
+    Timers are exported as summaries (`_seconds_count` and `_seconds_sum`) plus a `_seconds_max` gauge.
+
+    Returns:
+    - str: The metrics.
+    """
+    metrics = snapshot()
+    lines = []
+    for name, stats in sorted(metrics['timers'].items()):
+        metric = f'{METRICS_PREFIX}_{name}_seconds'
+        lines += [
+            f'# TYPE {metric} summary',
+            f'{metric}_count {stats["count"]}',
+            f'{metric}_sum {stats["total_s"]:.6f}',
+            f'# TYPE {metric}_max gauge',
+            f'{metric}_max {stats["max_ms"] / 1000:.6f}',
+        ]
+    for name, value in sorted(metrics['counters'].items()):
+        lines += [f'# TYPE {METRICS_PREFIX}_{name}_total counter', f'{METRICS_PREFIX}_{name}_total {value}']
+    for name, value in sorted(metrics['gauges'].items()):
+        lines += [f'# TYPE {METRICS_PREFIX}_{name} gauge', f'{METRICS_PREFIX}_{name} {value}']
+    return '\n'.join(lines) + '\n'
+
+def dump_metrics(path=None):
+    """
+    Writes the metrics in the Prometheus text format, for example for the node exporter's textfile collector.
+
+    Parameters:
+    - path (str, optional): The file to write. Defaults to `METRICS_FILE`; nothing is written if neither is set.
+    """
+    path = path or METRICS_FILE
+    if not path or not METRICS_ENABLED:
+        return
+    # Write to a temporary file first, so a scraper never reads a partial file. Its name is unique, so processes dumping at the same time
+    # do not write to each other's file.
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(path)), prefix=f'.{os.path.basename(path)}.', suffix='.tmp', delete=False) as f:
+        temporary_path = f.name
+        try:
+            f.write(render_prometheus())
+        except BaseException:
+            f.close()
+            os.unlink(temporary_path)
+            raise
+    try:
+        # Temporary files are only readable by their owner; a metrics file is read by the scraper's user
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port=None):
+    """
+    Serves the metrics at http://localhost:<port>/metrics on a background thread, once per process.
+
+    Parameters:
+    - port (int, optional): The port to listen on. Defaults to `METRICS_PORT`; no server is started if neither is set.
+
+    Returns:
+    - ThreadingHTTPServer: The server, or None if it is not enabled.
+    """
+    global _server
+    port = port or METRICS_PORT
+    if not port or not METRICS_ENABLED:
+        return None
+    with _lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(('127.0.0.1', port), _MetricsHandler)
+            except OSError as e:
+                print(f"Could not start the metrics server on port {port}: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+        return _server
@@ -0,0 +1,167 @@
+"""
+This module keeps the pre-trained models loaded once per process and shares them across Streamlit sessions and reruns.
+Models are loaded per inference engine (see the `engines` module), so the same model can be held as a Keras model and as a quantized TFLite model.
+They are built on first use, kept in least-recently-used order, and evicted when the configured memory cap would be exceeded.
+A model is built outside the registry's lock, so loaded models stay available while another one builds; threads asking for a model
+that is being built wait for that build instead of starting another.
+TensorFlow is only imported when the first model is built, so importing this module does not slow down app startup.
+The `start_background_warm_up` function imports TensorFlow and loads the models named in the `WARM_UP_MODELS` environment variable
+on a background thread, while the UI renders.
+"""
+
+import gc
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from engines import INFERENCE_ENGINE, create_engine
+from metrics import timer
+
+MODEL_NAMES = ['ResNet50', 'VGG16', 'InceptionV3']
+MODEL_MEMORY_LIMIT_MB = int(os.getenv('MODEL_MEMORY_LIMIT_MB', 1024))
+WARM_UP_MODELS = [name.strip() for name in os.getenv('WARM_UP_MODELS', '').split(',') if name.strip()]
+PRELOAD_TENSORFLOW = os.getenv('PRELOAD_TENSORFLOW', '1') != '0'
+
+# Engines keyed by (model name, engine name)
+_models = OrderedDict()
+_model_sizes = {}
+# Futures of the engines being built, keyed like `_models`
+_loading = {}
+_lock = threading.Lock()
+_warm_up_thread = None
+
+def _evict_models(limit_bytes):
+    """
+    Evicts the least recently used models until the loaded models fit within the limit.
+    The most recently used model is always kept, even if it alone exceeds the limit.
+
+    Parameters:
+    - limit_bytes (int): The memory limit in bytes.
+    """
+    evicted = False
+    while len(_models) > 1 and sum(_model_sizes.values()) > limit_bytes:
+        key, _ = _models.popitem(last=False)
+        _model_sizes.pop(key, None)
+        print(f"Evicted {key[0]} ({key[1]}) from the model registry.")
+        evicted = True
+    if evicted:
+        gc.collect()
+
+def get_engine(model_name, engine=None):
+    """
+    Returns the inference engine for the given model, loading it on first use.
+
+    Parameters:
+    - model_name (str): The name of the model to use for classification.
+    - engine (str, optional): The name of the inference engine. Defaults to `INFERENCE_ENGINE`.
+
+    Returns:
+    - KerasEngine or TFLiteEngine: The shared engine instance.
+
+    Raises:
+    - ValueError: If the model name or the engine is not supported.
+    """
+    if model_name not in MODEL_NAMES:
+        raise ValueError(f"Unsupported model: {model_name}")
+    key = (model_name, engine or INFERENCE_ENGINE)
+    with _lock:
+        if key in _models:
+            _models.move_to_end(key)
+            return _models[key]
+        future = _loading.get(key)
+        building = future is None
+        if building:
+            future = _loading[key] = Future()
+    if not building:
+        return future.result()
+    try:
+        with timer('model_load'):
+            loaded = create_engine(*key)
+    except BaseException as e:
+        with _lock:
+            _loading.pop(key, None)
+        future.set_exception(e)
+        raise
+    with _lock:
+        _loading.pop(key, None)
+        _models[key] = loaded
+        _model_sizes[key] = loaded.size_bytes
+        _evict_models(MODEL_MEMORY_LIMIT_MB * 1024 * 1024)
+    future.set_result(loaded)
+    return loaded
+
+def get_model(model_name):
+    """
+    Returns the full-precision Keras model for the given name, building it on first use.
+
+    Parameters:
+    - model_name (str): The name of the model to use for classification.
+
+    Returns:
+    - model: The shared Keras model instance.
+
+    Raises:
+    - ValueError: If the model name is not supported.
+    """
+    return get_engine(model_name, 'keras').model
+
+def warm_up_models(model_names=None, engine=None):
+    """
+    Loads the given models ahead of the first classification.
+
+    Parameters:
+    - model_names (list, optional): The names of the models to load. Defaults to `WARM_UP_MODELS`.
+    - engine (str, optional): The name of the inference engine. Defaults to `INFERENCE_ENGINE`.
+    """
+    for model_name in (WARM_UP_MODELS if model_names is None else model_names):
+        try:
+            get_engine(model_name, engine)
+        except ValueError as e:
+            print(f"Skipping warm-up: {e}")
+
+def preload_tensorflow():
+    """
+    Imports TensorFlow and the Keras applications, which takes several seconds on a cold start.
+    """
+    from tensorflow.keras import applications  # noqa: F401
+
+def start_background_warm_up(model_names=None):
+    """
+    Imports TensorFlow (unless `PRELOAD_TENSORFLOW` is disabled) and loads the warm-up models on a background thread, once per process.
+    A classification started before the thread finishes waits for the import in progress instead of starting another.
+
+    Parameters:
+    - model_names (list, optional): The names of the models to load. Defaults to `WARM_UP_MODELS`.
+
+    Returns:
+    - threading.Thread: The warm-up thread.
+    """
+    global _warm_up_thread
+    with _lock:
+        if _warm_up_thread is None:
+            def warm_up():
+                if PRELOAD_TENSORFLOW:
+                    preload_tensorflow()
+                warm_up_models(model_names)
+            _warm_up_thread = threading.Thread(target=warm_up, name='model-warm-up', daemon=True)
+            _warm_up_thread.start()
+        return _warm_up_thread
+
+def loaded_models():
+    """
+    Returns the loaded models, least recently used first.
+
+    Returns:
+    - list: The (model name, engine name) pairs of the loaded models.
+    """
+    with _lock:
+        return list(_models)
+
+def clear_models():
+    """
+    Removes all loaded models from the registry.
+    """
+    with _lock:
+        _models.clear()
+        _model_sizes.clear()
+    gc.collect()
@@ -0,0 +1,439 @@
+"""
+This module runs the classification pipeline without Streamlit, so it can be used from the command line as well as from the app.
+The pipeline runs its stages concurrently, connected by bounded queues so memory stays flat however many images are streamed:
+- A feeder thread reads the sources and submits them to a pool of worker processes, which decode and preprocess each image.
+- A single inference thread collects the preprocessed images into batches and classifies each batch with one forward pass
+  (one per model, run concurrently, when the model is `ensemble.ENSEMBLE`).
+- A single writer thread saves the results to the results store.
+Results are handed back to the calling thread, which is the only thread that calls the callbacks (Streamlit requires this).
+Timings recorded in the worker processes are sent back with each image and merged into this process's metrics.
+Progress is reported through two optional callbacks, which the Streamlit UI and the command line both implement:
+- on_result(name, thumbnail, classification_data): called once per classified image; the thumbnail is JPEG-encoded bytes.
+- on_progress(completed, total): called after each image; total is None when the number of images is not known up front.
+- on_duplicate(name, original_name): called for each image found to be a near-duplicate of an earlier one (see `dedup`).
+- on_saved(name, digest, result_id): called for each image after its results were handed to the results store (see `manifest`).
+"""
+
+import atexit
+import glob
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+from api import load_api_access_key
+from dedup import DEDUP_DISTANCE, DEDUP_MODE, DEDUP_MODES, BKTree, is_distinctive
+from embeddings import EMBEDDINGS_ENABLED
+from ensemble import ENSEMBLE, classify_ensemble, get_model_names
+from fetcher import KEEP_ORIGINAL_IMAGES, download, iter_completed, list_photos, photo_url
+from image_processing import MAX_BATCH_SIZE, compute_batch_size, predict_preprocessed, predictions_to_dataframe
+from ingest import get_decode_size, init_worker, prepare_image_in_worker
+from metrics import dump_metrics, increment, merge, set_gauge
+from preprocessing import allocate_batch
+from results_store import append_results, flush_results
+
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', os.cpu_count() or 1))
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 64))
+# Forking a process that already runs threads can copy a lock held by one of them, so workers are spawned by default
+PIPELINE_START_METHOD = os.getenv('PIPELINE_START_METHOD') or 'spawn'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+# Marks the end of the stream in the queues between the stages
+_DONE = object()
+
+# The shared process pools, keyed by number of workers
+_executors = {}
+_executors_lock = threading.Lock()
+
+def iter_image_files(pattern):
+    """
+    Lists the image files in a directory (recursively) or matching a glob pattern, without building the full list first.
+
+    Parameters:
+    - pattern (str): A directory, a file, or a glob pattern such as 'photos/**/*.jpg'.
+
+    Yields:
+    - str: The path of each image file.
+    """
+    if os.path.isdir(pattern):
+        for root, dirs, files in os.walk(pattern):
+            dirs.sort()
+            for file in sorted(files):
+                if file.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(root, file)
+    elif os.path.isfile(pattern):
+        yield pattern
+    else:
+        for path in glob.iglob(pattern, recursive=True):
+            if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                yield path
+
+def _put(q, item, stop):
+    """
+    Puts an item on a bounded queue, blocking while the queue is full, unless the pipeline is stopped.
+
+    Parameters:
+    - q (queue.Queue): The queue.
+    - item: The item to put.
+    - stop (threading.Event): Set when the pipeline is stopped.
+
+    Returns:
+    - bool: True if the item was put on the queue.
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _get(q, stop):
+    """
+    Takes an item from a queue, blocking while the queue is empty, unless the pipeline is stopped.
+
+    Parameters:
+    - q (queue.Queue): The queue.
+    - stop (threading.Event): Set when the pipeline is stopped.
+
+    Returns:
+    - The item, or `_DONE` if the pipeline was stopped.
+    """
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _DONE
+
+def _picklable_source(source):
+    """
+    Converts a source to something that can be sent to a worker process.
+
+    Parameters:
+    - source (bytes, str or file-like): The encoded image content, a file path, or a readable buffer.
+
+    Returns:
+    - bytes or str: The encoded image content or the file path.
+    """
+    if hasattr(source, 'getvalue'):
+        return source.getvalue()
+    if hasattr(source, 'read'):
+        return source.read()
+    return source
+
+def _start_workers(executor, workers):
+    """
+    Starts all the worker processes of a new pool.
+
+    Parameters:
+    - executor (ProcessPoolExecutor): The pool.
+    - workers (int): The number of worker processes.
+    """
+    in_main_thread = threading.current_thread() is threading.main_thread()
+    # Started with Ctrl+C ignored, the workers also ignore it while they import their modules, before `init_worker` runs.
+    # Signal handlers can only be changed from the main thread.
+    previous_handler = signal.signal(signal.SIGINT, signal.SIG_IGN) if in_main_thread else None
+    try:
+        # Each submission starts a worker while none is idle, so this starts all of them
+        for _ in range(workers):
+            executor.submit(os.getpid)
+    finally:
+        if in_main_thread:
+            signal.signal(signal.SIGINT, previous_handler)
+
+def _get_executor(workers):
+    """
+    Returns the pool that decodes and preprocesses images. Process pools are created on first use and shared by all runs
+    in this process, so the workers start and import their modules once rather than for every run. They are shut down at exit.
+
+    Parameters:
+    - workers (int): The number of worker processes. 0 runs the work on a single thread for this run only.
+
+    Returns:
+    - concurrent.futures.Executor: The pool.
+    """
+    if workers <= 0:
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix='prepare')
+    with _executors_lock:
+        if workers not in _executors:
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(PIPELINE_START_METHOD), initializer=init_worker)
+            _start_workers(executor, workers)
+            _executors[workers] = executor
+        return _executors[workers]
+
+def _discard_executor(executor):
+    """
+    Removes a pool whose worker died, so the next run creates a new one.
+
+    Parameters:
+    - executor (ProcessPoolExecutor): The broken pool.
+    """
+    with _executors_lock:
+        for workers, shared in list(_executors.items()):
+            if shared is executor:
+                del _executors[workers]
+    executor.shutdown(wait=False, cancel_futures=True)
+
+@atexit.register
+def shutdown_executors():
+    """
+    Shuts down the shared worker processes.
+    """
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def classify_sources(sources, model_name, batch_size=None, workers=PIPELINE_WORKERS, on_result=None, on_progress=None, total=None, engine=None, embed=EMBEDDINGS_ENABLED,
+                     dedup=DEDUP_MODE, dedup_distance=DEDUP_DISTANCE, on_duplicate=None, on_saved=None):
+    """
+    Classifies a stream of images and saves the results, running decoding, inference and persistence as overlapping stages.
+    The queues between the stages hold at most `PIPELINE_QUEUE_SIZE` images each, so the stream can be arbitrarily long.
+
+    Parameters:
+    - sources (iterable): (name, source) pairs, where source is the encoded image content, a file path, or a readable buffer.
+      The iterable is consumed on a background thread.
+    - model_name (str): The name of the model to use for classification, or `ensemble.ENSEMBLE` to run all models.
+    - batch_size (int, optional): The largest number of images per forward pass. Defaults to `compute_batch_size`.
+    - workers (int): The number of processes used to decode and preprocess images. Default is `PIPELINE_WORKERS`.
+    - on_result (callable, optional): Called as on_result(name, thumbnail, classification_data) for each classified image.
+    - on_progress (callable, optional): Called as on_progress(completed, total) after each image.
+    - total (int, optional): The number of images in the stream, if known.
+    - engine (str, optional): The name of the inference engine. Defaults to `INFERENCE_ENGINE`.
+    - embed (bool): Whether to also add the images' feature vectors to the embedding index. Default is `EMBEDDINGS_ENABLED`.
+    - dedup (str): What to do with near-duplicates of earlier images in the stream: 'off', 'skip' or 'link'. Default is `DEDUP_MODE`.
+    - dedup_distance (int): The largest Hamming distance between the hashes of near-duplicates. Default is `DEDUP_DISTANCE`.
+    - on_duplicate (callable, optional): Called as on_duplicate(name, original_name) for each near-duplicate.
+    - on_saved (callable, optional): Called as on_saved(name, digest, result_id) for each image once its results are in the results
+      store's write buffer. The digest is None if the image could not be read, and the result ID is None if no result was stored.
+
+    Returns:
+    - int: The number of images classified.
+
+    Raises:
+    - ValueError: If the dedup mode is not supported.
+    """
+    if dedup not in DEDUP_MODES:
+        raise ValueError(f"Unsupported dedup mode: {dedup}")
+    model_names = get_model_names(model_name)
+    batch_size = batch_size or min(compute_batch_size(name, total or MAX_BATCH_SIZE) for name in model_names)
+    stop = threading.Event()
+    errors = []
+    prepared = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    classified = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    finished = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+    def run_stage(stage, output):
+        try:
+            stage()
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(output, _DONE, stop)
+
+    def feed():
+        for name, source in sources:
+            future = executor.submit(prepare_image_in_worker, name, _picklable_source(source), model_names, collect_metrics)
+            if not _put(prepared, (name, future), stop):
+                future.cancel()
+                return
+
+    def infer():
+        buffers = {name: allocate_batch(batch_size, name) for name in model_names}
+        batch = []
+        # The hashes of the images classified so far, with their names and content hashes
+        duplicates = BKTree() if dedup != 'off' else None
+
+        def classify_pending():
+            names = [name for name, _, _, _, _ in batch]
+            digests = [classify_as for _, _, classify_as, _, _ in batch]
+            if model_name == ENSEMBLE:
+                results = classify_ensemble({name: buffer[:len(batch)] for name, buffer in buffers.items()}, digests, engine=engine, names=names, embed=embed)
+            else:
+                # Kept as tuples; a DataFrame is only built for the `on_result` callback
+                results = predict_preprocessed(buffers[model_name][:len(batch)], digests, model_name, engine=engine, names=names, embed=embed)
+            for (name, digest, _, thumbnail, duplicate_of), classification_data in zip(batch, results):
+                _put(classified, (name, digest, thumbnail, classification_data, duplicate_of), stop)
+            batch.clear()
+
+        while True:
+            # Classify what has been collected so far instead of waiting for more images to arrive, as in watch mode
+            if batch and prepared.empty():
+                classify_pending()
+            item = _get(prepared, stop)
+            if item is _DONE:
+                break
+            name, future = item
+            set_gauge('queue_depth_prepared', prepared.qsize())
+            # Classify what has been collected so far instead of waiting for an image that is still being decoded
+            if batch and not future.done():
+                classify_pending()
+            try:
+                (_, digest, images, thumbnail, image_hash), worker_metrics = future.result()
+            except BrokenExecutor:
+                # A worker died: the image was not read, and the run cannot continue
+                raise
+            except Exception as e:
+                print(f"Could not read image {name}: {e}")
+                increment('failed_images')
+                _put(classified, (name, None, None, None, None), stop)
+                continue
+            if worker_metrics is not None:
+                merge(worker_metrics)
+            duplicate_of = None
+            classify_as = digest
+            # Images with a (nearly) degenerate hash would match every other flat or evenly graded image, so they are always classified
+            if duplicates is not None and is_distinctive(image_hash, dedup_distance):
+                original = duplicates.nearest(image_hash, dedup_distance)
+                if original is None:
+                    duplicates.add(image_hash, (name, digest))
+                else:
+                    increment('duplicate_images')
+                    duplicate_of, original_digest = original
+                    if dedup == 'skip':
+                        _put(classified, (name, digest, None, None, duplicate_of), stop)
+                        continue
+                    # Classified under the earlier image's hash, so its results come from the batch or the prediction cache
+                    classify_as = original_digest
+            for image_model, image in images.items():
+                buffers[image_model][len(batch)] = image[0]
+            batch.append((name, digest, classify_as, thumbnail, duplicate_of))
+            if len(batch) == batch_size:
+                classify_pending()
+        if batch and not stop.is_set():
+            classify_pending()
+
+    def write():
+        while True:
+            item = _get(classified, stop)
+            if item is _DONE:
+                break
+            set_gauge('queue_depth_classified', classified.qsize())
+            name, _, _, classification_data, _ = item
+            result_id = append_results(classification_data, name, model_name) if classification_data is not None else None
+            _put(finished, (*item, result_id), stop)
+        flush_results()
+
+    executor = _get_executor(workers)
+    collect_metrics = isinstance(executor, ProcessPoolExecutor)
+    threads = [
+        threading.Thread(target=run_stage, args=(feed, prepared), name='pipeline-feed', daemon=True),
+        threading.Thread(target=run_stage, args=(infer, classified), name='pipeline-infer', daemon=True),
+        threading.Thread(target=run_stage, args=(write, finished), name='pipeline-write', daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    completed = 0
+    count = 0
+    try:
+        while True:
+            item = _get(finished, stop)
+            if item is _DONE:
+                break
+            set_gauge('queue_depth_finished', finished.qsize())
+            name, digest, thumbnail, classification_data, duplicate_of, result_id = item
+            completed += 1
+            if on_saved is not None:
+                on_saved(name, digest, result_id)
+            if duplicate_of is not None and on_duplicate is not None:
+                on_duplicate(name, duplicate_of)
+            if classification_data is not None:
+                count += 1
+                if on_result is not None:
+                    if isinstance(classification_data, list):
+                        classification_data = predictions_to_dataframe(classification_data)
+                    on_result(name, thumbnail, classification_data)
+            if on_progress is not None:
+                on_progress(completed, total)
+    finally:
+        # Stops the stages early if a callback raised; otherwise they have already finished
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if isinstance(executor, ProcessPoolExecutor):
+            # The pool is shared with other runs, so only the images this run left behind are cancelled
+            while True:
+                try:
+                    item = prepared.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _DONE:
+                    item[1].cancel()
+            if any(isinstance(error, BrokenExecutor) for error in errors):
+                _discard_executor(executor)
+        else:
+            executor.shutdown(wait=True, cancel_futures=True)
+        # A failure to write the metrics must not hide the outcome of the run
+        try:
+            dump_metrics()
+        except OSError as e:
+            print(f"Could not write the metrics: {e}")
+    if errors:
+        raise errors[0]
+    return count
+
+def fetch_and_classify(site, num_images, model_name, directory, filename, keep_originals=KEEP_ORIGINAL_IMAGES, on_result=None, on_progress=None, batch_size=None, engine=None, embed=EMBEDDINGS_ENABLED,
+                       dedup=DEDUP_MODE, dedup_distance=DEDUP_DISTANCE, on_duplicate=None):
+    """
+    Fetches images from Unsplash or Pexels, saves them to a directory, and classifies them.
+    Downloads run on the fetch thread pool while the images that have already arrived are classified.
+
+    Parameters:
+    - site (str): The site to fetch images from ('Unsplash' or 'Pexels').
+    - num_images (int): The number of images to fetch.
+    - model_name (str): The name of the model to use for classification, or `ensemble.ENSEMBLE` to run all models.
+    - directory (str): The directory where the fetched images are saved.
+    - filename (str): The prefix of the saved file names.
+    - keep_originals (bool): Whether to download full-resolution originals. Default is `KEEP_ORIGINAL_IMAGES`.
+    - on_result (callable, optional): Called as on_result(name, thumbnail, classification_data) for each classified image.
+    - on_progress (callable, optional): Called as on_progress(completed, total) after each batch.
+    - batch_size (int, optional): The number of images per batch. Defaults to `compute_batch_size`.
+    - engine (str, optional): The name of the inference engine. Defaults to `INFERENCE_ENGINE`.
+    - embed (bool): Whether to also add the images' feature vectors to the embedding index. Default is `EMBEDDINGS_ENABLED`.
+    - dedup (str): What to do with near-duplicates: 'off', 'skip' (also deletes the downloaded copy) or 'link'. Default is `DEDUP_MODE`.
+    - dedup_distance (int): The largest Hamming distance between the hashes of near-duplicates. Default is `DEDUP_DISTANCE`.
+    - on_duplicate (callable, optional): Called as on_duplicate(name, original_name) for each near-duplicate.
+
+    Returns:
+    - list: The paths of the saved images.
+    """
+    api_key = load_api_access_key(site)
+    if api_key is None:
+        return []
+    os.makedirs(directory, exist_ok=True)
+    target_size = get_decode_size(get_model_names(model_name))
+    image_paths = []
+
+    def downloaded_images():
+        photos = enumerate(list_photos(site, api_key, num_images), start=1)
+        fetched = iter_completed(lambda item: download(photo_url(site, item[1], target_size, keep_originals)), photos)
+        try:
+            for (index, _), content, error in fetched:
+                if error is not None:
+                    print(f"An error occurred while fetching images from {site}: {error}")
+                    continue
+                image_path = os.path.join(directory, f"{filename}_{int(time.time())}_{index}.jpg")
+                with open(image_path, 'wb') as f:
+                    f.write(content)
+                image_paths.append(image_path)
+                yield os.path.basename(image_path), content
+        except Exception as e:
+            print(f"An error occurred while fetching images from {site}: {e}")
+
+    def handle_duplicate(name, original_name):
+        if dedup == 'skip':
+            image_path = os.path.join(directory, name)
+            os.remove(image_path)
+            image_paths.remove(image_path)
+        if on_duplicate is not None:
+            on_duplicate(name, original_name)
+
+    classify_sources(
+        downloaded_images(), model_name, batch_size=batch_size, on_result=on_result, on_progress=on_progress, total=num_images,
+        engine=engine, embed=embed, dedup=dedup, dedup_distance=dedup_distance, on_duplicate=handle_duplicate,
+    )
+    return image_paths
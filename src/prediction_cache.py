@@ -0,0 +1,132 @@
+"""
+This module stores the top predictions for each classified image in a persistent SQLite cache.
+Entries are keyed by the image content hash, the model name, the preprocessing version and the number of predictions,
+so an image that has already been classified with the same model is not sent through the model again.
+The least recently used entries are evicted once the cache grows past `PREDICTION_CACHE_MAX_ENTRIES`.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from metrics import increment
+from preprocessing import PREPROCESSING_VERSION
+
+CACHE_DIR = os.getenv('CACHE_DIR', 'cache')
+PREDICTION_CACHE_FILE = os.path.join(CACHE_DIR, 'predictions.sqlite3')
+PREDICTION_CACHE_ENABLED = os.getenv('PREDICTION_CACHE_ENABLED', '1') != '0'
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv('PREDICTION_CACHE_MAX_ENTRIES', 100000))
+# Share of the entries kept when the cache is trimmed, so eviction does not run on every insert
+PREDICTION_CACHE_TRIM_RATIO = 0.9
+
+_local = threading.local()
+
+def _get_connection():
+    """
+    Returns the SQLite connection of the current thread, creating the cache file on first use.
+
+    Returns:
+    - sqlite3.Connection: The connection to the prediction cache.
+    """
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        connection = sqlite3.connect(PREDICTION_CACHE_FILE, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS predictions ('
+            'digest TEXT, model TEXT, version INTEGER, top INTEGER, predictions TEXT, accessed_at REAL, '
+            'PRIMARY KEY (digest, model, version, top))'
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS predictions_accessed_at ON predictions (accessed_at)')
+        _local.connection = connection
+    return connection
+
+def image_digest(data):
+    """
+    Computes the content hash used as the cache key of an image.
+
+    Parameters:
+    - data (bytes or PIL.Image): The encoded image file content, or a decoded image.
+
+    Returns:
+    - str: The hex SHA-256 digest.
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(data).hexdigest()
+    digest = hashlib.sha256(f'{data.mode}:{data.size}'.encode())
+    digest.update(data.tobytes())
+    return digest.hexdigest()
+
+def get_cached_predictions(digests, model_name, top):
+    """
+    Looks up the cached predictions for a list of images.
+
+    Parameters:
+    - digests (list): The content hashes of the images.
+    - model_name (str): The name of the model used for classification.
+    - top (int): The number of predictions per image.
+
+    Returns:
+    - dict: The cached (class ID, class name, score) tuples, keyed by digest. Images that are not cached are left out.
+    """
+    if not PREDICTION_CACHE_ENABLED or not digests:
+        return {}
+    connection = _get_connection()
+    unique_digests = list(set(digests))
+    cached = {}
+    # Stay below SQLite's limit on the number of query parameters
+    for start in range(0, len(unique_digests), 500):
+        chunk = unique_digests[start:start + 500]
+        rows = connection.execute(
+            f'SELECT digest, predictions FROM predictions WHERE model = ? AND version = ? AND top = ? '
+            f'AND digest IN ({",".join("?" * len(chunk))})',
+            [model_name, PREPROCESSING_VERSION, top, *chunk]
+        ).fetchall()
+        cached.update((digest, [tuple(row) for row in json.loads(predictions)]) for digest, predictions in rows)
+    increment('cache_hits', len(cached))
+    increment('cache_misses', len(unique_digests) - len(cached))
+    if cached:
+        with connection:
+            connection.executemany(
+                'UPDATE predictions SET accessed_at = ? WHERE digest = ? AND model = ? AND version = ? AND top = ?',
+                [(time.time(), digest, model_name, PREPROCESSING_VERSION, top) for digest in cached]
+            )
+    return cached
+
+def cache_predictions(predictions, model_name, top):
+    """
+    Stores the predictions for a list of images and evicts the least recently used entries if the cache is full.
+
+    Parameters:
+    - predictions (dict): The (class ID, class name, score) tuples of each image, keyed by digest.
+    - model_name (str): The name of the model used for classification.
+    - top (int): The number of predictions per image.
+    """
+    if not PREDICTION_CACHE_ENABLED or not predictions:
+        return
+    connection = _get_connection()
+    now = time.time()
+    with connection:
+        connection.executemany(
+            'INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?)',
+            [(digest, model_name, PREPROCESSING_VERSION, top, json.dumps(image_predictions), now)
+             for digest, image_predictions in predictions.items()]
+        )
+        count = connection.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+        if count > PREDICTION_CACHE_MAX_ENTRIES:
+            keep = int(PREDICTION_CACHE_MAX_ENTRIES * PREDICTION_CACHE_TRIM_RATIO)
+            connection.execute(
+                'DELETE FROM predictions WHERE rowid IN (SELECT rowid FROM predictions ORDER BY accessed_at LIMIT ?)',
+                (count - keep,)
+            )
+
+def clear_prediction_cache():
+    """
+    Removes all entries from the prediction cache.
+    """
+    if os.path.exists(PREDICTION_CACHE_FILE):
+        with _get_connection() as connection:
+            connection.execute('DELETE FROM predictions')
@@ -0,0 +1,131 @@
+"""
+This module prepares images for the pre-trained models.
+Each model has its own input size and normalization, matching the `preprocess_input` function Keras ships with the model.
+Images of any mode (grayscale, RGBA, palette) are converted to RGB, resized, and written into a preallocated batch array,
+which is then normalized in place with vectorized NumPy operations.
+"""
+
+import numpy as np
+from PIL import Image
+from metrics import timer
+
+# Bump this whenever the preprocessing changes, so results computed with the old preprocessing are not reused
+PREPROCESSING_VERSION = 1
+
+MODEL_PREPROCESSING = {
+    'ResNet50': {'size': (224, 224), 'mode': 'caffe'},
+    'VGG16': {'size': (224, 224), 'mode': 'caffe'},
+    'InceptionV3': {'size': (299, 299), 'mode': 'tf'},
+}
+DEFAULT_TARGET_SIZE = (224, 224)
+CAFFE_MEAN_BGR = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+BACKGROUND_COLOR = (255, 255, 255)
+RESAMPLE = Image.BILINEAR
+
+def get_preprocessing(model_name):
+    """
+    Returns the preprocessing settings for the given model.
+
+    Parameters:
+    - model_name (str): The name of the model to use for classification.
+
+    Returns:
+    - dict: The input size and normalization mode of the model.
+
+    Raises:
+    - ValueError: If the model name is not supported.
+    """
+    if model_name not in MODEL_PREPROCESSING:
+        raise ValueError(f"Unsupported model: {model_name}")
+    return MODEL_PREPROCESSING[model_name]
+
+def get_target_size(model_name):
+    """
+    Returns the input resolution expected by the model.
+
+    Parameters:
+    - model_name (str): The name of the model to use for classification.
+
+    Returns:
+    - tuple: The (width, height) of the model input.
+    """
+    return MODEL_PREPROCESSING.get(model_name, {'size': DEFAULT_TARGET_SIZE})['size']
+
+def to_rgb(image):
+    """
+    Converts an image of any mode to RGB.
+    Transparent pixels (RGBA, LA and palette images with transparency) are composited onto a white background.
+
+    Parameters:
+    - image (PIL.Image): The image to be converted.
+
+    Returns:
+    - image (PIL.Image): The RGB image.
+    """
+    if image.mode == 'RGB':
+        return image
+    if image.mode == 'P':
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    if image.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, BACKGROUND_COLOR)
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+def allocate_batch(batch_size, model_name):
+    """
+    Allocates an uninitialized batch array for the given model.
+
+    Parameters:
+    - batch_size (int): The number of images the array holds.
+    - model_name (str): The name of the model to use for classification.
+
+    Returns:
+    - np.array: A float32 array of shape (batch_size, height, width, 3).
+    """
+    width, height = get_preprocessing(model_name)['size']
+    return np.empty((batch_size, height, width, 3), dtype=np.float32)
+
+def normalize_batch(batch, mode):
+    """
+    Normalizes a batch of RGB or BGR pixel values in place.
+
+    Parameters:
+    - batch (np.array): The float32 batch array.
+    - mode (str): 'caffe' subtracts the ImageNet channel means from BGR pixels, 'tf' scales pixels to [-1, 1].
+    """
+    if mode == 'caffe':
+        batch -= CAFFE_MEAN_BGR
+    elif mode == 'tf':
+        batch /= 127.5
+        batch -= 1.0
+    else:
+        raise ValueError(f"Unsupported preprocessing mode: {mode}")
+
+def preprocess_batch(images, model_name, out=None):
+    """
+    Converts, resizes and normalizes a list of images into a single batch array for the given model.
+
+    Parameters:
+    - images (list): The PIL images to be processed.
+    - model_name (str): The name of the model to use for classification.
+    - out (np.array, optional): A preallocated array from `allocate_batch` to write into. It must hold at least len(images) images.
+
+    Returns:
+    - np.array: The preprocessed batch of shape (len(images), height, width, 3).
+    """
+    config = get_preprocessing(model_name)
+    if out is None:
+        out = allocate_batch(len(images), model_name)
+    batch = out[:len(images)]
+    with timer('preprocess'):
+        for i, image in enumerate(images):
+            image = to_rgb(image).resize(config['size'], RESAMPLE)
+            if config['mode'] == 'caffe':
+                # Caffe-style models expect BGR channel order
+                batch[i] = np.asarray(image)[..., ::-1]
+            else:
+                batch[i] = np.asarray(image)
+        normalize_batch(batch, config['mode'])
+    return batch
@@ -0,0 +1,112 @@
+"""
+This module keeps the classification results in an append-only SQLite store.
+Rows are buffered in memory and written in batches, so saving a result never reads or rewrites the results saved before it.
+The Excel workbook is produced on demand from this store by `results.export_results_to_excel`.
+"""
+
+import atexit
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+import pandas as pd
+from file_operations import output_dir
+from metrics import timer
+
+RESULTS_STORE_FILE = os.path.join(output_dir, 'results.sqlite3')
+RESULTS_FLUSH_ROWS = int(os.getenv('RESULTS_FLUSH_ROWS', 500))
+RESULT_COLUMNS = ['result_id', 'created_at', 'image_name', 'filename', 'model', 'rank', 'class_id', 'class_name', 'class_rating']
+
+_buffer = []
+_lock = threading.Lock()
+
+def _connect():
+    """
+    Opens the results store, creating it if it does not exist.
+
+    Returns:
+    - sqlite3.Connection: The connection to the results store.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    connection = sqlite3.connect(RESULTS_STORE_FILE, timeout=30)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS results ('
+        'result_id TEXT, created_at TEXT, image_name TEXT, filename TEXT, model TEXT, '
+        'rank INTEGER, class_id TEXT, class_name TEXT, class_rating REAL)'
+    )
+    return connection
+
+def append_results(classification_data, image_name=None, model_name=None):
+    """
+    Adds the classification results of one image to the write buffer, flushing it once it holds `RESULTS_FLUSH_ROWS` rows.
+
+    Parameters:
+    - classification_data (pd.DataFrame or list): The DataFrame containing the classification data, or the image's
+      (class ID, class name, score) tuples as returned by `image_processing.predict_preprocessed`.
+    - image_name (str, optional): The name of the classified image. Defaults to None.
+    - model_name (str, optional): The name of the model used for classification. Defaults to None.
+
+    Returns:
+    - str: The ID of the stored result.
+    """
+    result_id = uuid.uuid4().hex
+    now = datetime.now()
+    if isinstance(classification_data, pd.DataFrame):
+        predictions = zip(classification_data['Class ID'], classification_data['Class Name'], classification_data['Class Rating'])
+    else:
+        # Ratings in percent, as in `image_processing.predictions_to_dataframe`
+        predictions = [(class_id, class_name, round(score * 100, 2)) for class_id, class_name, score in classification_data]
+    predictions = list(predictions)
+    class_id, class_name, _ = predictions[0]
+    # Same naming scheme as the per-image entries of the original Excel output
+    filename = f"{now.strftime('%Y%m%d_%H%M%S')}_{class_id}_{class_name}.xlsx"
+    rows = [
+        (result_id, now.isoformat(timespec='seconds'), image_name, filename, model_name, rank, str(class_id), str(class_name), float(rating))
+        for rank, (class_id, class_name, rating) in enumerate(predictions, start=1)
+    ]
+    with _lock:
+        _buffer.extend(rows)
+        if len(_buffer) >= RESULTS_FLUSH_ROWS:
+            _flush_locked()
+    return result_id
+
+def _flush_locked():
+    """
+    Writes the buffered rows to the store. The caller must hold the buffer lock.
+    """
+    if not _buffer:
+        return
+    with timer('persist'):
+        connection = _connect()
+        try:
+            with connection:
+                connection.executemany(f'INSERT INTO results VALUES ({", ".join("?" * len(RESULT_COLUMNS))})', _buffer)
+        finally:
+            connection.close()
+    _buffer.clear()
+
+def flush_results():
+    """
+    Writes all buffered rows to the store.
+    """
+    with _lock:
+        _flush_locked()
+
+def load_results():
+    """
+    Loads all stored results, including rows that are still buffered.
+
+    Returns:
+    - pd.DataFrame: The stored results, one row per prediction, in the order they were saved.
+    """
+    flush_results()
+    if not os.path.exists(RESULTS_STORE_FILE):
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    connection = _connect()
+    try:
+        return pd.read_sql_query('SELECT * FROM results ORDER BY rowid', connection)
+    finally:
+        connection.close()
+
+atexit.register(flush_results)
@@ -3,8 +3,13 @@ This module is responsible for displaying the application's sidebar, which inclu
 It provides functionality to handle user interactions through the sidebar.
 """
 
+import pandas as pd
 import streamlit as st
 from instructions import instructions
+from ensemble import ENSEMBLE
+from fetcher import KEEP_ORIGINAL_IMAGES
+from metrics import snapshot
+from model_registry import MODEL_NAMES
 
 def display_sidebar():
     """
@@ -13,7 +18,7 @@ def display_sidebar():
     
     st.sidebar.markdown(instructions(), unsafe_allow_html=True)
     image_files = st.sidebar.file_uploader("Upload Images", type=['jpg', 'png', 'jpeg', 'PNG', 'GIF'], accept_multiple_files=True)
-    model_name_upload = st.sidebar.selectbox('Select Model for Uploaded Images', ['ResNet50', 'VGG16', 'InceptionV3', 'Other'])
+    model_name_upload = st.sidebar.selectbox('Select Model for Uploaded Images', [*MODEL_NAMES, ENSEMBLE])
 
     # Create two columns for the buttons
     col1, col2 = st.sidebar.columns(2)
@@ -30,7 +35,8 @@ def display_sidebar():
 
     num_images = max(st.sidebar.slider('Number of Images (Slider)', 0, 200, 0), st.sidebar.number_input('Number of Images (Input)', 0, 200, 0))
     site = st.sidebar.selectbox('Select the site to fetch images from:', ['Unsplash', 'Pexels', 'Both'])
-    model_name_fetch = st.sidebar.selectbox('Select Model for Fetched Images', ['ResNet50', 'VGG16', 'InceptionV3', 'Other'])
+    model_name_fetch = st.sidebar.selectbox('Select Model for Fetched Images', [*MODEL_NAMES, ENSEMBLE])
+    keep_originals = st.sidebar.checkbox('Keep original resolution', value=KEEP_ORIGINAL_IMAGES, help='Download full-size originals for archival instead of the smallest size the model needs.')
 
     # Create two columns for the fetch and reset buttons
     col3, col4 = st.sidebar.columns(2)
@@ -41,4 +47,25 @@ def display_sidebar():
     # Place the "Reset" button in the second column with a unique key
     reset_images = col4.button('Reset', key='reset_images_button')
 
-    return image_files, model_name_upload, classify, reset, num_images, site, model_name_fetch, fetch_classify, reset_images
+    return image_files, model_name_upload, classify, reset, num_images, site, model_name_fetch, fetch_classify, reset_images, keep_originals
+
+def display_performance_panel():
+    """
+    Displays a collapsible "Performance" panel at the bottom of the sidebar with the timings, counters and queue depths
+    collected by the `metrics` module since the app started.
+    """
+    metrics = snapshot()
+    with st.sidebar.expander("Performance"):
+        if not metrics['enabled']:
+            st.caption("Metrics are disabled (METRICS_ENABLED=0).")
+            return
+        if not metrics['timers'] and not metrics['counters']:
+            st.caption("No images have been processed yet.")
+            return
+        if metrics['timers']:
+            timers = pd.DataFrame.from_dict(metrics['timers'], orient='index')[['count', 'mean_ms', 'max_ms', 'total_s']]
+            st.dataframe(timers.round(2))
+        if metrics['cache_hit_rate'] is not None:
+            st.metric("Prediction cache hit rate", f"{metrics['cache_hit_rate']:.0%}")
+        for name, value in sorted({**metrics['counters'], **metrics['gauges']}.items()):
+            st.text(f"{name}: {value}")
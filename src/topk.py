@@ -0,0 +1,106 @@
+"""
+This module turns the class probabilities of a batch into its top predictions with a handful of NumPy operations.
+It replaces Keras's `decode_predictions`, which sorts all 1000 classes of each image in Python and builds a list of tuples per image.
+The ImageNet class IDs and names are loaded once per process into NumPy arrays. The top classes of the whole batch are selected with
+`np.argpartition`, and only those are sorted. The result is kept in columns (`TopKPredictions`), and is turned into per-image tuples
+or a DataFrame only when they are needed.
+"""
+
+import json
+import threading
+import numpy as np
+import pandas as pd
+
+# The class index file used by `decode_predictions`, which Keras caches in ~/.keras/models
+CLASS_INDEX_URL = 'https://storage.googleapis.com/download.tensorflow.org/data/imagenet_class_index.json'
+CLASS_INDEX_HASH = 'c2c37ea517e94d9795004a39431a14cb'
+
+_labels = None
+_labels_lock = threading.Lock()
+
+def load_class_labels():
+    """
+    Returns the ImageNet class IDs and names, downloading the class index on first use.
+
+    Returns:
+    - tuple: The class IDs (np.array of str) and class names (np.array of str), indexed by class.
+    """
+    global _labels
+    with _labels_lock:
+        if _labels is None:
+            from tensorflow.keras.utils import get_file
+            path = get_file('imagenet_class_index.json', CLASS_INDEX_URL, cache_subdir='models', file_hash=CLASS_INDEX_HASH)
+            with open(path) as f:
+                class_index = json.load(f)
+            entries = [class_index[str(index)] for index in range(len(class_index))]
+            _labels = np.array([class_id for class_id, _ in entries]), np.array([class_name for _, class_name in entries])
+        return _labels
+
+class TopKPredictions:
+    """
+    The top predictions of a batch, in columns with one entry per image and rank, ordered by image and then by rank:
+    - image (np.array of int32): The position of the image in the batch.
+    - class_index (np.array of int16): The ImageNet class.
+    - score (np.array of float32): The probability of the class.
+    """
+
+    def __init__(self, image, class_index, score, top):
+        self.image = image
+        self.class_index = class_index
+        self.score = score
+        self.top = top
+
+    def __len__(self):
+        return len(self.image) // self.top if self.top else 0
+
+    def to_lists(self):
+        """
+        Returns the predictions of each image as (class ID, class name, score) tuples, the format of the prediction cache.
+
+        Returns:
+        - list: One list of tuples per image, best first.
+        """
+        class_ids, class_names = load_class_labels()
+        rows = list(zip(class_ids[self.class_index].tolist(), class_names[self.class_index].tolist(), self.score.tolist()))
+        return [rows[start:start + self.top] for start in range(0, len(rows), self.top)]
+
+    def to_dataframe(self):
+        """
+        Returns the predictions of the whole batch as one DataFrame, with ratings in percent as in `predictions_to_dataframe`.
+
+        Returns:
+        - pd.DataFrame: The Image, Rank, Class ID, Class Name and Class Rating of each prediction.
+        """
+        class_ids, class_names = load_class_labels()
+        return pd.DataFrame({
+            'Image': self.image,
+            'Rank': np.tile(np.arange(1, self.top + 1, dtype=np.int16), len(self)),
+            'Class ID': class_ids[self.class_index],
+            'Class Name': class_names[self.class_index],
+            'Class Rating': (self.score.astype(np.float64) * 100).round(2),
+        })
+
+def decode_top_k(probabilities, top=5):
+    """
+    Selects the top classes of each image in a batch.
+
+    Parameters:
+    - probabilities (np.array): The class probabilities of shape (images, classes).
+    - top (int): The number of predictions per image. Default is 5.
+
+    Returns:
+    - TopKPredictions: The top predictions, best first for each image.
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    count, classes = probabilities.shape
+    top = min(top, classes)
+    # Only the `top` selected classes of each image are sorted
+    candidates = np.argpartition(-probabilities, top - 1, axis=1)[:, :top]
+    scores = np.take_along_axis(probabilities, candidates, axis=1)
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return TopKPredictions(
+        np.repeat(np.arange(count, dtype=np.int32), top),
+        np.take_along_axis(candidates, order, axis=1).astype(np.int16).ravel(),
+        np.take_along_axis(scores, order, axis=1).ravel(),
+        top,
+    )
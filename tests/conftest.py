@@ -0,0 +1,13 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+# The modules import each other by name, as when the app is started from the `src` directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+# The app keeps its output, caches and API usage relative to the working directory, so the tests run in a scratch directory
+_workdir = tempfile.mkdtemp(prefix='imageclassification-tests-')
+os.chdir(_workdir)
+atexit.register(shutil.rmtree, _workdir, ignore_errors=True)
@@ -0,0 +1,44 @@
+import sqlite3
+import pytest
+import api
+
+@pytest.fixture
+def usage(tmp_path, monkeypatch):
+    monkeypatch.setattr(api, 'API_USAGE_FILE', str(tmp_path / 'api_usage.sqlite3'))
+    monkeypatch.setattr(api, 'API_QUOTA_BLOCK_SIZE', 10)
+    monkeypatch.setattr(api, 'SITE_USAGE_LIMITS', {'Unsplash': 25, 'Pexels': 25})
+    monkeypatch.setattr(api, '_reserved', {})
+    monkeypatch.setattr(api, '_site_limits', {})
+    reservations = []
+    reserve_block = api._reserve_block
+    monkeypatch.setattr(api, '_reserve_block', lambda site: reservations.append(reserve_block(site)) or reservations[-1])
+    return reservations
+
+def test_calls_are_counted_in_blocks(usage):
+    assert all(api.check_api_usage('Unsplash') for _ in range(25))
+    assert not api.check_api_usage('Unsplash')
+    # The file is only read when a block runs out
+    assert usage == [10, 10, 5, 0]
+    assert api.check_api_usage('Pexels')
+
+def test_processes_share_the_budget(usage, monkeypatch):
+    for _ in range(3):
+        assert api.check_api_usage('Unsplash')
+    # Another process starts with nothing reserved, and gets the quota left after this process's block
+    monkeypatch.setattr(api, '_reserved', {})
+    assert sum(api.check_api_usage('Unsplash') for _ in range(30)) == 15
+
+def test_expired_reservations_are_released(usage, monkeypatch):
+    assert all(api.check_api_usage('Unsplash') for _ in range(25))
+    connection = sqlite3.connect(api.API_USAGE_FILE)
+    with connection:
+        connection.execute('UPDATE reservations SET reserved_at = reserved_at - ?', (api.API_USAGE_WINDOW + 1,))
+    connection.close()
+    assert api.check_api_usage('Unsplash')
+
+def test_site_headers_cap_the_reserved_calls(usage):
+    assert api.check_api_usage('Unsplash')
+    api.update_api_usage_from_headers('Unsplash', {'X-Ratelimit-Remaining': '2'})
+    assert api._reserved['Unsplash'] == 2
+    api.update_api_usage_from_headers('Unsplash', {'X-Ratelimit-Remaining': '0'})
+    assert not api.check_api_usage('Unsplash')
@@ -0,0 +1,59 @@
+import numpy as np
+from PIL import Image
+from dedup import DEDUP_DISTANCE, BKTree, dhash, hamming_distance, is_distinctive
+
+def make_image(pixels):
+    return Image.fromarray(np.asarray(pixels, dtype=np.uint8).reshape(64, 72))
+
+def test_flat_and_graded_images_are_not_distinctive():
+    flat = make_image(np.full((64, 72), 128))
+    gradient = make_image(np.tile(np.linspace(0, 255, 72), (64, 1)))
+    assert not is_distinctive(dhash(flat))
+    assert not is_distinctive(dhash(gradient))
+
+def test_nearly_flat_images_are_not_distinctive():
+    # A flat image with a brighter corner only sets a few bits of its hash
+    pixels = np.full((64, 72), 128)
+    pixels[:8, :8] = 160
+    image_hash = dhash(make_image(pixels))
+    assert 0 < bin(image_hash).count('1') <= DEDUP_DISTANCE
+    assert not is_distinctive(image_hash)
+    # The same within the distance of all ones
+    inverted = (1 << 64) - 1 ^ image_hash
+    assert not is_distinctive(inverted)
+
+def test_textured_images_are_distinctive():
+    pixels = np.random.default_rng(0).integers(0, 256, (64, 72))
+    assert is_distinctive(dhash(make_image(pixels)))
+
+def test_distance_sets_the_margin():
+    image_hash = 0b111
+    assert not is_distinctive(image_hash, distance=3)
+    assert is_distinctive(image_hash, distance=2)
+
+def test_nearest_finds_the_closest_hash():
+    tree = BKTree()
+    tree.add(0b0000, 'a')
+    tree.add(0b0111, 'b')
+    tree.add(0b1111, 'c')
+    assert tree.nearest(0b0110, 4) == 'b'
+    assert tree.nearest(0b1110, 1) == 'c'
+    assert tree.nearest(0b0001, 0) is None
+    assert len(tree) == 3
+
+def test_nearest_matches_a_linear_search():
+    rng = np.random.default_rng(0)
+    hashes = [int(value) for value in rng.integers(0, 1 << 62, 500)]
+    tree = BKTree()
+    for index, image_hash in enumerate(hashes):
+        tree.add(image_hash, index)
+    for query in hashes[:50]:
+        # Flips a few bits of a stored hash
+        query ^= int(rng.integers(0, 1 << 62)) & int(rng.integers(0, 1 << 62)) & int(rng.integers(0, 1 << 62))
+        distances = [hamming_distance(query, image_hash) for image_hash in hashes]
+        closest = min(distances)
+        nearest = tree.nearest(query, 12)
+        if closest > 12:
+            assert nearest is None
+        else:
+            assert distances[nearest] == closest
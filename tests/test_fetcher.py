@@ -0,0 +1,57 @@
+import fetcher
+
+class FakeResponse:
+    headers = {}
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        pass
+
+def fake_site(monkeypatch, available):
+    calls = []
+
+    def http_get(url, headers=None, params=None):
+        calls.append(dict(params))
+        if 'pexels' in url:
+            start = (params['page'] - 1) * params['per_page']
+            return FakeResponse({'photos': [{'id': i} for i in range(start, min(start + params['per_page'], available))]})
+        return FakeResponse([{'id': i} for i in range(params['count'])])
+
+    monkeypatch.setattr(fetcher, 'http_get', http_get)
+    monkeypatch.setattr(fetcher, 'check_api_usage', lambda site: True)
+    monkeypatch.setattr(fetcher, 'update_api_usage_from_headers', lambda site, headers: None)
+    return calls
+
+def test_pexels_pages_keep_their_size(monkeypatch):
+    calls = fake_site(monkeypatch, available=1000)
+    photos = list(fetcher.list_photos('Pexels', 'key', 170))
+    # A smaller last page would start inside the photos already listed
+    assert [photo['id'] for photo in photos] == list(range(170))
+    assert [(call['page'], call['per_page']) for call in calls] == [(1, 80), (2, 80), (3, 80)]
+
+def test_pexels_small_request_is_one_page(monkeypatch):
+    calls = fake_site(monkeypatch, available=1000)
+    assert len(list(fetcher.list_photos('Pexels', 'key', 12))) == 12
+    assert [(call['page'], call['per_page']) for call in calls] == [(1, 12)]
+
+def test_pexels_stops_when_the_results_run_out(monkeypatch):
+    calls = fake_site(monkeypatch, available=100)
+    assert len(list(fetcher.list_photos('Pexels', 'key', 500))) == 100
+    assert len(calls) == 3
+
+def test_unsplash_requests_at_most_the_maximum_count(monkeypatch):
+    calls = fake_site(monkeypatch, available=1000)
+    assert len(list(fetcher.list_photos('Unsplash', 'key', 70))) == 70
+    assert [call['count'] for call in calls] == [30, 30, 10]
+
+def test_pages_are_requested_lazily(monkeypatch):
+    calls = fake_site(monkeypatch, available=1000)
+    photos = fetcher.list_photos('Pexels', 'key', 500)
+    for _ in range(80):
+        next(photos)
+    assert len(calls) == 1
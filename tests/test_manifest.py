@@ -0,0 +1,65 @@
+import os
+import pytest
+from PIL import Image
+from manifest import Manifest
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = Manifest('ResNet50', str(tmp_path / 'manifest.sqlite3'))
+    yield manifest
+    manifest.close()
+
+def write_image(path, color=(255, 0, 0)):
+    Image.new('RGB', (8, 8), color).save(path)
+    return os.path.abspath(path)
+
+def test_rescan_only_lists_changed_files(tmp_path, manifest):
+    photos = tmp_path / 'photos'
+    photos.mkdir()
+    first = write_image(photos / 'first.jpg')
+    second = write_image(photos / 'second.png')
+    (photos / 'notes.txt').write_text('not an image')
+    assert sorted(manifest.changed_files([str(photos)])) == sorted([first, second])
+    manifest.record(first, 'digest-1', 'result-1')
+    manifest.record(second, 'digest-2', 'result-2')
+    manifest.flush()
+    assert list(manifest.changed_files([str(photos)])) == []
+    write_image(photos / 'second.png', (0, 0, 255))
+    stat = os.stat(second)
+    os.utime(second, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    third = write_image(photos / 'third.jpg')
+    assert sorted(manifest.changed_files([str(photos)])) == sorted([second, third])
+
+def test_unrecorded_files_are_retried(tmp_path, manifest):
+    photos = tmp_path / 'photos'
+    photos.mkdir()
+    path = write_image(photos / 'image.jpg')
+    # Listed but never recorded, as when a run is interrupted
+    assert list(manifest.changed_files([str(photos)])) == [path]
+    assert list(manifest.changed_files([str(photos)])) == [path]
+
+def test_unreadable_files_are_retried_once_changed(tmp_path, manifest):
+    photos = tmp_path / 'photos'
+    photos.mkdir()
+    path = str(photos / 'broken.jpg')
+    with open(path, 'wb') as f:
+        f.write(b'not a jpeg')
+    assert list(manifest.changed_files([str(photos)])) == [os.path.abspath(path)]
+    manifest.record(os.path.abspath(path), None, None)
+    manifest.flush()
+    assert list(manifest.changed_files([str(photos)])) == []
+    write_image(path)
+    assert list(manifest.changed_files([str(photos)])) == [os.path.abspath(path)]
+
+def test_records_are_kept_per_model(tmp_path, manifest):
+    photos = tmp_path / 'photos'
+    photos.mkdir()
+    path = write_image(photos / 'image.jpg')
+    list(manifest.changed_files([str(photos)]))
+    manifest.record(path, 'digest', 'result')
+    manifest.flush()
+    other = Manifest('VGG16', str(tmp_path / 'manifest.sqlite3'))
+    try:
+        assert list(other.changed_files([str(photos)])) == [path]
+    finally:
+        other.close()
@@ -0,0 +1,61 @@
+import threading
+from concurrent.futures import BrokenExecutor
+from io import BytesIO
+import pytest
+from PIL import Image
+import pipeline
+
+def encode_image(color):
+    output = BytesIO()
+    Image.new('RGB', (32, 32), color).save(output, format='JPEG')
+    return output.getvalue()
+
+@pytest.fixture(autouse=True)
+def fake_model(monkeypatch):
+    # Inference runs in this process, so the model can be replaced without TensorFlow
+    def predict_preprocessed(batch, digests, model_name, engine=None, names=None, embed=False):
+        return [[('n00000001', 'thing', 0.9)] for _ in digests]
+    monkeypatch.setattr(pipeline, 'predict_preprocessed', predict_preprocessed)
+
+def run(sources, workers, saved):
+    return pipeline.classify_sources(
+        sources, 'ResNet50', batch_size=4, workers=workers, embed=False, dedup='off',
+        on_saved=lambda name, digest, result_id: saved.append((name, digest, result_id)),
+    )
+
+def test_unreadable_images_are_reported_and_skipped():
+    sources = [(f'image-{index}', encode_image((index * 20, 0, 0))) for index in range(6)]
+    sources.insert(3, ('broken', b'not an image'))
+    saved = []
+    assert run(sources, 0, saved) == 6
+    assert len(saved) == 7
+    assert [(digest, result_id) for name, digest, result_id in saved if name == 'broken'] == [(None, None)]
+    assert all(digest and result_id for name, digest, result_id in saved if name != 'broken')
+
+def test_a_dead_worker_fails_the_run():
+    killed = threading.Event()
+    saved = []
+
+    def sources():
+        yield 'first', encode_image((255, 0, 0))
+        # The other images are only submitted once the worker is gone
+        killed.wait(30)
+        for index in range(4):
+            yield f'image-{index}', encode_image((0, index * 50, 0))
+
+    def on_saved(name, digest, result_id):
+        saved.append((name, digest, result_id))
+        if not killed.is_set():
+            for process in list(pipeline._executors[1]._processes.values()):
+                process.kill()
+                process.join()
+            killed.set()
+
+    with pytest.raises(BrokenExecutor):
+        pipeline.classify_sources(sources(), 'ResNet50', batch_size=1, workers=1, embed=False, dedup='off', on_saved=on_saved)
+    # No image is recorded as unreadable because its worker died
+    assert all(digest is not None for _, digest, _ in saved)
+    # The broken pool is replaced by the next run
+    saved.clear()
+    assert run([('again', encode_image((0, 0, 255)))], 1, saved) == 1
+    assert saved[0][1] is not None
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+import topk
+
+@pytest.fixture
+def labels(monkeypatch):
+    class_ids = np.array([f'n{index:08d}' for index in range(1000)])
+    class_names = np.array([f'class_{index}' for index in range(1000)])
+    monkeypatch.setattr(topk, 'load_class_labels', lambda: (class_ids, class_names))
+
+def test_top_classes_are_sorted(labels):
+    probabilities = np.random.default_rng(0).dirichlet(np.ones(1000), size=8).astype(np.float32)
+    predictions = topk.decode_top_k(probabilities, top=5).to_lists()
+    assert len(predictions) == 8
+    for image, rows in zip(probabilities, predictions):
+        expected = np.argsort(-image, kind='stable')[:5]
+        assert [class_id for class_id, _, _ in rows] == [f'n{index:08d}' for index in expected]
+        assert [score for _, _, score in rows] == pytest.approx(image[expected].tolist())
+
+def test_dataframe_ranks_each_image(labels):
+    probabilities = np.random.default_rng(1).dirichlet(np.ones(1000), size=3)
+    frame = topk.decode_top_k(probabilities, top=4).to_dataframe()
+    assert frame['Image'].tolist() == [0] * 4 + [1] * 4 + [2] * 4
+    assert frame['Rank'].tolist() == [1, 2, 3, 4] * 3
+
+def test_matches_decode_predictions():
+    tf = pytest.importorskip('tensorflow')
+    probabilities = np.random.default_rng(2).dirichlet(np.ones(1000), size=4).astype(np.float32)
+    expected = tf.keras.applications.imagenet_utils.decode_predictions(probabilities, top=5)
+    predictions = topk.decode_top_k(probabilities, top=5).to_lists()
+    for rows, expected_rows in zip(predictions, expected):
+        assert [row[:2] for row in rows] == [tuple(row[:2]) for row in expected_rows]
+        assert [row[2] for row in rows] == pytest.approx([float(row[2]) for row in expected_rows])